@@ -0,0 +1,190 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Controle de admissão dos jobs nas filas dos workers.
+#
+# As filas dos workers descartam as mensagens após o TTL ('x-message-ttl'). Quando os workers não dão conta da carga,
+# os jobs novos ficam na fila até expirarem e o cliente só descobre isso ao consultar o status, após o TTL. Para falhar
+# rápido, a API estima o tempo de espera de um job novo em cada fila e recusa o job (HTTP 429 com 'Retry-After') quando
+# a espera prevista ultrapassa o TTL.
+#
+# A espera prevista é a profundidade da fila dividida pela taxa de atendimento:
+#
+# - Profundidade: quantidade de mensagens obtida por um 'queue_declare' passivo (no máximo uma consulta por fila a cada
+#   'intervalo_consulta' segundos), ajustada com os jobs enviados e concluídos por esta instância desde a consulta.
+# - Taxa de atendimento: média móvel exponencial (EWMA) dos jobs concluídos por segundo (retornos recebidos no
+#   '/retorno'), calculada em janelas de 'janela' segundos. Quando a fila não está acumulando, a taxa observada é só
+#   um limite inferior da capacidade, por isso nestas janelas a estimativa nunca é reduzida.
+#
+# OBS.: com várias instâncias da API, cada uma só observa os retornos que recebe, então a taxa estimada é menor que a
+# real e o controle fica mais conservador.
+# --------------------------------------------------------------------------------------------------------------------
+import math
+import threading
+from time import time
+
+
+class ControleAdmissao:
+    """
+    Estima a espera dos jobs em cada fila e decide se um job novo pode ser enfileirado.
+    """
+    def __init__(self, publicador, espera_maxima: float = 90.0, intervalo_consulta: float = 1.0,
+                 janela: float = 5.0, alfa: float = 0.3, retry_sem_consumidores: int = 10, logger=None):
+        """
+        :param publicador: Instância de 'PoolPublicadores' utilizada para consultar as filas.
+        :param espera_maxima: Espera máxima prevista, em segundos, para aceitar um job (normalmente o TTL da fila).
+                              Se for 0, o controle fica desligado.
+        :param intervalo_consulta: Intervalo mínimo, em segundos, entre as consultas da profundidade de uma fila.
+        :param janela: Duração, em segundos, de cada janela de medição da taxa de atendimento.
+        :param alfa: Peso da janela mais recente na média móvel da taxa de atendimento.
+        :param retry_sem_consumidores: 'Retry-After', em segundos, sugerido quando a fila está sem consumidores.
+        :param logger: Logger utilizado para registrar os eventos do controle.
+        """
+        self._publicador = publicador
+        self.espera_maxima = espera_maxima
+        self._intervalo_consulta = intervalo_consulta
+        self._janela = janela
+        self._alfa = alfa
+        self._retry_sem_consumidores = retry_sem_consumidores
+        self._logger = logger
+        self._lock = threading.Lock()
+
+        # Estado de cada fila: profundidade e consumidores da última consulta, jobs enviados/concluídos desde a
+        # consulta, contagem da janela de medição atual e taxa de atendimento estimada (jobs/s)
+        self._filas = {}
+
+        self.stats = {'admitidos': 0, 'recusados': 0, 'recusados_sem_consumidores': 0, 'falhas_consulta': 0}
+
+    @property
+    def ativo(self) -> bool:
+        return self.espera_maxima > 0
+
+    def _estado(self, queue_name: str) -> dict:
+        estado = self._filas.get(queue_name)
+
+        if estado is None:
+            estado = {'mensagens': 0, 'consumidores': None, 'consultado_em': 0.0, 'enviados': 0, 'concluidos': 0,
+                      'inicio_janela': time(), 'concluidos_janela': 0, 'acumulando': False, 'taxa': None}
+            self._filas[queue_name] = estado
+
+        return estado
+
+    def registrar_envio(self, queue_name: str, quantidade: int = 1):
+        """
+        Registra os jobs enviados por esta instância para uma fila.
+        """
+        with self._lock:
+            self._estado(queue_name)['enviados'] += quantidade
+
+    def registrar_conclusao(self, queue_name: str):
+        """
+        Registra a conclusão de um job (retorno do worker) e atualiza a taxa de atendimento da fila.
+        """
+        if not queue_name:
+            return
+
+        agora = time()
+
+        with self._lock:
+            estado = self._estado(queue_name)
+            estado['concluidos'] += 1
+            estado['concluidos_janela'] += 1
+            decorrido = agora - estado['inicio_janela']
+
+            if decorrido < self._janela:
+                return
+
+            taxa_janela = estado['concluidos_janela'] / decorrido
+
+            if estado['taxa'] is None:
+                estado['taxa'] = taxa_janela
+            elif estado['acumulando']:
+                estado['taxa'] = self._alfa * taxa_janela + (1 - self._alfa) * estado['taxa']
+            else:
+                # Sem fila acumulada, a taxa observada é a taxa de chegada, não a capacidade dos workers
+                estado['taxa'] = max(estado['taxa'], taxa_janela)
+
+            estado['inicio_janela'] = agora
+            estado['concluidos_janela'] = 0
+            estado['acumulando'] = self._profundidade(estado) > max(estado['consumidores'] or 0, 1)
+
+    @staticmethod
+    def _profundidade(estado: dict) -> int:
+        return max(estado['mensagens'] + estado['enviados'] - estado['concluidos'], 0)
+
+    def _atualizar_profundidade(self, queue_name: str, estado: dict):
+        if time() - estado['consultado_em'] < self._intervalo_consulta:
+            return
+
+        try:
+            info = self._publicador.consultar_fila(queue_name, usar_cache=False)
+        except BaseException as e:
+            # Sem a consulta, usa a última profundidade conhecida. A falha real aparece no enfileiramento
+            self.stats['falhas_consulta'] += 1
+
+            if self._logger:
+                self._logger.error(f"Não foi possível consultar a profundidade da fila '{queue_name}': "
+                                   f"{e.__class__} - {e}")
+            return
+
+        with self._lock:
+            estado['mensagens'] = info['mensagens']
+            estado['consumidores'] = info['consumidores']
+            estado['consultado_em'] = time()
+            estado['enviados'] = 0
+            estado['concluidos'] = 0
+
+            if estado['mensagens'] > max(estado['consumidores'], 1):
+                estado['acumulando'] = True
+
+    def avaliar(self, queue_name: str, quantidade: int = 1):
+        """
+        Verifica se novos jobs podem ser enviados para uma fila. Pode fazer uma consulta ao servidor de filas, por isso
+        deve ser executado fora do event loop.
+            :param queue_name: Nome da fila.
+            :param quantidade: Quantidade de jobs que serão enviados.
+            :return: None, se os jobs foram admitidos, ou o tempo sugerido (em segundos) para o cliente tentar
+                     novamente ('Retry-After').
+        """
+        if not self.ativo:
+            return None
+
+        with self._lock:
+            estado = self._estado(queue_name)
+
+        self._atualizar_profundidade(queue_name, estado)
+
+        with self._lock:
+            profundidade = self._profundidade(estado) + quantidade
+            taxa = estado['taxa']
+
+            if estado['consumidores'] == 0:
+                # Os jobs ficariam na fila até expirar, a menos que um worker se conecte antes
+                self.stats['recusados'] += 1
+                self.stats['recusados_sem_consumidores'] += 1
+                return self._retry_sem_consumidores
+
+            if not taxa or profundidade / taxa <= self.espera_maxima:
+                self.stats['admitidos'] += 1
+                return None
+
+            self.stats['recusados'] += 1
+
+            # Tempo para a fila baixar até uma profundidade em que os jobs voltam a ser admitidos
+            return max(math.ceil((profundidade - taxa * self.espera_maxima) / taxa), 1)
+
+    def resumo(self) -> dict:
+        """
+        Retorna as estatísticas do controle e a estimativa atual de cada fila.
+        """
+        with self._lock:
+            ret = dict(self.stats)
+            ret['espera_maxima_seg'] = self.espera_maxima
+            ret['filas'] = {}
+
+            for queue_name, estado in self._filas.items():
+                profundidade = self._profundidade(estado)
+                taxa = estado['taxa']
+                ret['filas'][queue_name] = {'profundidade': profundidade, 'consumidores': estado['consumidores'],
+                                            'taxa_atendimento': round(taxa, 3) if taxa else None,
+                                            'espera_prevista_seg': round(profundidade / taxa, 2) if taxa else None}
+
+            return ret
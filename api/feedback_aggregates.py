@@ -0,0 +1,431 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Agregados diários de feedback dos modelos.
+#
+# O 'get_feedback' precisava contar e ler todos os jobs de 'predict' com feedback do período (até 30000 documentos
+# completos) para montar as listas de labels. Agora, cada modelo tem um documento por dia, na coleção
+# 'col_feedback_daily', com os contadores do dia e a quantidade de cada par (label predito, label do feedback):
+#
+#   {'_id': "<modelo>|<aaaa-mm-dd>", 'model_name': ..., 'dia': "aaaa-mm-dd", 'predict_done': ..., 'jobs_feedback': ...,
+#    'pares': {<hash do par>: {'pred': ..., 'true': ..., 'n': ...}}, 'lotes': [<id do lote>, ...]}
+#
+# Os documentos são atualizados com '$inc', que é atômico no banco de dados, a partir dos retornos de 'predict'
+# concluídos ('/retorno' e fila de resultados), dos jobs atendidos pelo cache de resultados e do '/feedback'. Os
+# incrementos são acumulados em memória e gravados em lotes a cada 'intervalo_ms', por isso a consulta pode não
+# enxergar os últimos instantes. Assim, um 'get_feedback' de 90 dias lê no máximo 90 documentos pequenos.
+#
+# As gravações podem ser repetidas sem contar duas vezes (ex.: falha de conexão depois de parte do lote ser aplicada):
+#
+# - Os incrementos de 'predict_done' e os feedbacks levam o id do lote (ou da operação), guardado em 'lotes' (os
+#   últimos 'LOTES_GUARDADOS'), e só são aplicados se o id ainda não estiver no documento.
+# - Cada 'predict' concluído é contado uma só vez por job: antes do incremento, o id do lote é gravado no marcador do
+#   job (coleção 'col_feedback_jobs', com expiração) somente se o job ainda não foi contado, e o incremento considera
+#   apenas os jobs marcados pelo próprio lote. Assim, um retorno reentregue pela fila de resultados não é contado de
+#   novo.
+# - O feedback de cada job é gravado separadamente. Antes, o hash do feedback é trocado no marcador do job (mesma
+#   coleção 'col_feedback_jobs') somente se o hash guardado for o do feedback anterior do job (ou se o job ainda não
+#   tiver feedback contado). O agregado do dia só é alterado se a troca foi feita pela própria operação, por isso um
+#   '/feedback' repetido, concorrente ou regravado não é contado de novo. Os marcadores de feedback expiram depois de
+#   'ttl_feedback_dias' sem alterações; um job com feedback anterior e mais antigo que isso pode não ter mais o
+#   marcador, e só nesse caso a falta do marcador é aceita como feedback anterior contado.
+#
+# Os dias anteriores à criação dos agregados (dia registrado no documento '__inicio__') não possuem agregados e
+# continuam sendo calculados a partir dos jobs.
+# --------------------------------------------------------------------------------------------------------------------
+import orjson
+import threading
+from uuid import uuid4
+from hashlib import sha1
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Documento que guarda o primeiro dia que possui agregados
+ID_INICIO = "__inicio__"
+
+# Quantidade de ids dos últimos lotes gravados guardados em cada documento (evita aplicar um lote repetido)
+LOTES_GUARDADOS = 100
+
+
+def dia_timestamp(timestamp: float) -> str:
+    """
+    Retorna o dia (aaaa-mm-dd, no horário local, igual às datas do 'get_feedback') de um timestamp.
+    """
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+def chave_par(pred, true) -> str:
+    """
+    Gera a chave de um par de labels. Os labels podem ter qualquer tipo aceito no JSON, por isso a chave é o hash do
+    par serializado (os nomes dos campos no MongoDB não podem conter '.' nem começar com '$').
+    """
+    return sha1(orjson.dumps([pred, true])).hexdigest()[:20]
+
+
+def chave_feedback(feedback: list) -> str:
+    """
+    Gera a chave (hash) dos labels de um feedback, guardada no agregado do dia para saber qual feedback foi contado.
+    """
+    return sha1(orjson.dumps(feedback)).hexdigest()[:20]
+
+
+class AgregadosFeedback:
+    """
+    Mantém os agregados diários de feedback dos modelos, gravando os incrementos em lotes, em uma thread própria.
+    """
+    def __init__(self, colecao, colecao_marcadores, intervalo_ms: float = 1000, ttl_marcadores_dias: float = 7,
+                 ttl_feedback_dias: float = 365, logger=None, ao_falhar=None):
+        """
+        :param colecao: Coleção do pymongo onde os agregados são gravados.
+        :param colecao_marcadores: Coleção do pymongo onde ficam os marcadores dos jobs já contados.
+        :param intervalo_ms: Intervalo, em milissegundos, entre as gravações dos incrementos acumulados.
+        :param ttl_marcadores_dias: Tempo, em dias, que o marcador de um 'predict' contado é mantido.
+        :param ttl_feedback_dias: Tempo, em dias, que o marcador do feedback de um job é mantido após a última
+                                  alteração.
+        :param logger: Logger utilizado para registrar os eventos dos agregados.
+        :param ao_falhar: Função chamada quando acontece uma falha na gravação dos incrementos.
+        """
+        self._colecao = colecao
+        self._marcadores = colecao_marcadores
+        self._ttl_marcadores = timedelta(days=ttl_marcadores_dias)
+        self._ttl_feedback = timedelta(days=ttl_feedback_dias)
+        self.intervalo = intervalo_ms / 1000
+        self._logger = logger
+        self._ao_falhar = ao_falhar
+
+        # Incrementos pendentes por documento: _id -> {'model_name', 'dia', 'inc': {campo: incremento}, 'jobs': [job_id
+        # dos 'predict' que só podem ser contados uma vez]}
+        self._pendentes = {}
+
+        # Feedbacks pendentes, gravados um a um e na ordem de chegada: lista de (_id, {'model_name', 'dia', 'inc',
+        # 'set', 'job_id', 'timestamp', 'chave', 'chave_anterior', 'id_op'})
+        self._feedbacks = []
+
+        # Gravações que falharam e serão repetidas (com o mesmo id do lote) antes das novas
+        self._reenviar = []
+        self._lock = threading.Lock()
+        self.stats = {'lotes': 0, 'documentos_gravados': 0, 'repetidos': 0, 'falhas': 0, 'consultas': 0}
+
+        self._colecao.create_index([("model_name", 1), ("dia", 1)], name="idx_modelo_dia")
+        self._marcadores.create_index([("expira", 1)], name="idx_expira", expireAfterSeconds=0)
+
+        # Os agregados começam a valer no dia seguinte à primeira execução, pois os jobs de hoje anteriores a este
+        # momento não foram contados
+        inicio = dia_timestamp((datetime.now() + timedelta(days=1)).timestamp())
+        self._colecao.update_one({'_id': ID_INICIO}, {'$setOnInsert': {'dia': inicio}}, upsert=True)
+        self.inicio = self._colecao.find_one({'_id': ID_INICIO})['dia']
+
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    def _incrementar(self, model_name: str, timestamp: float, inc: dict, job_id: str = None):
+        dia = dia_timestamp(timestamp)
+
+        if not model_name or dia < self.inicio:
+            return  # Dias sem agregados são calculados a partir dos jobs
+
+        _id = f"{model_name}|{dia}"
+
+        with self._lock:
+            entrada = self._pendentes.get(_id)
+
+            if entrada is None:
+                entrada = {'model_name': model_name, 'dia': dia, 'inc': {}, 'jobs': []}
+                self._pendentes[_id] = entrada
+
+            if job_id:
+                entrada['jobs'].append(job_id)  # Contado na gravação, se o job ainda não foi contado
+                return
+
+            for campo, valor in inc.items():
+                entrada['inc'][campo] = entrada['inc'].get(campo, 0) + valor
+
+    def registrar_predict(self, model_name: str, timestamp: float, job_id: str = None):
+        """
+        Registra um job de 'predict' concluído ('Done').
+            :param model_name: Nome do modelo.
+            :param timestamp: Timestamp da criação do job (define o dia).
+            :param job_id: Job ID. Se for informado, o job só é contado uma vez, mesmo que seja registrado de novo
+                           (ex.: retorno reentregue pela fila de resultados).
+        """
+        self._incrementar(model_name, timestamp, {'predict_done': 1}, job_id)
+
+    def registrar_feedback(self, job_id: str, model_name: str, timestamp: float, response: list, feedback: list,
+                           feedback_anterior: list = None):
+        """
+        Registra o feedback de um job. Caso o job já tivesse feedback, os pares anteriores são descontados. Se o
+        feedback contado no agregado não for o anterior (ex.: feedback repetido), a gravação é ignorada.
+            :param job_id: Job ID do job.
+            :param model_name: Nome do modelo.
+            :param timestamp: Timestamp da criação do job (define o dia).
+            :param response: Labels preditos pelo modelo.
+            :param feedback: Labels informados no feedback.
+            :param feedback_anterior: Labels do feedback anterior do job, caso exista.
+        """
+        inc = {}
+        campos = {}
+
+        if feedback_anterior:
+            for pred, true in zip(response, feedback_anterior):
+                chave = chave_par(pred, true)
+                inc[f"pares.{chave}.n"] = inc.get(f"pares.{chave}.n", 0) - 1
+        else:
+            inc['jobs_feedback'] = 1
+
+        for pred, true in zip(response, feedback):
+            chave = chave_par(pred, true)
+            inc[f"pares.{chave}.n"] = inc.get(f"pares.{chave}.n", 0) + 1
+            campos[f"pares.{chave}.pred"] = pred
+            campos[f"pares.{chave}.true"] = true
+
+        dia = dia_timestamp(timestamp)
+
+        if not model_name or dia < self.inicio:
+            return  # Dias sem agregados são calculados a partir dos jobs
+
+        entrada = {'model_name': model_name, 'dia': dia, 'inc': {campo: valor for campo, valor in inc.items() if valor},
+                   'set': campos, 'job_id': job_id, 'timestamp': timestamp, 'chave': chave_feedback(feedback),
+                   'chave_anterior': chave_feedback(feedback_anterior) if feedback_anterior else None,
+                   'id_op': uuid4().hex}
+
+        with self._lock:
+            self._feedbacks.append((f"{model_name}|{dia}", entrada))
+
+    def consultar(self, model_name: str, dia_inicial: str, dia_final: str, limite_labels: int = 0) -> dict:
+        """
+        Soma os agregados de um modelo em um intervalo de dias.
+            :param model_name: Nome do modelo.
+            :param dia_inicial: Dia inicial (aaaa-mm-dd).
+            :param dia_final: Dia final (aaaa-mm-dd), inclusive.
+            :param limite_labels: Quantidade máxima de labels (0 não limita). Os dias mais recentes são somados
+                                  primeiro; no dia em que o limite é atingido, as quantidades dos pares são reduzidas
+                                  na mesma proporção e os dias anteriores ficam de fora.
+            :return: Dicionário contendo: 'predict_done', 'jobs_feedback', 'pares' (lista de tuplas (label predito,
+                     label do feedback, quantidade)) e 'labels_deixados' (quantidade de labels que ficaram de fora por
+                     causa do limite).
+        """
+        docs = self._colecao.find({'model_name': model_name, 'dia': {'$gte': dia_inicial, '$lte': dia_final}},
+                                  {'lotes': 0}, hint="idx_modelo_dia").sort("dia", -1)
+        resultado = {'predict_done': 0, 'jobs_feedback': 0, 'pares': [], 'labels_deixados': 0}
+        pares = {}
+        qtd_labels = 0
+
+        for doc in docs:
+            resultado['predict_done'] += doc.get('predict_done', 0)
+            resultado['jobs_feedback'] += doc.get('jobs_feedback', 0)
+            pares_dia = {chave: par for chave, par in doc.get('pares', {}).items() if par.get('n', 0) > 0}
+            labels_dia = sum(par['n'] for par in pares_dia.values())
+            fator = 1
+
+            if limite_labels and qtd_labels + labels_dia > limite_labels:
+                fator = max(limite_labels - qtd_labels, 0) / labels_dia
+
+            for chave, par in pares_dia.items():
+                n = par['n'] if fator == 1 else int(par['n'] * fator)
+                resultado['labels_deixados'] += par['n'] - n
+                qtd_labels += n
+
+                if not n:
+                    continue
+
+                if chave in pares:
+                    pares[chave][2] += n
+                else:
+                    pares[chave] = [par.get('pred'), par.get('true'), n]
+
+        resultado['pares'] = [tuple(par) for par in pares.values()]
+        self.stats['consultas'] += 1
+        return resultado
+
+    def _marcar_predicts(self, lote: list) -> dict:
+        """
+        Marca os jobs de 'predict' dos incrementos do lote que ainda não foram contados. Um job já marcado mantém o id
+        do lote que o contou, por isso a marcação repetida de um mesmo lote retorna o mesmo resultado.
+            :param lote: Lista de (_id, entrada) do lote.
+            :return: Dicionário com a quantidade de jobs contados por id do lote.
+        """
+        entradas = [entrada for _, entrada in lote if entrada.get('jobs')]
+
+        if not entradas:
+            return {}
+
+        expira = datetime.now() + self._ttl_marcadores
+
+        try:
+            self._marcadores.bulk_write([UpdateOne({'_id': job_id},
+                                                   [{'$set': {'predict': {'$ifNull': ["$predict", entrada['id_lote']]},
+                                                              'expira': {'$ifNull': ["$expira", expira]}}}],
+                                                   upsert=True)
+                                         for entrada in entradas for job_id in entrada['jobs']], ordered=False)
+        except BulkWriteError as e:
+            # Chave duplicada: outra instância da API criou o marcador do mesmo job ao mesmo tempo e ele já foi contado
+            outros = [erro for erro in e.details.get('writeErrors', []) if erro.get('code') != 11000]
+
+            if outros or e.details.get('writeConcernErrors'):
+                raise RuntimeError(f"Falha na gravação dos marcadores dos jobs: {outros[:1]}") from e
+
+        contados = {}
+        job_ids = [job_id for entrada in entradas for job_id in entrada['jobs']]
+
+        for doc in self._marcadores.find({'_id': {'$in': job_ids},
+                                          'predict': {'$in': [entrada['id_lote'] for entrada in entradas]}},
+                                         {'predict': 1}):
+            contados[doc['predict']] = contados.get(doc['predict'], 0) + 1
+
+        return contados
+
+    def _marcar_feedbacks(self, lote: list) -> set:
+        """
+        Troca, na ordem do lote, o hash do feedback guardado no marcador de cada job, somente se o hash guardado for o
+        do feedback anterior. Cada marcador guarda os ids das últimas operações que o trocaram, por isso a marcação
+        repetida de uma mesma operação não troca o hash de novo e é reconhecida como aplicada.
+            :param lote: Lista de (_id, entrada) do lote.
+            :return: Conjunto com os ids das operações de feedback que podem ser aplicadas no agregado do dia.
+        """
+        entradas = [entrada for _, entrada in lote if 'job_id' in entrada]
+
+        if not entradas:
+            return set()
+
+        agora = datetime.now()
+        limite_marcador = (agora - self._ttl_feedback).timestamp()
+        ops = []
+
+        for entrada in entradas:
+            if entrada['chave_anterior'] is None:
+                condicao = {'$eq': [{'$type': "$feedback"}, "missing"]}
+            elif entrada['timestamp'] < limite_marcador:
+                # O marcador do feedback anterior pode ter expirado
+                condicao = {'$in': [{'$ifNull': ["$feedback", None]}, [entrada['chave_anterior'], None]]}
+            else:
+                condicao = {'$eq': ["$feedback", entrada['chave_anterior']]}
+
+            ops_job = {'$ifNull': ["$ops", []]}
+            trocar = {'$and': [condicao, {'$not': [{'$in': [entrada['id_op'], ops_job]}]}]}
+            ops.append(UpdateOne({'_id': entrada['job_id']},
+                                 [{'$set': {'trocar': trocar}},
+                                  {'$set': {'feedback': {'$cond': ["$trocar", entrada['chave'], "$feedback"]},
+                                            'ops': {'$cond': ["$trocar",
+                                                              {'$slice': [{'$concatArrays': [ops_job,
+                                                                                             [entrada['id_op']]]},
+                                                                          -LOTES_GUARDADOS]},
+                                                              "$ops"]},
+                                            'expira': {'$max': ["$expira", agora + self._ttl_feedback]}}},
+                                  {'$unset': "trocar"}], upsert=True))
+
+        # Em ordem, para que os feedbacks de um mesmo job sejam trocados na ordem em que chegaram
+        self._marcadores.bulk_write(ops, ordered=True)
+
+        aplicadas = set()
+
+        for doc in self._marcadores.find({'_id': {'$in': [entrada['job_id'] for entrada in entradas]}}, {'ops': 1}):
+            aplicadas.update(doc.get('ops', []))
+
+        return aplicadas
+
+    @staticmethod
+    def _operacao(_id: str, entrada: dict) -> UpdateOne:
+        if 'job_id' in entrada:
+            # Feedback de um job (o marcador do job já foi trocado): só é aplicado se a operação ainda não foi gravada
+            atualizacao = {'$push': {'lotes': {'$each': [entrada['id_op']], '$slice': -LOTES_GUARDADOS}}}
+
+            if entrada['set']:
+                atualizacao['$set'] = entrada['set']
+
+            if entrada['inc']:
+                atualizacao['$inc'] = entrada['inc']
+
+            return UpdateOne({'_id': _id, 'lotes': {'$ne': entrada['id_op']}}, atualizacao)
+
+        # Incrementos acumulados: só são aplicados se o lote ainda não foi gravado no documento
+        return UpdateOne({'_id': _id, 'lotes': {'$ne': entrada['id_lote']}},
+                         {'$inc': entrada['inc'],
+                          '$push': {'lotes': {'$each': [entrada['id_lote']], '$slice': -LOTES_GUARDADOS}}})
+
+    def _gravar(self, lote: list):
+        posicoes = []  # Posição, no lote, de cada operação da gravação ordenada
+
+        try:
+            # Cria os documentos que ainda não existem; as atualizações abaixo não fazem upsert, pois a condição de
+            # cada uma pode não ser atendida justamente por já ter sido aplicada
+            documentos = {_id: entrada for _id, entrada in lote}
+            self._colecao.bulk_write([UpdateOne({'_id': _id}, {'$setOnInsert': {'model_name': entrada['model_name'],
+                                                                                 'dia': entrada['dia']}}, upsert=True)
+                                      for _id, entrada in documentos.items()], ordered=False)
+
+            # Os 'predict' já contados (ex.: retorno reentregue) não entram no incremento e os feedbacks que não
+            # trocaram o marcador do job (ex.: feedback repetido) não são aplicados
+            contados = self._marcar_predicts(lote)
+            aplicadas = self._marcar_feedbacks(lote)
+            operacoes = []
+
+            for i, (_id, entrada) in enumerate(lote):
+                if 'job_id' in entrada:
+                    if entrada['id_op'] not in aplicadas:
+                        continue
+                else:
+                    inc = dict(entrada['inc'])
+                    inc['predict_done'] = inc.get('predict_done', 0) + contados.get(entrada['id_lote'], 0)
+                    inc = {campo: valor for campo, valor in inc.items() if valor}
+
+                    if not inc:
+                        continue
+
+                    entrada = dict(entrada, inc=inc)
+
+                operacoes.append(self._operacao(_id, entrada))
+                posicoes.append(i)
+
+            # Em ordem, para que os feedbacks de um mesmo job sejam aplicados na ordem em que chegaram
+            ret = self._colecao.bulk_write(operacoes, ordered=True) if operacoes else None
+        except BulkWriteError as e:
+            # As operações anteriores à que falhou foram aplicadas e a que falhou não é repetida (erro do documento).
+            # As seguintes não foram executadas e são gravadas novamente. Se a falha foi na criação dos documentos,
+            # antes da gravação ordenada, o lote inteiro é gravado novamente
+            self.stats['falhas'] += 1
+            erros = e.details.get('writeErrors', [])
+            indice = posicoes[erros[0]['index']] if erros and posicoes else -1
+
+            if self._logger:
+                self._logger.error(f"Falha na gravação de um agregado de feedback: {erros[:1]}")
+
+            if self._ao_falhar:
+                self._ao_falhar()
+
+            with self._lock:
+                self._reenviar = lote[indice + 1:] + self._reenviar
+
+            return
+        except BaseException as e:
+            # As gravações podem ser repetidas sem contar duas vezes, por isso o lote inteiro é gravado novamente
+            self.stats['falhas'] += 1
+
+            if self._logger:
+                self._logger.error(f"Falha na gravação dos agregados de feedback ({len(lote)} operação(ões)). As "
+                                   f"operações serão gravadas novamente: {e.__class__} - {e}")
+
+            if self._ao_falhar:
+                self._ao_falhar()
+
+            with self._lock:
+                self._reenviar = lote + self._reenviar
+
+            threading.Event().wait(1)  # Evita martelar o banco enquanto ele está indisponível
+            return
+
+        self.stats['lotes'] += 1
+        self.stats['documentos_gravados'] += ret.modified_count if ret else 0
+        self.stats['repetidos'] += len(lote) - (ret.matched_count if ret else 0)
+
+    def _executar(self):
+        while True:
+            threading.Event().wait(self.intervalo)
+
+            with self._lock:
+                # As gravações que falharam vão primeiro, mantendo a ordem dos feedbacks de cada job
+                lote = self._reenviar + self._feedbacks
+                lote += [(_id, dict(entrada, id_lote=uuid4().hex)) for _id, entrada in self._pendentes.items()]
+                self._reenviar = []
+                self._feedbacks = []
+                self._pendentes = {}
+
+            if lote:
+                self._gravar(lote)
@@ -12,49 +12,347 @@
 # - A qualquer momento, o cliente que fez a requisição pode consultar o status através do endpoint '/status'. Se
 #   o worker já tiver atendido e retornado, o resultado é enviado para o cliente.
 # --------------------------------------------------------------------------------------------------------------------
-from time import time
+import orjson
+import base64
+import asyncio
+import numpy as np
+from time import time, sleep
 from datetime import datetime
+from contextlib import asynccontextmanager
 from typing import Optional, Union, Annotated
-from fastapi import FastAPI, Request, Header, HTTPException, status, Security, Body
+from fastapi import FastAPI, Request, Header, HTTPException, status, Security, Body, Query, WebSocket, \
+    WebSocketDisconnect
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel
-from utils import ObjectId, TOKEN, STK_VERSION, LOGGER, CLIENT_BD, ADVWORKID_CRED, TOKEN_WORKERS, enfileirar_job, \
-    generate_hash, insert_doc, validate_request, retrieve_doc, update_doc, save_queue_registry, \
-    get_queue_registry_startup, retrieve_docs_feedback, validate_params, gerar_arquivo_erro
-
-
-# Obtém o registro das filas no início da API
+from pydantic import BaseModel, ConfigDict
+from utils import TOKEN, STK_VERSION, LOGGER, ADVWORKID_CRED, TOKEN_WORKERS, enfileirar_job, \
+    enfileirar_jobs_lote, generate_hash, generate_hashes, insert_job, insert_jobs, validate_request, retrieve_job, \
+    retrieve_jobs, update_job, save_queue_registry, get_queue_registry_startup, retrieve_docs_feedback, \
+    validate_params, gerar_arquivo_erro, executar_bloqueante, marcar_jobs_running, fila_metodo, definir_versao_modelo, \
+    NOTIFICADOR, CONSUMIDOR_RESPOSTAS, REGISTRO_FILAS, CACHE_RESULTADOS, POOL_PUBLICADOR, BUFFER_JOBS, \
+    CONTROLE_ADMISSAO, CONSUMIDOR_RESULTADOS, AGREGADOS_FEEDBACK, FEEDBACK_MODEL_INTERVAL_SECONDS, \
+    FEEDBACK_GLOBAL_INTERVAL_SECONDS, ARMAZEM_PAYLOADS, CLAIM_CHECK_MAX_AGE_SECONDS, FEEDBACK_ENCODED_LABELS, \
+    FEEDBACK_MAX_LABELS, RESULTS_FLUSH_TIMEOUT_SECONDS
+from result_cache import hash_features
+from results_consumer import FILA_RESULTADOS
+
+
+# Obtém o registro das filas no início da API. O registro é mantido atualizado com as alterações feitas por outras
+# instâncias da API (avisos via servidor de filas e verificação periódica da versão do registro)
 QUEUE_REG = get_queue_registry_startup()
 
-# Parâmetros para fazer o reload do registro das filas para obter as atualizações feitas por outras instâncias da API
-QUEUE_REG_RELOAD = {'next_reload': 0.0, 'delay_seconds': 300}
-
 # Ajuda a controlar a periodicidade de feedbacks solicitados globalmente e por modelo.
 NEXT_FEEDBACKS_MODELOS = {'next_global_feedback': -1.0}
 
 # TTL em milissegundos para jobs
 TTL_MS = 90000
 
-def reload_queue_registry():
+# Tempo máximo, em milissegundos, que uma requisição do '/inference' pode aguardar pelo resultado (modo síncrono)
+MAX_WAIT_MS = 30000
+
+# Quantidade máxima de requisições de inferência aceitas em um único lote ('/inference/batch')
+MAX_JOBS_LOTE = 1000
+
+
+def preparar_job(req_info: dict, job_id: str, timestamp: float) -> dict:
     """
-    Lê novamente o registro de filas do banco de dados.
+    Acrescenta na requisição as informações necessárias para o worker processar o job e retorna o documento que
+    será persistido com o status 'Queued'.
+        :param req_info: Requisição recebida do cliente.
+        :param job_id: Job ID gerado para a requisição.
+        :param timestamp: Timestamp de criação do job.
+        :return: Documento do job que será persistido no banco de dados.
     """
-    global QUEUE_REG
-    col = CLIENT_BD["col_queue_registry"]
-    obj_id = ObjectId("000000000000aaaabbbbffff")  # Fixa o _id para facilitar nas buscas e evitar duplicidade de filas
+    model_name = req_info['model_name']
+    method = req_info['method']
 
-    try:
-        result = col.find_one({"_id": obj_id})
+    # Adiciona o job_id
+    req_info['job_id'] = job_id
 
-        if result:
-            QUEUE_REG = result['queue_registry']
-            LOGGER.info("Reload do QUEUE registry -> OK")
-        else:
-            LOGGER.error("O registro de filas não foi encontrado!")
-            gerar_arquivo_erro()
-    except BaseException as e:
-        LOGGER.error(f"Falha ao buscar o registro de filas. Mensagem: {e.__class__} - {e}")
-        gerar_arquivo_erro()
+    # Inclui o token para que o ml worker possa utilizar na atualização de status e retorno
+    req_info['token'] = f"Bearer {TOKEN_WORKERS}"
+
+    # Inclui o timestamp para apuração dos tempos de fila e processamento do job
+    req_info['datetime'] = timestamp
+
+    # Inclui TTL no job (para que o /status saiba quando expirar)
+    req_info['ttl'] = TTL_MS
+
+    # Coloca o status do job como 'Queued'
+    dados_add = {'job_id': job_id, 'model_name': model_name, 'model_version': "", 'method': method,
+                 'datetime': timestamp, 'ttl': TTL_MS, 'status': 'Queued', 'queue_response_time_sec': -1,
+                 'total_response_time_sec': -1, 'response': ""}
+
+    # Chaves específicas para o predict
+    if method == "predict":
+        dados_add['feedback'] = ""
+        dados_add['has_feedback'] = False
+
+    return dados_add
+
+
+def preparar_job_cache(req_info: dict, job_id: str, model_version: str, response) -> dict:
+    """
+    Gera o documento de um job de 'predict' atendido pelo cache de resultados, já com o status 'Done'.
+        :param req_info: Requisição recebida do cliente.
+        :param job_id: Job ID gerado para a requisição.
+        :param model_version: Versão do modelo que gerou o resultado guardado no cache.
+        :param response: Resultado guardado no cache.
+        :return: Documento do job que será persistido no banco de dados.
+    """
+    dados_add = preparar_job(req_info, job_id, time())
+    dados_add['status'] = "Done"
+    dados_add['model_version'] = model_version
+    dados_add['response'] = response
+    dados_add['queue_response_time_sec'] = 0
+    dados_add['total_response_time_sec'] = 0
+    dados_add['from_cache'] = True
+    return dados_add
+
+
+def montar_recusa(model_name: str, method: str, retry_after: int) -> dict:
+    """
+    Monta a resposta de um job recusado pelo controle de admissão.
+        :param model_name: Nome do modelo.
+        :param method: Método solicitado.
+        :param retry_after: Tempo, em segundos, sugerido para o cliente tentar novamente.
+        :return: Dicionário com o status e a mensagem de erro.
+    """
+    msg = f"Os workers do modelo '{model_name}' estão sobrecarregados e o job expiraria na fila antes de ser " \
+          f"atendido. Tente novamente em {retry_after} segundo(s)."
+    return {'job_id': "n/a", 'model_name': model_name, 'method': method, 'status': "Error", 'response': msg,
+            'retry_after': retry_after}
+
+
+def resposta_sobrecarga(conteudo: dict, retry_after: int) -> ORJSONResponse:
+    """
+    Gera a resposta HTTP 429 (Too Many Requests), com o cabeçalho 'Retry-After'.
+        :param conteudo: Corpo da resposta.
+        :param retry_after: Tempo, em segundos, sugerido para o cliente tentar novamente.
+        :return: Resposta HTTP.
+    """
+    return ORJSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, content=conteudo,
+                          headers={'Retry-After': str(retry_after)})
+
+
+def montar_resposta_job(dados_job: dict, resultado: dict) -> dict:
+    """
+    Monta a resposta de um job concluído a partir do resultado enviado diretamente pelo worker, no mesmo formato
+    retornado pelo endpoint '/status'.
+        :param dados_job: Documento do job gerado no momento do enfileiramento.
+        :param resultado: Resultado do job enviado pelo worker.
+        :return: Dicionário com o status e o resultado do job.
+    """
+    ret = {'job_id': dados_job['job_id'], 'model_name': dados_job['model_name'],
+           'model_version': resultado.get('model_version', ""), 'method': dados_job['method'],
+           'status': resultado['status'], 'datetime': dados_job['datetime'],
+           'queue_response_time_sec': resultado.get('queue_response_time_sec', -1),
+           'total_response_time_sec': time() - dados_job['datetime'], 'response': resultado['response']}
+
+    if dados_job['method'] == "predict":
+        ret['feedback'] = ""
+        ret['has_feedback'] = False
+
+    return ret
+
+
+def montar_status(result: dict) -> dict:
+    """
+    Monta a resposta do status de um job a partir do documento persistido, verificando se o job expirou.
+        :param result: Documento do job.
+        :return: Dicionário com o status do job.
+    """
+    job_id = result['job_id']
+    status_job = result['status']
+    response = result['response']
+    dt_job = result['datetime']
+    ttl = result.get('ttl', TTL_MS)  # TTL salvo no momento da criação do job
+
+    # Verificação de expiração do job
+    if status_job in ("Queued", "Running") and ttl > 0:
+        elapsed_ms = (time() - dt_job) * 1000  # diferença em milissegundos
+        if elapsed_ms > ttl:
+            status_job = "Error"
+            response = f"Job expirou após {ttl} ms sem ser processado."
+            LOGGER.warning(f"Job {job_id} expirou (elapsed={elapsed_ms} ms > ttl={ttl} ms)")
+
+    ret = {'job_id': job_id, 'model_name': result['model_name'], 'model_version': result['model_version'],
+           'method': result['method'], 'status': status_job, 'datetime': dt_job,
+           'queue_response_time_sec': result['queue_response_time_sec'],
+           'total_response_time_sec': result['total_response_time_sec'], 'response': response}
+
+    # Obtenção de chaves específicas dependendo do método
+    if result['method'] == "predict":
+        ret['feedback'] = result['feedback']
+        ret['has_feedback'] = result['has_feedback']
+
+    if result['method'] == "get_feedback":
+        ret['initial_date'] = result['initial_date']
+        ret['end_date'] = result['end_date']
+        ret['request_source'] = result['request_source']
+
+    return ret
+
+
+def aplicar_resultado(result: dict, resultado: dict) -> dict:
+    """
+    Aplica, no documento de um job, o resultado recebido através do notificador de conclusão de jobs.
+        :param result: Documento do job.
+        :param resultado: Resultado do job (vindo do '/retorno' ou da resposta direta do worker).
+        :return: Documento do job atualizado.
+    """
+    result = dict(result)
+    result['status'] = resultado['status']
+    result['response'] = resultado['response']
+    result['model_version'] = resultado.get('model_version', result['model_version'])
+    result['queue_response_time_sec'] = resultado.get('queue_response_time_sec', result['queue_response_time_sec'])
+    result['total_response_time_sec'] = resultado.get('total_response_time_sec', time() - result['datetime'])
+    return result
+
+
+def aplicar_retorno(job_id: str, req_info: dict, dt_job: float, model_name: str, method: str = None) -> dict:
+    """
+    Aplica o retorno de um job enviado pelo worker: agenda a atualização do job no buffer de escrita, alimenta o
+    controle de admissão, o cache de resultados e os agregados de feedback e avisa as requisições que aguardam a
+    conclusão do job.
+        :param job_id: Job ID.
+        :param req_info: Retorno enviado pelo worker.
+        :param dt_job: Timestamp da criação do job.
+        :param model_name: Nome do modelo.
+        :param method: Método do job.
+        :return: Campos do job que foram atualizados.
+    """
+    return_status = req_info['status']
+
+    # Cada retorno alimenta a taxa de atendimento da fila utilizada no controle de admissão. A fila é obtida sem
+    # consultar o servidor de filas, pois o retorno pode estar sendo aplicado pela thread do consumidor de resultados
+    CONTROLE_ADMISSAO.registrar_conclusao(fila_metodo(QUEUE_REG.get(model_name), method, consultar=False))
+
+    campos_atualizar = {'status': return_status, 'queue_response_time_sec': req_info['queue_response_time_sec'],
+                        'total_response_time_sec': time() - dt_job, 'response': req_info['response'],
+                        'model_version': req_info['model_version']}
+    # Um retorno repetido de um job que já terminou é descartado e não é contabilizado novamente
+    if not update_job(job_id, campos_atualizar):
+        return campos_atualizar
+
+    # Conta o 'predict' concluído no dia do job, para as estatísticas do 'get_feedback'
+    if method == "predict" and return_status == "Done":
+        AGREGADOS_FEEDBACK.registrar_predict(model_name, dt_job, job_id)
+
+    # Guarda o resultado no cache, caso o job seja um 'predict' enfileirado por esta instância da API
+    CACHE_RESULTADOS.registrar_retorno(job_id, return_status, req_info['model_version'], req_info['response'])
+
+    # Avisa as requisições que estão aguardando a conclusão do job (long-poll, SSE e WebSocket)
+    if return_status in ("Done", "Error"):
+        NOTIFICADOR.notificar(job_id, campos_atualizar)
+
+    return campos_atualizar
+
+
+def aplicar_resultados(mensagens: list):
+    """
+    Aplica um lote de mensagens da fila de resultados dos workers. Executado na thread do consumidor da fila.
+        :param mensagens: Lista com as mensagens do lote. Cada mensagem é uma mudança de status ('tipo' = "status") ou
+                          um retorno de job ('tipo' = "retorno").
+    """
+    # O status 'Running' de um job que já terminou no mesmo lote não precisa ser gravado
+    concluidos = {m.get('job_id') for m in mensagens if m.get('tipo') == "retorno"}
+    running = []
+
+    for m in mensagens:
+        job_id = m.get('job_id')
+
+        try:
+            if m.get('tipo') == "status":
+                if job_id in concluidos:
+                    continue
+
+                ret_validate = validate_request(job_id, m['newstatus'], FILA_RESULTADOS)
+
+                if ret_validate['status'] == "Done":
+                    running.append(job_id)
+            elif m.get('tipo') == "retorno":
+                ret_validate = validate_request(job_id, m['status'], FILA_RESULTADOS)
+
+                if ret_validate['status'] == "Done":
+                    aplicar_retorno(job_id, m, m['datetime'], m.get('model_name'), m.get('method'))
+            else:
+                ret_validate = {'status': "Error", 'response': f"Tipo de mensagem desconhecido: {m.get('tipo')}"}
+        except KeyError as e:
+            ret_validate = {'status': "Error", 'response': f"Faltou informar esta chave na mensagem: {e}"}
+
+        if ret_validate['status'] == "Error":
+            LOGGER.error(f"Resultado inválido para o job {job_id} na fila '{FILA_RESULTADOS}': "
+                         f"{ret_validate['response']}")
+
+    if running:
+        # As mensagens de um job podem ser aplicadas fora de ordem por instâncias diferentes da API, por isso o
+        # 'Running' é gravado direto no banco, somente nos jobs que ainda estão 'Queued'. Como o status 'Running' é só
+        # informativo, uma falha aqui não devolve o lote para a fila
+        try:
+            marcar_jobs_running(running)
+        except BaseException as e:
+            LOGGER.error(f"Não foi possível atualizar o status de {len(running)} job(s) para 'Running': "
+                         f"{e.__class__} - {e}")
+
+    # O lote só é reconhecido na fila depois que os retornos são gravados no banco. Se a gravação não terminar a
+    # tempo, o lote volta para a fila; reaplicar um retorno não tem efeito, pois as atualizações dos jobs são
+    # condicionais ao status e cada 'predict' é contado uma só vez nos agregados
+    if not BUFFER_JOBS.aguardar_gravacao(BUFFER_JOBS.marco(), timeout=RESULTS_FLUSH_TIMEOUT_SECONDS):
+        raise TimeoutError(f"Os retornos não foram gravados no banco de dados em {RESULTS_FLUSH_TIMEOUT_SECONDS}s")
+
+
+def montar_labels_feedback(pares: list):
+    """
+    Monta as listas de labels para o feedback a partir dos pares de labels retornados pela função
+    'retrieve_docs_feedback'.
+        :param pares: Lista de tuplas (label predito, label do feedback, quantidade).
+        :return: Tupla contendo: labels preditos e labels informados no feedback.
+    """
+    y_pred = []
+    y_true = []
+
+    for pred, true, quantidade in pares:
+        y_pred += [pred] * quantidade
+        y_true += [true] * quantidade
+
+    return y_pred, y_true
+
+
+def codificar_labels_feedback(pares: list) -> tuple:
+    """
+    Codifica os labels para o feedback a partir dos pares de labels retornados pela função 'retrieve_docs_feedback',
+    no formato de matriz de confusão: vocabulário com os labels distintos, arrays com os códigos (inteiros pequenos,
+    posições no vocabulário) do label predito e do label do feedback de cada par distinto e array com a quantidade de
+    cada par, serializados em base64. Assim, o tamanho da mensagem depende só da quantidade de pares distintos.
+        :param pares: Lista de tuplas (label predito, label do feedback, quantidade).
+        :return: Tupla contendo: labels codificados, tipos dos labels informados no feedback e quantidade de labels.
+    """
+    vocabulario = []
+    codigos = {}  # O label serializado é a chave, assim 1, "1" e true são labels diferentes
+
+    for pred, true, _ in pares:
+        for label in (pred, true):
+            chave = orjson.dumps(label)
+
+            if chave not in codigos:
+                codigos[chave] = len(vocabulario)
+                vocabulario.append(label)
+
+    dtype = np.uint8 if len(vocabulario) <= 256 else np.uint16 if len(vocabulario) <= 65536 else np.uint32
+    quantidades = np.fromiter((quantidade for _, _, quantidade in pares), dtype=np.int64, count=len(pares))
+    codigos_pred = np.fromiter((codigos[orjson.dumps(pred)] for pred, _, _ in pares), dtype=dtype, count=len(pares))
+    codigos_true = np.fromiter((codigos[orjson.dumps(true)] for _, true, _ in pares), dtype=dtype, count=len(pares))
+
+    labels_codificados = {'vocabulary': vocabulario, 'dtype': np.dtype(dtype).name,
+                          'y_pred': base64.b64encode(codigos_pred.tobytes()).decode(),
+                          'y_true': base64.b64encode(codigos_true.tobytes()).decode(),
+                          'counts': base64.b64encode(quantidades.astype(np.uint32).tobytes()).decode()}
+
+    # Os tipos dos labels do feedback são lidos do vocabulário
+    tipos_labels = [vocabulario[codigo] for codigo in np.unique(codigos_true)]
+
+    return labels_codificados, tipos_labels, int(quantidades.sum())
 
 
 # Informações adicionais para geração de documentação automática da API via Swagger.
@@ -73,9 +371,15 @@ API para servir modelos de ML (Machine Learning).
 ### Endpoints principais
 
 * **inference**: Recebe itens para inferência ou avaliação. Também retorna informações sobre um modelo publicado. 
+* **inference/batch**: Recebe um lote de requisições de inferência (de um ou mais modelos) em uma única chamada.
 * **feedback**: Recebe o feedback dos usuários em relação às inferências feitas pelos modelos.
 * **get_feedback**: Solicita as informações consolidadas sobre os feedbacks informados pelos usuários.
-* **status**: Obtém o status de um job.
+* **status**: Obtém o status de um job. Aceita o parâmetro 'wait' (long-poll) para aguardar a conclusão do job.
+* **status/stream** e **status/ws**: Acompanham vários jobs, via Server-Sent Events ou WebSocket, recebendo o status de
+cada um assim que ele é concluído.
+
+Quando os workers de um modelo estão sobrecarregados e o job expiraria na fila antes de ser atendido, os endpoints de
+inferência recusam o job com o status HTTP 429 e o cabeçalho 'Retry-After' (em segundos).
 
 ### Links úteis
 * Repositório da versão standalone para testes da Stack: [Stack de ML Prodest - standalone](https://github.com/prodest/prodest-ml-stack)
@@ -105,28 +409,53 @@ tags_metadata = [
     {
         "name": "version",
         "description": "Obtém a versão da stack.",
+    },
+    {
+        "name": "stats",
+        "description": "Obtém as estatísticas de funcionamento da instância da API (cache de resultados, etc.).",
     }
 ]
 
 
-# Classes criadas somente para auxiliar na documentação automática do Swagger
+# Classes criadas somente para auxiliar na documentação automática do Swagger. Os campos extras enviados pelos clientes
+# são mantidos, como acontecia quando o corpo da requisição era lido diretamente
 class InferenceRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     model_name: str
     features: Optional[list] = None
     targets: Optional[list] = None
     method: str
 
 
+class InferenceBatchRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    requests: list[InferenceRequest]
+
+
 class StatusRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     job_id: str
 
 
+class StatusStreamRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    job_ids: list[str]
+
+
 class FeedbackRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     job_id: str
     feedback: list
 
 
 class GetFeedbackRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     model_name: str
     initial_date: str
     end_date: str
@@ -153,8 +482,25 @@ def validar_credenciais(token_recebido, is_worker=False):
         raise credentials_exception
 
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Inicia as rotinas que rodam em background durante toda a vida da API.
+    """
+    NOTIFICADOR.iniciar(asyncio.get_running_loop())
+    CONSUMIDOR_RESPOSTAS.iniciar()
+    REGISTRO_FILAS.iniciar()
+    CONSUMIDOR_RESULTADOS.iniciar(aplicar_resultados)
+
+    if ARMAZEM_PAYLOADS:
+        ARMAZEM_PAYLOADS.iniciar_limpeza(intervalo=min(CLAIM_CHECK_MAX_AGE_SECONDS, 600),
+                                         idade_maxima=CLAIM_CHECK_MAX_AGE_SECONDS)
+    yield
+
+
 # Instancia a API
-app = FastAPI(title="API de ML", description=description, openapi_tags=tags_metadata, redoc_url=None)
+app = FastAPI(title="API de ML", description=description, openapi_tags=tags_metadata, redoc_url=None,
+              lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 # Endpoints
@@ -214,18 +560,17 @@ async def inference(cr: Annotated[
                               },
                           ),
                       ], info: Request, header_value=Security(auth_header),
-                    authorization: Optional[str] = Header(None, include_in_schema=False)):
+                    authorization: Optional[str] = Header(None, include_in_schema=False),
+                    wait: Optional[int] = Query(None, description="Modo síncrono: tempo máximo, em milissegundos, "
+                                                                  "que a requisição aguarda pelo resultado do job. "
+                                                                  f"Máximo: {MAX_WAIT_MS}. Caso o tempo acabe, "
+                                                                  "retorna o status 'Queued' e o resultado deve ser "
+                                                                  "consultado através do '/status'.")):
     validar_credenciais(authorization)
-    req_info = await info.json()
+    # O corpo já foi lido e validado pelo FastAPI no parâmetro 'cr', não é necessário ler o JSON novamente
+    req_info = cr.model_dump(exclude_unset=True)
     method = req_info['method']
 
-    global QUEUE_REG_RELOAD
-
-    # Obtém as atualizações do registro de filas feitas por outras instâncias da API. Faz em intervalos mínimos de 5 min
-    if QUEUE_REG_RELOAD['next_reload'] < time():
-        QUEUE_REG_RELOAD['next_reload'] = time() + QUEUE_REG_RELOAD['delay_seconds']
-        reload_queue_registry()
-
     model_name = req_info['model_name']  # Obtém o 'model_name' para verificar qual fila utilizar
 
     if model_name in QUEUE_REG:
@@ -235,50 +580,87 @@ async def inference(cr: Annotated[
             LOGGER.error(f"Origem da requisição: IP={info.client.host}. Modelo: {model_name}. Erro: {val['response']}")
             return {'job_id': "n/a", 'status': "Error", 'response': val['response']}
 
-        # Obtém o worker_id para utilizar a fila específica do worker
+        # Obtém o worker_id para utilizar a fila específica do worker (ou a fila separada do método)
         worker_id = QUEUE_REG[model_name]
 
+        if method != "predict":
+            worker_id = await executar_bloqueante(fila_metodo, worker_id, method)
+
         client_key = f"IP_{info.client.host}:{info.client.port}"  # Para ajudar a diversificar o hash
         job_id = generate_hash(client_key)
 
-        # Adiciona o job_id
-        req_info['job_id'] = job_id
+        # Um 'predict' repetido é atendido pelo cache, sem passar pela fila e pelo worker
+        features_hash = None
 
-        # Inclui o token para que o ml worker possa utilizar na atualização de status e retorno
-        req_info['token'] = f"Bearer {TOKEN_WORKERS}"
+        if method == "predict" and CACHE_RESULTADOS.ativo:
+            features_hash = hash_features(req_info['features'])
+            resultado_cache = CACHE_RESULTADOS.obter(model_name, features_hash)
 
-        # Inclui o timestamp para apuração dos tempos de fila e processamento do job
-        timestamp = time()
-        req_info['datetime'] = timestamp
+            if resultado_cache:
+                dados_add = preparar_job_cache(req_info, job_id, *resultado_cache)
+
+                try:
+                    await executar_bloqueante(insert_job, dados_add)
+                    AGREGADOS_FEEDBACK.registrar_predict(model_name, dados_add['datetime'])
+                except BaseException as e:
+                    LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: Não foi possível gerar "
+                                 f"o job. Erro na conexão com o banco de dados: {e.__class__} - {e}")
+                    gerar_arquivo_erro()
+                    return {'job_id': "n/a", 'model_name': model_name, 'method': method, 'status': "Error",
+                            'response': "Não foi possível gerar o job. Erro na conexão com o banco de dados"}
+
+                return montar_status(dados_add)
+
+        # Falha rápido quando o job expiraria na fila antes de ser atendido
+        retry_after = await executar_bloqueante(CONTROLE_ADMISSAO.avaliar, worker_id)
+
+        if retry_after is not None:
+            LOGGER.error(f"Origem da requisição: IP={info.client.host}. Job recusado pelo controle de admissão. "
+                         f"Fila: '{worker_id}'. Modelo: '{model_name}'. Retry-After: {retry_after}s")
+            return resposta_sobrecarga(montar_recusa(model_name, method, retry_after), retry_after)
 
-        # Inclui TTL no job (para que o /status saiba quando expirar)
-        req_info['ttl'] = TTL_MS
+        dados_add = preparar_job(req_info, job_id, time())
 
-        resp_enfileirar = enfileirar_job(worker_id, model_name, info.client.host, req_info)
+        # No modo síncrono o worker publica o resultado diretamente na fila de respostas desta instância da API. O
+        # registro do interesse no resultado é feito antes do enfileiramento para não perder uma resposta rápida
+        reply_to = None
+        fut_resultado = None
+
+        if wait and wait > 0 and NOTIFICADOR.ativo and CONSUMIDOR_RESPOSTAS.fila:
+            reply_to = CONSUMIDOR_RESPOSTAS.fila
+            fut_resultado = NOTIFICADOR.registrar(job_id)
+
+        resp_enfileirar = await executar_bloqueante(enfileirar_job, worker_id, model_name, info.client.host,
+                                                     req_info, reply_to=reply_to)
 
         if resp_enfileirar['status'] != "Done":
+            if fut_resultado:
+                NOTIFICADOR.remover(job_id, fut_resultado)
+
             return resp_enfileirar
 
         try:
-            # Coloca o status do job como 'Queued' e persiste
-            dados_add = {'job_id': job_id, 'model_name': model_name, 'model_version': "", 'method': method,
-                         'datetime': timestamp, 'ttl': TTL_MS, 'status': 'Queued', 'queue_response_time_sec': -1,
-                         'total_response_time_sec': -1, 'response': ""}
-
-            # Chaves específicas para o predict
-            if method == "predict":
-                dados_add['feedback'] = ""
-                dados_add['has_feedback'] = False
-
-            insert_doc("col_jobs", dados_add)
-            
+            # Persiste o job com o status 'Queued'
+            await executar_bloqueante(insert_job, dados_add)
         except BaseException as e:
+            if fut_resultado:
+                NOTIFICADOR.remover(job_id, fut_resultado)
+
             LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: Não foi possível gerar o "
                          f"job. Erro na conexão com o banco de dados: {e.__class__} - {e}")
             gerar_arquivo_erro()
             return {'job_id': "n/a", 'model_name': model_name, 'method': method, 'status': "Error",
                     'response': "Não foi possível gerar o job. Erro na conexão com o banco de dados"}
 
+        if features_hash:
+            CACHE_RESULTADOS.registrar_job(job_id, model_name, features_hash)
+
+        if fut_resultado:
+            resultado = await NOTIFICADOR.aguardar(job_id, fut_resultado, min(wait, MAX_WAIT_MS) / 1000)
+
+            if resultado:
+                return montar_resposta_job(dados_add, resultado)
+
         return {'job_id': job_id, 'model_name': model_name, 'method': method, 'status': "Queued"}
     else:
         ret = {'job_id': "n/a", 'model_name': model_name, 'method': method, 'status': "Error",
@@ -288,6 +670,205 @@ async def inference(cr: Annotated[
         return ret
 
 
+# Endpoint: Realiza as atividades de inferência de um lote de requisições (de um ou mais modelos) de uma só vez
+@app.post("/inference/batch", tags=["inference"])
+async def inference_batch(cr: Annotated[
+                                InferenceBatchRequest,
+                                Body(
+                                    openapi_examples={
+                                        "batch": {
+                                            "summary": "Exemplo de lote de inferências",
+                                            "description": "Envia várias requisições de inferência em uma única "
+                                                           "chamada. Cada item segue as mesmas regras do endpoint "
+                                                           "'inference'. A quantidade máxima de itens do lote é "
+                                                           f"{MAX_JOBS_LOTE}. Os job_ids são retornados na mesma "
+                                                           f"ordem dos itens enviados.",
+                                            "value": {
+                                                'requests': [
+                                                    {
+                                                        'model_name': "COLE_AQUI_O_NOME_DO_MODELO",
+                                                        "features": ["aposto que vou sofrer bullying depois do meu "
+                                                                     "próximo tweet"],
+                                                        'method': "predict",
+                                                    },
+                                                    {
+                                                        'model_name': "COLE_AQUI_O_NOME_DO_MODELO",
+                                                        'method': "info",
+                                                    },
+                                                ],
+                                            },
+                                        },
+                                    },
+                                ),
+                            ], info: Request, header_value=Security(auth_header),
+                          authorization: Optional[str] = Header(None, include_in_schema=False)):
+    validar_credenciais(authorization)
+    req_info = cr.model_dump(exclude_unset=True)
+    requisicoes = req_info['requests']
+
+    if len(requisicoes) == 0:
+        return {'status': "Error", 'response': "Foi passada uma lista vazia no parâmetro 'requests'"}
+
+    if len(requisicoes) > MAX_JOBS_LOTE:
+        msg = f"A quantidade máxima de itens do lote foi ultrapassada. Foram passados {len(requisicoes)} itens, mas " \
+              f"é suportado no máximo {MAX_JOBS_LOTE}."
+        LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro: {msg}")
+        return {'status': "Error", 'response': msg}
+
+    client_key = f"IP_{info.client.host}:{info.client.port}"  # Para ajudar a diversificar o hash
+    job_ids = generate_hashes(client_key, len(requisicoes))
+    timestamp = time()
+
+    respostas = [None] * len(requisicoes)  # Mantém a mesma ordem dos itens recebidos
+    jobs = []  # Tuplas (worker_id, model_name, req) dos jobs validados
+    docs = []  # Documentos dos jobs validados, que serão persistidos
+    indices = []  # Posição de cada job validado na lista de respostas
+    docs_cache = []  # Documentos dos jobs de 'predict' atendidos pelo cache de resultados
+    indices_cache = []  # Posição de cada job atendido pelo cache na lista de respostas
+    hashes = {}  # job_id -> (model_name, hash das features) dos 'predicts' que vão para a fila
+
+    # Valida todas as requisições antes de enfileirar
+    for i, req in enumerate(requisicoes):
+        model_name = req['model_name']
+        method = req['method']
+
+        if model_name not in QUEUE_REG:
+            respostas[i] = {'job_id': "n/a", 'model_name': model_name, 'method': method, 'status': "Error",
+                            'response': "O modelo não foi encontrado!"}
+            continue
+
+        val = validate_params(req)
+
+        if val['status'] == 'Error':
+            respostas[i] = {'job_id': "n/a", 'model_name': model_name, 'method': method, 'status': "Error",
+                            'response': val['response']}
+            continue
+
+        if method == "predict" and CACHE_RESULTADOS.ativo:
+            features_hash = hash_features(req['features'])
+            resultado_cache = CACHE_RESULTADOS.obter(model_name, features_hash)
+
+            if resultado_cache:
+                docs_cache.append(preparar_job_cache(req, job_ids[i], *resultado_cache))
+                indices_cache.append(i)
+                continue
+
+            hashes[job_ids[i]] = (model_name, features_hash)
+
+        worker_id = QUEUE_REG[model_name]
+
+        if method != "predict":
+            worker_id = await executar_bloqueante(fila_metodo, worker_id, method)
+
+        docs.append(preparar_job(req, job_ids[i], timestamp))
+        jobs.append((worker_id, model_name, req))
+        indices.append(i)
+
+    qtd_erros_validacao = len(requisicoes) - len(jobs) - len(docs_cache)
+
+    if qtd_erros_validacao:
+        LOGGER.error(f"Origem da requisição: IP={info.client.host}. {qtd_erros_validacao} item(ns) do lote não "
+                     f"passaram na validação")
+
+    # Controle de admissão por fila: os itens destinados a uma fila sobrecarregada são recusados
+    qtd_recusados = 0
+    maior_retry_after = 0
+
+    if jobs and CONTROLE_ADMISSAO.ativo:
+        qtd_por_fila = {}
+
+        for worker_id, _, _ in jobs:
+            qtd_por_fila[worker_id] = qtd_por_fila.get(worker_id, 0) + 1
+
+        recusas = {}
+
+        for worker_id, qtd in qtd_por_fila.items():
+            retry_after = await executar_bloqueante(CONTROLE_ADMISSAO.avaliar, worker_id, qtd)
+
+            if retry_after is not None:
+                recusas[worker_id] = retry_after
+
+        if recusas:
+            jobs_admitidos, docs_admitidos, indices_admitidos = [], [], []
+
+            for job, doc, i in zip(jobs, docs, indices):
+                retry_after = recusas.get(job[0])
+
+                if retry_after is None:
+                    jobs_admitidos.append(job)
+                    docs_admitidos.append(doc)
+                    indices_admitidos.append(i)
+                    continue
+
+                respostas[i] = montar_recusa(doc['model_name'], doc['method'], retry_after)
+                hashes.pop(doc['job_id'], None)
+                qtd_recusados += 1
+                maior_retry_after = max(maior_retry_after, retry_after)
+
+            jobs, docs, indices = jobs_admitidos, docs_admitidos, indices_admitidos
+            LOGGER.error(f"Origem da requisição: IP={info.client.host}. {qtd_recusados} item(ns) do lote recusados "
+                         f"pelo controle de admissão. Filas: {recusas}")
+
+    if jobs:
+        resps_enfileirar = await executar_bloqueante(enfileirar_jobs_lote, jobs, info.client.host)
+        docs_enfileirados = []
+        indices_enfileirados = []
+
+        for i, doc, resp_enfileirar in zip(indices, docs, resps_enfileirar):
+            if resp_enfileirar['status'] != "Done":
+                respostas[i] = {'job_id': "n/a", 'model_name': doc['model_name'], 'method': doc['method'],
+                                'status': "Error", 'response': resp_enfileirar['response']}
+            else:
+                docs_enfileirados.append(doc)
+                indices_enfileirados.append(i)
+
+                if doc['job_id'] in hashes:
+                    CACHE_RESULTADOS.registrar_job(doc['job_id'], *hashes[doc['job_id']])
+
+        if docs_enfileirados:
+            try:
+                # Persiste todos os jobs com o status 'Queued' em uma única operação
+                await executar_bloqueante(insert_jobs, docs_enfileirados)
+                status_jobs = "Queued"
+                msg = None
+            except BaseException as e:
+                LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: Não foi possível gerar os "
+                             f"jobs do lote. Erro na conexão com o banco de dados: {e.__class__} - {e}")
+                gerar_arquivo_erro()
+                status_jobs = "Error"
+                msg = "Não foi possível gerar o job. Erro na conexão com o banco de dados"
+
+            for i, doc in zip(indices_enfileirados, docs_enfileirados):
+                respostas[i] = {'job_id': doc['job_id'] if msg is None else "n/a", 'model_name': doc['model_name'],
+                                'method': doc['method'], 'status': status_jobs}
+
+                if msg:
+                    respostas[i]['response'] = msg
+
+    if docs_cache:
+        try:
+            await executar_bloqueante(insert_jobs, docs_cache)
+
+            for i, doc in zip(indices_cache, docs_cache):
+                AGREGADOS_FEEDBACK.registrar_predict(doc['model_name'], doc['datetime'])
+                respostas[i] = montar_status(doc)
+        except BaseException as e:
+            LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: Não foi possível gerar os "
+                         f"jobs do lote. Erro na conexão com o banco de dados: {e.__class__} - {e}")
+            gerar_arquivo_erro()
+
+            for i, doc in zip(indices_cache, docs_cache):
+                respostas[i] = {'job_id': "n/a", 'model_name': doc['model_name'], 'method': doc['method'],
+                                'status': "Error",
+                                'response': "Não foi possível gerar o job. Erro na conexão com o banco de dados"}
+
+    # Se todos os itens foram recusados por sobrecarga, o lote inteiro é recusado com o HTTP 429
+    if qtd_recusados == len(requisicoes):
+        return resposta_sobrecarga({'status': "Error", 'response': respostas}, maior_retry_after)
+
+    return {'status': "Done", 'response': respostas}
+
+
 # Consulta o status do job
 @app.post("/status", tags=["status"])
 async def get_status(cr: Annotated[
@@ -314,9 +895,12 @@ async def get_status(cr: Annotated[
                             },
                         ),
                         ], info: Request, header_value=Security(auth_header),
-                     authorization: Optional[str] = Header(None, include_in_schema=False)):
+                     authorization: Optional[str] = Header(None, include_in_schema=False),
+                     wait: Optional[int] = Query(None, description="Long-poll: tempo máximo, em milissegundos, que a "
+                                                                   "requisição aguarda o job sair dos status 'Queued'/"
+                                                                   f"'Running'. Máximo: {MAX_WAIT_MS}.")):
     validar_credenciais(authorization)
-    req_info = await info.json()
+    req_info = cr.model_dump(exclude_unset=True)
     job_id = req_info['job_id']
 
     # Foi utilizado 'Done' para passar na verificação de status, pois o objetivo é somente validar o job_id
@@ -325,42 +909,29 @@ async def get_status(cr: Annotated[
     if ret_validate['status'] == "Error":
         return ret_validate  # Não foi validado, retorna o status e a resposta da rotina de validação
 
+    # No long-poll, o interesse na conclusão do job é registrado antes da leitura do banco para não perder um retorno
+    # que chegue entre a leitura e a espera
+    fut_resultado = None
+
+    if wait and wait > 0 and NOTIFICADOR.ativo:
+        fut_resultado = NOTIFICADOR.registrar(job_id)
+
     # Busca o job
     try:
-        result = retrieve_doc("col_jobs", "job_id", job_id)
+        result = await executar_bloqueante(retrieve_job, job_id)
 
         if result:
-            model_name = result['model_name']
-            model_version = result['model_version']
-            method = result['method']
-            status = result['status']
-            datetime = result['datetime']
-            queue_response_time_sec = result['queue_response_time_sec']
-            total_response_time_sec = result['total_response_time_sec']
-            response = result['response']
-            ttl = result.get('ttl', TTL_MS)  # TTL salvo no momento da criação do job
-
-            # Verificação de expiração do job
-            if status in ("Queued", "Running") and ttl > 0:
-                elapsed_ms = (time() - datetime) * 1000  # diferença em milissegundos
-                if elapsed_ms > ttl:
-                    status = "Error"
-                    response = f"Job expirou após {ttl} ms sem ser processado."
-                    LOGGER.warning(f"Job {job_id} expirou (elapsed={elapsed_ms} ms > ttl={ttl} ms)")
-
-            ret = {'job_id': job_id, 'model_name': model_name, 'model_version': model_version, 'method': method,
-                   'status': status, 'datetime': datetime, 'queue_response_time_sec': queue_response_time_sec,
-                   'total_response_time_sec': total_response_time_sec, 'response': response}
-
-            # Obtenção de chaves específicas dependendo do método
-            if method == "predict":
-                ret['feedback'] = result['feedback']
-                ret['has_feedback'] = result['has_feedback']
-
-            if method == "get_feedback":
-                ret['initial_date'] = result['initial_date']
-                ret['end_date'] = result['end_date']
-                ret['request_source'] = result['request_source']
+            ret = montar_status(result)
+
+            if fut_resultado and ret['status'] in ("Queued", "Running"):
+                resultado = await NOTIFICADOR.aguardar(job_id, fut_resultado, min(wait, MAX_WAIT_MS) / 1000)
+
+                if resultado:
+                    ret = montar_status(aplicar_resultado(result, resultado))
+                else:
+                    # O retorno pode ter sido recebido por outra instância da API, por isso consulta novamente o banco
+                    result = await executar_bloqueante(retrieve_job, job_id)
+                    ret = montar_status(result)
 
             return ret
         else:
@@ -372,6 +943,171 @@ async def get_status(cr: Annotated[
         LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: {msg}: {e.__class__} - {e}")
         gerar_arquivo_erro()
         return {'status': "Error", 'response': msg}
+    finally:
+        if fut_resultado:
+            NOTIFICADOR.remover(job_id, fut_resultado)
+
+
+async def acompanhar_jobs(job_ids: list, timeout: float):
+    """
+    Acompanha um conjunto de jobs e gera o status de cada um assim que ele é concluído. Os jobs que já estão concluídos
+    são gerados imediatamente. Os que não forem concluídos dentro do tempo máximo são gerados com o status atual.
+        :param job_ids: Lista de job_ids que serão acompanhados.
+        :param timeout: Tempo máximo de acompanhamento, em segundos.
+        :return: Gerador assíncrono com o status de cada job.
+    """
+    job_ids = list(dict.fromkeys(job_ids))  # Remove os repetidos, mantendo a ordem
+    futs = {job_id: NOTIFICADOR.registrar(job_id) for job_id in job_ids}
+
+    try:
+        docs = await executar_bloqueante(retrieve_jobs, job_ids)
+        encontrados = {doc['job_id']: doc for doc in docs}
+        pendentes = {}  # 'future' -> documento do job
+
+        for job_id in job_ids:
+            doc = encontrados.get(job_id)
+
+            if doc is None:
+                yield {'job_id': job_id, 'status': "Error", 'response': f"Não foi possível encontrar o job {job_id}"}
+                continue
+
+            ret = montar_status(doc)
+
+            if ret['status'] in ("Queued", "Running"):
+                pendentes[futs[job_id]] = doc
+            else:
+                yield ret
+
+        limite = time() + timeout
+
+        while pendentes and limite > time():
+            concluidos, _ = await asyncio.wait(pendentes.keys(), timeout=limite - time(),
+                                               return_when=asyncio.FIRST_COMPLETED)
+
+            for fut in concluidos:
+                yield montar_status(aplicar_resultado(pendentes.pop(fut), fut.result()))
+
+        if pendentes:
+            # O retorno pode ter sido recebido por outra instância da API, por isso consulta novamente o banco
+            docs = await executar_bloqueante(retrieve_jobs, [doc['job_id'] for doc in pendentes.values()])
+
+            for doc in docs:
+                yield montar_status(doc)
+    finally:
+        for job_id, fut in futs.items():
+            NOTIFICADOR.remover(job_id, fut)
+
+
+def validar_job_ids_acompanhamento(job_ids, client_host) -> dict:
+    """
+    Valida a lista de job_ids recebida nos endpoints de acompanhamento de jobs (SSE e WebSocket).
+        :param job_ids: Lista de job_ids recebida.
+        :param client_host: Informação do host que fez a requisição.
+        :return: Dicionário com o status da validação e a resposta.
+    """
+    if type(job_ids) is not list or len(job_ids) == 0:
+        return {'status': "Error", 'response': "Informe uma lista não vazia no parâmetro 'job_ids'"}
+
+    if len(job_ids) > MAX_JOBS_LOTE:
+        return {'status': "Error", 'response': f"A quantidade máxima de job_ids foi ultrapassada. Foram passados "
+                                               f"{len(job_ids)}, mas é suportado no máximo {MAX_JOBS_LOTE}."}
+
+    for job_id in job_ids:
+        ret_validate = validate_request(job_id, "Done", client_host)
+
+        if ret_validate['status'] == "Error":
+            return ret_validate
+
+    return {'status': "Done", 'response': ""}
+
+
+# Acompanha vários jobs através de Server-Sent Events. Cada job gera um evento assim que é concluído
+@app.post("/status/stream", tags=["status"])
+async def get_status_stream(cr: Annotated[
+                               StatusStreamRequest,
+                               Body(
+                                   openapi_examples={
+                                       'status_stream': {
+                                           "summary": "Exemplo de acompanhamento de jobs via SSE",
+                                           "description": "Abre um fluxo 'text/event-stream' que envia um evento "
+                                                          "'status' para cada job assim que ele for concluído (o "
+                                                          "conteúdo é o mesmo retornado pelo '/status'). Os jobs que "
+                                                          "não forem concluídos até o fim do tempo de espera são "
+                                                          "enviados com o status atual. Ao final é enviado o evento "
+                                                          "'end'.",
+                                           "value": {
+                                               'job_ids': ["COLE_AQUI_O_JOB_ID_1", "COLE_AQUI_O_JOB_ID_2"],
+                                           },
+                                       },
+                                   },
+                               ),
+                               ], info: Request, header_value=Security(auth_header),
+                            authorization: Optional[str] = Header(None, include_in_schema=False),
+                            wait: Optional[int] = Query(None, description="Tempo máximo de acompanhamento dos jobs, "
+                                                                          f"em milissegundos. Padrão: {TTL_MS}.")):
+    validar_credenciais(authorization)
+    req_info = cr.model_dump(exclude_unset=True)
+    job_ids = req_info['job_ids']
+
+    ret_validate = validar_job_ids_acompanhamento(job_ids, info.client.host)
+
+    if ret_validate['status'] == "Error":
+        return ret_validate
+
+    timeout = min(wait, TTL_MS) / 1000 if wait and wait > 0 else TTL_MS / 1000
+
+    async def gerar_eventos():
+        try:
+            async for ret in acompanhar_jobs(job_ids, timeout):
+                yield f"event: status\ndata: {orjson.dumps(ret, default=str).decode()}\n\n"
+        except BaseException as e:
+            msg = "Não foi possível obter o status dos jobs. Erro na conexão com o banco de dados"
+            LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: {msg}: {e.__class__} - {e}")
+            yield f"event: error\ndata: {orjson.dumps({'status': 'Error', 'response': msg}).decode()}\n\n"
+
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(gerar_eventos(), media_type="text/event-stream", headers={'Cache-Control': "no-cache"})
+
+
+# Acompanha vários jobs através de WebSocket. O cliente envia {"job_ids": [...]} e recebe o status de cada job assim que
+# ele é concluído. A conexão é fechada quando todos os jobs forem informados ou o tempo de espera acabar
+@app.websocket("/status/ws")
+async def get_status_ws(websocket: WebSocket):
+    try:
+        validar_credenciais(websocket.headers.get("authorization"))
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+
+    try:
+        req_info = orjson.loads(await websocket.receive_text())
+        job_ids = req_info.get('job_ids')
+        ret_validate = validar_job_ids_acompanhamento(job_ids, websocket.client.host)
+
+        if ret_validate['status'] == "Error":
+            await websocket.send_json(ret_validate)
+        else:
+            wait = req_info.get('wait')
+            timeout = min(wait, TTL_MS) / 1000 if type(wait) is int and wait > 0 else TTL_MS / 1000
+
+            async for ret in acompanhar_jobs(job_ids, timeout):
+                await websocket.send_text(orjson.dumps(ret, default=str).decode())
+
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except BaseException as e:
+        msg = "Não foi possível obter o status dos jobs. Erro na conexão com o banco de dados"
+        LOGGER.error(f"Origem da requisição: IP={websocket.client.host}. Erro reportado: {msg}: {e.__class__} - {e}")
+
+        try:
+            await websocket.send_json({'status': "Error", 'response': msg})
+            await websocket.close()
+        except BaseException:
+            pass
 
 
 # Dá feedback em relação às inferências dos modelos
@@ -397,7 +1133,7 @@ async def feedback(cr: Annotated[
                       ], info: Request, header_value=Security(auth_header),
                    authorization: Optional[str] = Header(None, include_in_schema=False)):
     validar_credenciais(authorization)
-    req_info = await info.json()
+    req_info = cr.model_dump(exclude_unset=True)
     job_id = req_info['job_id']
 
     val = validate_params(req_info)
@@ -409,7 +1145,7 @@ async def feedback(cr: Annotated[
         return {'job_id': "n/a", 'status': "Error", 'response':  val['response']}
 
     try:
-        result = retrieve_doc("col_jobs", "job_id", job_id)
+        result = await executar_bloqueante(retrieve_job, job_id)
 
         if result:
             if result['method'] == "predict" and result['status'] == "Done":
@@ -433,7 +1169,12 @@ async def feedback(cr: Annotated[
                         LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: {msg}")
                         return {'status': "Error", 'response': msg}
 
-                update_doc("col_jobs", "_id", result['_id'], {'feedback': req_info['feedback'], 'has_feedback': True})
+                await executar_bloqueante(update_job, job_id, {'feedback': req_info['feedback'], 'has_feedback': True})
+
+                # Atualiza os agregados do dia do job. Se o job já tinha feedback, os labels anteriores são descontados
+                AGREGADOS_FEEDBACK.registrar_feedback(job_id, result['model_name'], result['datetime'],
+                                                      result['response'], req_info['feedback'],
+                                                      result['feedback'] if result.get('has_feedback') else None)
                 return {'status': "Done", 'response': f"Feedback informado com sucesso"}
             else:
                 msg = f"Não foi possível informar o feedback. O job não é do método 'predict' e/ou o status não é " \
@@ -461,11 +1202,12 @@ async def get_feedback(cr: Annotated[
                                       "summary": "Exemplo de solicitação de feedback",
                                       "description": "Solicita o feedback em relação às inferências feitas por um "
                                                      "modelo. Regras: O intervalo máximo entre a data inicial e a "
-                                                     "final é de 90 dias. O intervalo entre as solicitações de "
-                                                     "feedback de um mesmo modelo deve ser maior que 30 minutos. O "
-                                                     "intervalo entre as solicitações de feedback entre modelos "
-                                                     "diferentes é de 2 minutos. A quantidade máxima de labels "
-                                                     "analisados no feedback é 30000.",
+                                                     "final é de 90 dias. Os períodos anteriores aos agregados "
+                                                     "diários de feedback são calculados a partir dos jobs: nestes "
+                                                     "casos, o intervalo entre as solicitações de feedback de um "
+                                                     "mesmo modelo deve ser maior que 30 minutos e o intervalo entre "
+                                                     "as solicitações de feedback entre modelos diferentes é de 2 "
+                                                     "minutos.",
                                       "value": {
                                           'model_name': "COLE_AQUI_O_NOME_DO_MODELO",
                                           "initial_date": "dd/mm/yyyy",
@@ -477,7 +1219,7 @@ async def get_feedback(cr: Annotated[
                           ], info: Request, header_value=Security(auth_header),
                        authorization: Optional[str] = Header(None, include_in_schema=False)):
     validar_credenciais(authorization)
-    req_info = await info.json()
+    req_info = cr.model_dump(exclude_unset=True)
 
     global NEXT_FEEDBACKS_MODELOS
     model_name = req_info['model_name']  # Obtém o 'model_name' para verificar qual fila utilizar
@@ -499,8 +1241,8 @@ async def get_feedback(cr: Annotated[
             next_global_feedbk = NEXT_FEEDBACKS_MODELOS['next_global_feedback']
             next_global_feedbk_dt = datetime.fromtimestamp(next_global_feedbk).strftime("dia %d/%m/%Y a partir das "
                                                                                         "%H:%M:%S hs")
-            msg = f"O intervalo global de 2 minutos entre feedbacks não foi respeitado. O próximo feedback poderá " \
-                  f"ser solicitado {next_global_feedbk_dt}"
+            msg = f"O intervalo global entre feedbacks não foi respeitado. O próximo feedback poderá ser " \
+                  f"solicitado {next_global_feedbk_dt}"
             LOGGER.error(f"Origem da requisição: IP={info.client.host}. Modelo: {model_name}. Erro: {msg}")
             return {'job_id': "n/a", 'model_name': model_name, 'method': "get_feedback", 'status': "Error",
                     'response': msg, 'next_feedback_timestamp': next_global_feedbk + 1}
@@ -512,7 +1254,7 @@ async def get_feedback(cr: Annotated[
         timestamp = time()
 
         try:
-            ret = retrieve_docs_feedback("col_jobs", model_name, initial_date, end_date)
+            ret = await executar_bloqueante(retrieve_docs_feedback, "col_jobs", model_name, initial_date, end_date)
         except BaseException as e:
             msg = f"Erro ao tentar obter os jobs para realizar o feedback do modelo {model_name}. Falha na conexão " \
                   f"com o banco de dados"
@@ -521,10 +1263,16 @@ async def get_feedback(cr: Annotated[
             return {'job_id': "n/a", 'model_name': model_name, 'method': "get_feedback", 'status': "Error",
                     'response': msg}
 
-        # O próximo feedback do modelo só poderá ser solicitado daqui a 30 minutos e o global daqui a 2 minutos
+        # Quando só os agregados diários foram lidos, os intervalos até o próximo feedback são os configurados. Se
+        # os jobs de dias anteriores aos agregados foram lidos, o próximo feedback do modelo só poderá ser solicitado
+        # daqui a 30 minutos e o global daqui a 2 minutos
         if ret['bloqueia_novo_feedback']:
-            NEXT_FEEDBACKS_MODELOS[model_name] = time() + 1800
-            NEXT_FEEDBACKS_MODELOS['next_global_feedback'] = time() + 120
+            if ret['dias_legados']:
+                NEXT_FEEDBACKS_MODELOS[model_name] = time() + 1800
+                NEXT_FEEDBACKS_MODELOS['next_global_feedback'] = time() + 120
+            else:
+                NEXT_FEEDBACKS_MODELOS[model_name] = time() + FEEDBACK_MODEL_INTERVAL_SECONDS
+                NEXT_FEEDBACKS_MODELOS['next_global_feedback'] = time() + FEEDBACK_GLOBAL_INTERVAL_SECONDS
 
         if ret['status'] != "Done":
             LOGGER.error(f"Origem da requisição: IP={info.client.host}. Modelo: {model_name}. Método: get_feedback. "
@@ -535,34 +1283,19 @@ async def get_feedback(cr: Annotated[
         # Informa o método para o worker utilizar no processamento do job
         req_info['method'] = 'get_feedback'
 
-        # Prepara as listas de labels para enviar para o worker realizar o feedback
-        y_pred = []
-        y_true = []
-        qtd_labels = 0
-
-        # Quantidade de jobs considerados para o feedback. Esta quantidade pode ser diferente da que foi
-        # reportada pela função 'retrieve_docs_feedback', por conta de que um job de predict pode ter mais de um label
-        # na resposta, assim, pode acontecer de atingir a quantidade máxima de labels com um número menor de jobs
-        qtd_jobs_feedback_computados = 0
-
-        for doc in ret['docs']:
-            if qtd_labels + len(doc['response']) > 30000:  # Para quando for atingir a quantidade máxima de labels
-                break
-
-            y_pred += doc['response']
-            y_true += doc['feedback']
-            qtd_labels += len(doc['response'])
-            qtd_jobs_feedback_computados += 1
-
-        # Fecha o cursor retornado pela função 'retrieve_docs_feedback'
-        ret['docs'].close()
-
-        # Acrescenta as informações para o processamento do feedback e algumas outras adicionais
-        req_info['y_pred'] = y_pred
-        req_info['y_true'] = y_true
+        # Prepara os labels para enviar para o worker realizar o feedback: codificados, se o worker do modelo informou
+        # que os decodifica, ou, para os workers de versões anteriores, em listas
+        if FEEDBACK_ENCODED_LABELS and "encoded_labels" in REGISTRO_FILAS.capacidades(model_name):
+            req_info['encoded_labels'], tipos_labels, qtd_labels = await executar_bloqueante(
+                codificar_labels_feedback, ret['pares'])
+        else:
+            req_info['y_pred'], req_info['y_true'] = await executar_bloqueante(montar_labels_feedback, ret['pares'])
+            tipos_labels = list({true for _, true, _ in ret['pares']})
+            qtd_labels = len(req_info['y_pred'])
 
-        # Coloca as métricas da API em um dicionário para ficarem separadas das métricas retornadas pelos modelos
-        metricas_api = {'feedback_labels_types': list(set(y_true))}
+        # Coloca as métricas da API em um dicionário para ficarem separadas das métricas retornadas pelos modelos. Os
+        # tipos de labels são obtidos sem percorrer as listas de labels
+        metricas_api = {'feedback_labels_types': tipos_labels}
 
         # Trata o caso dos tipos dos labels informados serem diferentes. Caso sejam, fica sem ordenar
         try:
@@ -573,27 +1306,34 @@ async def get_feedback(cr: Annotated[
         metricas_api['qty_computed_labels'] = qtd_labels
         metricas_api['total_jobs_predict_done'] = ret['total_jobs_predict_done']
         metricas_api['total_jobs_has_feedback'] = ret['total_jobs_has_feedback']
-        metricas_api['total_jobs_computed_feedback'] = qtd_jobs_feedback_computados
+
+        # Com o limite de labels, os pares enviados ao worker são uma amostra proporcional dos pares com feedback, por
+        # isso os jobs considerados são estimados na mesma proporção dos labels enviados
+        total_labels = max(qtd_labels + ret['labels_deixados'], 1)
+        metricas_api['total_jobs_computed_feedback'] = round(ret['total_jobs_has_feedback'] * qtd_labels /
+                                                             total_labels)
 
         # Informações adicionais
         add_info = f""
-        if qtd_jobs_feedback_computados != ret['total_jobs_has_feedback']:
-            qtd_jobs_deixados_de_fora = ret['total_jobs_has_feedback'] - qtd_jobs_feedback_computados
-            perc_jobs_deixados_de_fora = f"{((qtd_jobs_deixados_de_fora / ret['total_jobs_has_feedback']) * 100):.2f}%"
-            add_info += f"Nem todos os jobs que possuem feedback foram processados, pois a quantidade máxima de " \
-                        f"labels (30000) por feedback foi alcançada. Foram deixados {qtd_jobs_deixados_de_fora} " \
-                        f"jobs de fora do feedback, perfazendo {perc_jobs_deixados_de_fora} dos jobs que tem " \
-                        f"feedback. "
-
-        perc_feedbacks = f"{((ret['total_jobs_has_feedback'] / ret['total_jobs_predict_done']) * 100):.2f}%"
-        add_info += f"Dos {ret['total_jobs_predict_done']} jobs do método 'predict' que estão com o status 'Done' " \
-                    f"(concluídos), {ret['total_jobs_has_feedback']} receberam feedback do usuário, perfazendo " \
-                    f"{perc_feedbacks} do total de jobs de 'predict' concluídos"
+
+        if ret['labels_deixados']:
+            perc_labels_deixados = f"{(ret['labels_deixados'] / total_labels) * 100:.2f}%"
+            add_info += f"Nem todos os labels com feedback foram processados, pois a quantidade máxima de labels " \
+                        f"({FEEDBACK_MAX_LABELS}) por feedback foi alcançada. Os labels processados são uma amostra " \
+                        f"proporcional de cada par (label predito, label do feedback), deixando " \
+                        f"{ret['labels_deixados']} labels de fora do feedback, perfazendo {perc_labels_deixados} " \
+                        f"dos labels que tem feedback. "
+
+        total_jobs_predict_done = max(ret['total_jobs_predict_done'], 1)
+        perc_feedbacks = f"{((ret['total_jobs_has_feedback'] / total_jobs_predict_done) * 100):.2f}%"
+        add_info += f"Dos {ret['total_jobs_predict_done']} jobs do método 'predict' do período que estão com o " \
+                   f"status 'Done' (concluídos), {ret['total_jobs_has_feedback']} receberam feedback do usuário, " \
+                   f"perfazendo {perc_feedbacks} do total de jobs de 'predict' concluídos"
 
         metricas_api['additional_info'] = add_info
         req_info['api_metrics'] = metricas_api
 
-        worker_id = QUEUE_REG[model_name]
+        worker_id = await executar_bloqueante(fila_metodo, QUEUE_REG[model_name], "get_feedback")
 
         client_key = f"IP_{info.client.host}:{info.client.port}"  # Para ajudar a diversificar o hash
         job_id = generate_hash(client_key)
@@ -607,7 +1347,11 @@ async def get_feedback(cr: Annotated[
         # Ajuda no cálculo do tempo de fila, pois ignora o processamento anterior ao enfileiramento
         req_info['datetime_temp_queue'] = time()
 
-        resp_enfileirar = enfileirar_job(worker_id, model_name, info.client.host, req_info)
+        # Timestamp da criação do job, utilizado no cálculo do tempo total quando o retorno chega pela fila de resultados
+        req_info['datetime'] = timestamp
+
+        resp_enfileirar = await executar_bloqueante(enfileirar_job, worker_id, model_name, info.client.host,
+                                                     req_info)
 
         if resp_enfileirar['status'] != "Done":
             return resp_enfileirar
@@ -618,7 +1362,7 @@ async def get_feedback(cr: Annotated[
                          'datetime': timestamp, 'status': 'Queued', 'initial_date': initial_date, 'end_date': end_date,
                          'queue_response_time_sec': -1, 'total_response_time_sec': -1, 'response': "",
                          'request_source': info.client.host}
-            insert_doc("col_jobs", dados_add)
+            await executar_bloqueante(insert_job, dados_add)
         except BaseException as e:
             msg = "Não foi possível gerar o job. Erro na conexão com o banco de dados"
             LOGGER.error(f"Origem da requisição: IP={info.client.host}. Erro reportado: {msg}: {e.__class__} - {e}")
@@ -637,104 +1381,224 @@ async def get_feedback(cr: Annotated[
         return ret
 
 
-# Endpoint interno: O worker-pub atualiza o status do job_id
-@app.post("/attstatus", include_in_schema=False)
-async def attstatus(info: Request, authorization: Optional[str] = Header(None, include_in_schema=False)):
-    validar_credenciais(authorization, is_worker=True)
-    req_info = await info.json()
-    job_id = req_info['job_id']
-    new_status = req_info['newstatus']
-    ret_validate = validate_request(job_id, new_status, info.client.host)
+# Retorna as estatísticas de funcionamento desta instância da API
+@app.get("/stats", tags=["stats"])
+async def stats(header_value=Security(auth_header),
+                authorization: Optional[str] = Header(None, include_in_schema=False)):
+    validar_credenciais(authorization)
+    return {'result_cache': CACHE_RESULTADOS.resumo(), 'publisher': POOL_PUBLICADOR.resumo(),
+            'write_behind': dict(BUFFER_JOBS.stats), 'admission': CONTROLE_ADMISSAO.resumo(),
+            'results_consumer': dict(CONSUMIDOR_RESULTADOS.stats),
+            'feedback_aggregates': dict(AGREGADOS_FEEDBACK.stats),
+            'claim_check': dict(ARMAZEM_PAYLOADS.stats) if ARMAZEM_PAYLOADS else None}
 
-    if ret_validate['status'] == "Error":
-        return ret_validate  # Não foi validado, retorna o status e a resposta da rotina de validação
 
-    try:
-        result = update_doc("col_jobs", "job_id", job_id, {'status': new_status})
+def buscar_jobs_worker(job_ids: list) -> dict:
+    """
+    Busca os jobs informados pelo worker. Um job recém-criado por outra instância da API pode ainda estar no buffer de
+    escrita dela, por isso os jobs não encontrados são buscados novamente algumas vezes antes de serem considerados
+    inexistentes.
+        :param job_ids: Lista de job_ids.
+        :return: Dicionário com os documentos dos jobs encontrados, indexados pelo job_id.
+    """
+    jobs = {doc['job_id']: doc for doc in retrieve_jobs(job_ids)}
+
+    for espera in (0.05, 0.2, 0.75):
+        ausentes = list(set(job_ids) - jobs.keys())
+
+        if not ausentes:
+            break
+
+        sleep(espera)
+        jobs.update({doc['job_id']: doc for doc in retrieve_jobs(ausentes)})
+
+    return jobs
+
+
+def aplicar_status_lote(itens: list, client_host) -> list:
+    """
+    Aplica um lote de mudanças de status enviadas pelo worker no endpoint '/attstatus'.
+        :param itens: Lista com as mudanças de status ('job_id' e 'newstatus').
+        :param client_host: Informação do host que fez a requisição.
+        :return: Lista, na mesma ordem dos itens, com o status da atualização de cada job.
+    """
+    respostas = [None] * len(itens)
+    validos = []  # Posições dos itens validados
+
+    for i, item in enumerate(itens):
+        ret_validate = validate_request(item.get('job_id'), item.get('newstatus'), client_host)
 
-        if result.modified_count:
-            return {'status': "Done", 'response': ""}  # Não retorna detalhes porque o worker não salva isso no log
+        if ret_validate['status'] == "Error":
+            respostas[i] = ret_validate  # Não foi validado, retorna o status e a resposta da rotina de validação
         else:
-            return {'status': "Error", 'response': f"Não foi possível encontrar o job {job_id}"}
+            validos.append(i)
+
+    if not validos:
+        return respostas
+
+    try:
+        jobs = buscar_jobs_worker([itens[i]['job_id'] for i in validos])
     except BaseException as e:
-        msg = f"Não foi possível atualizar o status do job {job_id}. Erro na conexão com o banco de dados"
+        msg = "Não foi possível atualizar o status dos jobs. Erro na conexão com o banco de dados"
         LOGGER.error(f"{msg}: {e.__class__} - {e}")
         gerar_arquivo_erro()
-        return {'status': "Error", 'response': msg}
 
+        for i in validos:
+            respostas[i] = {'status': "Error", 'response': msg}
 
-# Endpoint interno: O worker-pub atualiza para "Done" ou "Error" e retorna os resultados do predict
-@app.post("/retorno", include_in_schema=False)
-async def retorno(info: Request, authorization: Optional[str] = Header(None, include_in_schema=False)):
-    validar_credenciais(authorization, is_worker=True)
-    req_info = await info.json()
-    job_id = req_info['job_id']
-    return_status = req_info['status']
-    ret_validate = validate_request(job_id, return_status, info.client.host)
+        return respostas
 
-    if ret_validate['status'] == "Error":
-        return ret_validate  # Não foi validado, retorna o status e a resposta da rotina de validação
+    for i in validos:
+        job_id = itens[i]['job_id']
 
-    try:
-        result = retrieve_doc("col_jobs", "job_id", job_id)
+        if job_id not in jobs:
+            respostas[i] = {'status': "Error", 'response': f"Não foi possível encontrar o job {job_id}"}
+            continue
 
-        if result:
-            total_response_time_sec = time() - result['datetime']
-            campos_atualizar = {'status': return_status, 'queue_response_time_sec': req_info['queue_response_time_sec'],
-                                'total_response_time_sec': total_response_time_sec, 'response': req_info['response'],
-                                'model_version': req_info['model_version']}
-            update_doc("col_jobs", "_id", result['_id'], campos_atualizar)
-            return {'status': "Done", 'response': ""}  # Não retorna detalhes porque o worker não salva isso no log
+        try:
+            # A atualização é gravada pelo buffer de escrita, em lote. Se o job terminar antes da gravação, as duas
+            # atualizações são combinadas em uma só. Um status que chega depois do job terminar é descartado
+            update_job(job_id, {'status': itens[i]['newstatus']})
+            respostas[i] = {'status': "Done", 'response': ""}  # Sem detalhes, o worker não salva isso no log
+        except BaseException as e:
+            msg = f"Não foi possível atualizar o status do job {job_id}. Erro na conexão com o banco de dados"
+            LOGGER.error(f"{msg}: {e.__class__} - {e}")
+            gerar_arquivo_erro()
+            respostas[i] = {'status': "Error", 'response': msg}
+
+    return respostas
+
+
+def aplicar_retornos_lote(itens: list, client_host) -> list:
+    """
+    Aplica um lote de retornos enviados pelo worker no endpoint '/retorno'. Os jobs são lidos de uma só vez e as
+    atualizações são gravadas em lote pelo buffer de escrita.
+        :param itens: Lista com os retornos dos jobs.
+        :param client_host: Informação do host que fez a requisição.
+        :return: Lista, na mesma ordem dos itens, com o status da atualização de cada job.
+    """
+    respostas = [None] * len(itens)
+    validos = []  # Posições dos itens validados
+
+    for i, item in enumerate(itens):
+        ret_validate = validate_request(item.get('job_id'), item.get('status'), client_host)
+
+        if ret_validate['status'] == "Error":
+            respostas[i] = ret_validate  # Não foi validado, retorna o status e a resposta da rotina de validação
         else:
-            return {'status': "Error", 'response': f"Não foi possível encontrar o job {job_id}"}
+            validos.append(i)
+
+    if not validos:
+        return respostas
+
+    try:
+        jobs = buscar_jobs_worker([itens[i]['job_id'] for i in validos])
     except BaseException as e:
-        msg = f"Não foi possível salvar o retorno dos dados e atualizar o status do job {job_id}. Falha na conexão " \
-              f"com o banco de dados: {e.__class__} - {e}"
+        msg = f"Não foi possível salvar o retorno dos dados e atualizar o status dos jobs. Falha na conexão com o " \
+              f"banco de dados: {e.__class__} - {e}"
         LOGGER.error(msg)
         gerar_arquivo_erro()
-        return {'status': "Error", 'response': f"{msg}"}
+
+        for i in validos:
+            respostas[i] = {'status': "Error", 'response': msg}
+
+        return respostas
+
+    for i in validos:
+        job_id = itens[i]['job_id']
+        result = jobs.get(job_id)
+
+        if not result:
+            respostas[i] = {'status': "Error", 'response': f"Não foi possível encontrar o job {job_id}"}
+            continue
+
+        try:
+            aplicar_retorno(job_id, itens[i], result['datetime'], result.get('model_name'), result.get('method'))
+            respostas[i] = {'status': "Done", 'response': ""}  # Sem detalhes, o worker não salva isso no log
+        except BaseException as e:
+            msg = f"Não foi possível salvar o retorno dos dados e atualizar o status do job {job_id}. Falha na " \
+                  f"conexão com o banco de dados: {e.__class__} - {e}"
+            LOGGER.error(msg)
+            gerar_arquivo_erro()
+            respostas[i] = {'status': "Error", 'response': msg}
+
+    return respostas
+
+
+# Endpoint interno: O worker-pub atualiza o status do job_id. Aceita uma atualização ou uma lista de atualizações
+@app.post("/attstatus", include_in_schema=False)
+async def attstatus(info: Request, authorization: Optional[str] = Header(None, include_in_schema=False)):
+    validar_credenciais(authorization, is_worker=True)
+    req_info = orjson.loads(await info.body())
+
+    if type(req_info) is list:
+        return {'status': "Done", 'response': await executar_bloqueante(aplicar_status_lote, req_info,
+                                                                          info.client.host)}
+
+    return (await executar_bloqueante(aplicar_status_lote, [req_info], info.client.host))[0]
+
+
+# Endpoint interno: O worker-pub atualiza para "Done" ou "Error" e retorna os resultados do predict. Aceita um retorno
+# ou uma lista de retornos
+@app.post("/retorno", include_in_schema=False)
+async def retorno(info: Request, authorization: Optional[str] = Header(None, include_in_schema=False)):
+    validar_credenciais(authorization, is_worker=True)
+    req_info = orjson.loads(await info.body())
+
+    if type(req_info) is list:
+        return {'status': "Done", 'response': await executar_bloqueante(aplicar_retornos_lote, req_info,
+                                                                          info.client.host)}
+
+    return (await executar_bloqueante(aplicar_retornos_lote, [req_info], info.client.host))[0]
 
 
 # Endpoint interno: O worker-pub informa o seu 'worker_id' e modelos para validação da criação das filas
 @app.post("/advworkid", include_in_schema=False)
 async def advworkid(info: Request):
-    global QUEUE_REG
-    req_info = await info.json()
+    req_info = orjson.loads(await info.body())
 
     if req_info['advworkid_cred'] == ADVWORKID_CRED:
         worker_id = req_info['worker_id']
         models = req_info['models']
 
+        # Formatos de mensagem que o worker decodifica. Os workers de versões anteriores não informam e recebem JSON
+        formatos = req_info.get('wire_formats') or ["json"]
+
+        # Capacidades opcionais do worker (ex.: claim-check). Os workers de versões anteriores não informam nenhuma
+        capacidades = sorted(req_info.get('capabilities') or [])
+
         if worker_id:
             LOGGER.info(f"Registrando o worker: {worker_id} ...")
 
-            # Registra os modelos atendidos pelo worker
+            # Uma versão nova de um modelo invalida os resultados do modelo guardados no cache de todas as instâncias
+            for m, versao in req_info.get('models_versions', {}).items():
+                await executar_bloqueante(definir_versao_modelo, m, versao)
+
+            # Registra os modelos atendidos pelo worker. Cada modelo é gravado individualmente e as demais instâncias
+            # da API são avisadas da alteração
             for m in models:
-                if m not in QUEUE_REG:  # Registra se for novo
-                    QUEUE_REG[m] = worker_id
-                    resp = save_queue_registry(queue_registry=QUEUE_REG)
+                old_worker_id = QUEUE_REG.get(m)
+
+                if old_worker_id == worker_id and REGISTRO_FILAS.formatos(m) == formatos and \
+                        REGISTRO_FILAS.capacidades(m) == capacidades:
+                    continue
+
+                resp = await executar_bloqueante(save_queue_registry, m, worker_id, formatos, capacidades)
 
-                    if resp['status'] == "Done":
+                if resp['status'] == "Done":
+                    if old_worker_id is None:  # Registra se for novo
                         LOGGER.info(f"Novo modelo cadastrado........................: {m}")
-                    else:
-                        ret = {'status': "Error", 'response': f"Não foi possível informar o nome do modelo '{m}' e "
-                                                              f"worker_id. Retorno da API: {resp['response']}"}
-                        LOGGER.error(f"{ret}")
-                        return ret
+                    elif old_worker_id == worker_id:  # O worker foi atualizado e informou outros formatos/capacidades
+                        LOGGER.info(f"Formatos de mensagem e capacidades do worker {worker_id} para o modelo '{m}': "
+                                    f"{formatos}; {capacidades}")
+                    else:  # Se trocou o worker id, atualiza o worker id responsável pelo modelo
+                        LOGGER.info(f"O worker responsável pelo modelo '{m}' foi alterado de {old_worker_id} "
+                                    f"para {worker_id}")
                 else:
-                    if QUEUE_REG[m] != worker_id:  # Se trocou o worker id, atualiza o worker id responsável pelo modelo
-                        old_worker_id = QUEUE_REG[m]
-                        QUEUE_REG[m] = worker_id
-                        resp = save_queue_registry(queue_registry=QUEUE_REG)
-
-                        if resp['status'] == "Done":
-                            LOGGER.info(f"O worker responsável pelo modelo '{m}' foi alterado de {old_worker_id} "
-                                        f"para {worker_id}")
-                        else:
-                            ret = {'status': "Error", 'response': f"Não foi possível informar o nome do modelo '{m}' e "
-                                                                  f"worker_id. Retorno da API: {resp['response']}"}
-                            LOGGER.error(f"{ret}")
-                            return ret
+                    ret = {'status': "Error", 'response': f"Não foi possível informar o nome do modelo '{m}' e "
+                                                          f"worker_id. Retorno da API: {resp['response']}"}
+                    LOGGER.error(f"{ret}")
+                    return ret
 
             return {'status': "Done", 'response': f"O 'work_id' {worker_id} e modelo(s) {list(models)} foram "
                                                   f"informados com sucesso!"}
@@ -0,0 +1,82 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Notificação, dentro do processo da API, da conclusão dos jobs.
+#
+# As requisições que desejam aguardar pelo resultado de um job registram um 'future' para o job_id. Quando o
+# resultado chega (vindo de qualquer thread), todos os 'futures' registrados para aquele job_id são resolvidos no
+# event loop da API.
+# --------------------------------------------------------------------------------------------------------------------
+import asyncio
+
+
+class NotificadorJobs:
+    """
+    Mantém os 'futures' das requisições que aguardam a conclusão de jobs e os resolve quando o resultado chega.
+    """
+    def __init__(self):
+        self._loop = None
+        self._aguardando = {}  # job_id -> conjunto de 'futures' aguardando o resultado
+
+    def iniciar(self, loop: asyncio.AbstractEventLoop):
+        """
+        Define o event loop onde os 'futures' serão resolvidos. Deve ser chamado na inicialização da API.
+            :param loop: Event loop da API.
+        """
+        self._loop = loop
+
+    @property
+    def ativo(self) -> bool:
+        return self._loop is not None
+
+    def registrar(self, job_id: str) -> asyncio.Future:
+        """
+        Registra o interesse no resultado de um job. Deve ser chamado no event loop, antes do job ser enfileirado, para
+        não perder um resultado que chegue muito rápido.
+            :param job_id: Job ID que será aguardado.
+            :return: 'Future' que será resolvido com o resultado do job.
+        """
+        fut = self._loop.create_future()
+        self._aguardando.setdefault(job_id, set()).add(fut)
+        return fut
+
+    def remover(self, job_id: str, fut: asyncio.Future):
+        """
+        Remove o registro de um 'future' (por exemplo, quando o tempo de espera acabou).
+        """
+        futs = self._aguardando.get(job_id)
+
+        if futs is not None:
+            futs.discard(fut)
+
+            if not futs:
+                del self._aguardando[job_id]
+
+    def notificar(self, job_id: str, resultado: dict):
+        """
+        Informa o resultado de um job. Pode ser chamado de qualquer thread.
+            :param job_id: Job ID concluído.
+            :param resultado: Resultado do job.
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        self._loop.call_soon_threadsafe(self._resolver, job_id, resultado)
+
+    def _resolver(self, job_id: str, resultado: dict):
+        for fut in self._aguardando.pop(job_id, ()):
+            if not fut.done():
+                fut.set_result(resultado)
+
+    async def aguardar(self, job_id: str, fut: asyncio.Future, timeout: float):
+        """
+        Aguarda o resultado de um job por um tempo máximo.
+            :param job_id: Job ID aguardado.
+            :param fut: 'Future' obtido através do método 'registrar'.
+            :param timeout: Tempo máximo de espera, em segundos.
+            :return: Resultado do job ou None, caso o tempo de espera tenha acabado.
+        """
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.remover(job_id, fut)
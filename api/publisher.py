@@ -0,0 +1,357 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Publicador persistente de jobs no servidor de filas (RabbitMQ).
+#
+# Mantém um pool de conexões/canais abertos durante toda a vida do processo da API, evitando que cada requisição
+# pague o handshake TCP + AMQP. Os canais trabalham em modo 'publisher confirms' e as mensagens são publicadas com a
+# flag 'mandatory', assim uma fila ausente é detectada na própria publicação. Os lotes são publicados em um segundo
+# canal da conexão, em modo transacional, para aguardar uma única confirmação do servidor para o lote inteiro (no
+# pika, o 'publisher confirms' da BlockingConnection aguarda a confirmação de cada mensagem). Também guarda uma visão
+# em cache das filas dos workers que existem (obtida via 'queue_declare' passivo), com a quantidade de mensagens e
+# consumidores.
+# --------------------------------------------------------------------------------------------------------------------
+import pika
+import queue
+import threading
+from time import time
+from pika.exceptions import ChannelClosed, UnroutableError, NackError, AMQPError
+
+
+class FilaAusenteError(Exception):
+    """
+    Indica que a fila de destino não existe no servidor de filas (não há workers escutando a fila).
+    """
+    pass
+
+
+class PoolPublicadores:
+    """
+    Pool de conexões/canais do pika para publicação de mensagens. Cada canal é utilizado por uma única thread por vez
+    (o pika não é thread-safe), por isso os canais são emprestados e devolvidos ao pool a cada publicação.
+    """
+    def __init__(self, host: str, port: int, usuario: str, senha: str, exchange: str = "mlapi_exchange",
+                 tamanho_pool: int = 4, heartbeat: int = 60, ttl_cache_filas: float = 30.0, logger=None):
+        """
+        :param host: Endereço do servidor de filas.
+        :param port: Porta do servidor de filas.
+        :param usuario: Usuário para autenticação no servidor de filas.
+        :param senha: Senha para autenticação no servidor de filas.
+        :param exchange: Exchange onde os jobs serão publicados.
+        :param tamanho_pool: Quantidade máxima de conexões/canais abertos simultaneamente.
+        :param heartbeat: Intervalo de heartbeat (em segundos) negociado com o servidor de filas.
+        :param ttl_cache_filas: Tempo (em segundos) que a informação sobre a existência de uma fila fica em cache.
+        :param logger: Logger utilizado para registrar os eventos do pool.
+        """
+        self.exchange = exchange
+        self.tamanho_pool = tamanho_pool
+        self.ttl_cache_filas = ttl_cache_filas
+        self._logger = logger
+        self._parametros = pika.ConnectionParameters(host=host, port=port, heartbeat=heartbeat,
+                                                     credentials=pika.PlainCredentials(usuario, senha))
+        self._intervalo_manutencao = max(heartbeat / 3, 1)
+        self._disponiveis = queue.LifoQueue()  # LIFO para reaproveitar os canais mais 'quentes'
+        self._lock = threading.Lock()
+        self._qtd_criados = 0
+
+        # Cache das filas: nome da fila -> {'expira': timestamp, 'mensagens': int, 'consumidores': int}
+        self._filas = {}
+
+        # Exchanges auxiliares já declarados por este pool
+        self._exchanges_declarados = set()
+
+        # Estatísticas simples do pool
+        self.stats = {'publicacoes': 0, 'reconexoes': 0, 'filas_ausentes': 0}
+
+        self._thread_manutencao = threading.Thread(target=self._manter_conexoes, daemon=True)
+        self._thread_manutencao.start()
+
+    def _contar(self, **incrementos):
+        """
+        Atualiza as estatísticas do pool. As publicações acontecem em várias threads ao mesmo tempo, por isso os
+        contadores são protegidos pelo lock do pool.
+        """
+        with self._lock:
+            for campo, valor in incrementos.items():
+                self.stats[campo] += valor
+
+    def resumo(self) -> dict:
+        """
+        Retorna uma cópia das estatísticas do pool.
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def _log_erro(self, msg: str):
+        if self._logger:
+            self._logger.error(msg)
+
+    def _novo_canal(self) -> dict:
+        """
+        Abre uma nova conexão com o servidor de filas e retorna o canal, já em modo 'publisher confirms'.
+            :return: Dicionário contendo a conexão, o canal e o timestamp do último uso.
+        """
+        conexao = pika.BlockingConnection(self._parametros)
+        canal = conexao.channel()
+        canal.confirm_delivery()
+        return {'conexao': conexao, 'canal': canal, 'ultimo_uso': time()}
+
+    def _emprestar(self, timeout: float = 10.0) -> dict:
+        """
+        Obtém um canal do pool. Cria um novo se ainda não atingiu o tamanho máximo; caso contrário, aguarda algum
+        canal ser devolvido.
+            :param timeout: Tempo máximo (em segundos) para aguardar por um canal livre.
+            :return: Canal emprestado.
+        """
+        try:
+            return self._disponiveis.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            pode_criar = self._qtd_criados < self.tamanho_pool
+
+            if pode_criar:
+                self._qtd_criados += 1
+
+        if pode_criar:
+            try:
+                return self._novo_canal()
+            except BaseException:
+                with self._lock:
+                    self._qtd_criados -= 1
+                raise
+
+        return self._disponiveis.get(timeout=timeout)
+
+    def _devolver(self, item: dict):
+        item['ultimo_uso'] = time()
+        self._disponiveis.put(item)
+
+    def _descartar(self, item: dict):
+        """
+        Fecha (se possível) e descarta um canal com problema, liberando espaço no pool para um novo.
+        """
+        try:
+            if item['conexao'].is_open:
+                item['conexao'].close()
+        except BaseException:
+            pass
+
+        with self._lock:
+            self._qtd_criados -= 1
+
+    @staticmethod
+    def _canal_lote(item: dict) -> tuple:
+        """
+        Obtém o canal transacional de um item do pool, utilizado na publicação dos lotes. O canal é aberto no primeiro
+        uso e guarda as mensagens devolvidas pelo servidor de filas (fila de destino ausente).
+            :param item: Item do pool.
+            :return: Tupla contendo: canal e conjunto de mensagens devolvidas (nome da fila, corpo da mensagem).
+        """
+        canal = item.get('canal_lote')
+
+        if canal is None or not canal.is_open:
+            devolvidas = set()
+            canal = item['conexao'].channel()
+            canal.tx_select()
+            canal.add_on_return_callback(lambda _ch, method, _props, body: devolvidas.add((method.routing_key, body)))
+            item['canal_lote'] = canal
+            item['devolvidas'] = devolvidas
+
+        return canal, item['devolvidas']
+
+    def _restaurar_canal(self, item: dict):
+        """
+        Reabre o canal de um item do pool caso ele tenha sido fechado pelo servidor de filas e o devolve ao pool. O
+        canal dos lotes é reaberto no próximo uso.
+        """
+        try:
+            if not item['canal'].is_open:
+                item['canal'] = item['conexao'].channel()
+                item['canal'].confirm_delivery()
+
+            self._devolver(item)
+        except BaseException:
+            self._descartar(item)
+
+    def _manter_conexoes(self):
+        """
+        Rotina executada em background para atender aos heartbeats das conexões ociosas. Sem isso o servidor de filas
+        encerraria as conexões que ficaram sem publicar por muito tempo.
+        """
+        while True:
+            threading.Event().wait(self._intervalo_manutencao)
+            ociosos = []
+
+            # Só pega os canais que estão livres no momento, os demais estão em uso e serão atendidos pela publicação
+            while True:
+                try:
+                    ociosos.append(self._disponiveis.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in ociosos:
+                try:
+                    item['conexao'].process_data_events(time_limit=0)
+                    self._disponiveis.put(item)
+                except BaseException:
+                    self._descartar(item)
+
+    def _executar(self, operacao, lote: bool = False):
+        """
+        Executa uma operação em um canal do pool. Em caso de falha de conexão, descarta o canal e tenta novamente uma
+        única vez com uma conexão nova.
+            :param operacao: Função que recebe o canal pika e realiza a operação desejada.
+            :param lote: Indica se a operação recebe o canal transacional dos lotes (ver '_canal_lote').
+            :return: Retorno da operação.
+        """
+        for tentativa in range(2):
+            item = self._emprestar()
+
+            try:
+                resultado = operacao(self._canal_lote(item) if lote else item['canal'])
+            except (UnroutableError, NackError, FilaAusenteError, ChannelClosed):
+                # O canal pode ter sido fechado pelo servidor, mas a conexão ainda pode ser aproveitada
+                self._restaurar_canal(item)
+                raise
+            except (AMQPError, OSError) as e:
+                self._descartar(item)
+
+                if tentativa == 0:
+                    self._contar(reconexoes=1)
+                    self._log_erro(f"Conexão com o servidor de filas perdida. Reconectando: {e.__class__} - {e}")
+                    continue
+
+                raise
+            except BaseException:
+                self._descartar(item)
+                raise
+
+            self._devolver(item)
+            return resultado
+
+    def consultar_fila(self, queue_name: str, usar_cache: bool = True) -> dict:
+        """
+        Verifica se uma fila existe, consultando o cache ou fazendo um 'queue_declare' passivo.
+            :param queue_name: Nome da fila.
+            :param usar_cache: Indica se pode utilizar a informação em cache.
+            :return: Dicionário com a quantidade de mensagens e consumidores da fila.
+        """
+        info = self._filas.get(queue_name)
+
+        if usar_cache and info and info['expira'] > time():
+            return info
+
+        def declarar(canal):
+            try:
+                return canal.queue_declare(queue=queue_name, passive=True)
+            except ChannelClosed as e:
+                if e.reply_code == 404:
+                    raise FilaAusenteError(queue_name)
+                raise
+
+        try:
+            r = self._executar(declarar)
+        except FilaAusenteError:
+            self._filas.pop(queue_name, None)
+            raise
+
+        info = {'expira': time() + self.ttl_cache_filas, 'mensagens': r.method.message_count,
+                'consumidores': r.method.consumer_count}
+        self._filas[queue_name] = info
+        return info
+
+    def invalidar_fila(self, queue_name: str):
+        """
+        Remove uma fila do cache, forçando uma nova consulta ao servidor de filas.
+        """
+        self._filas.pop(queue_name, None)
+
+    def publicar(self, queue_name: str, body: bytes, properties: pika.BasicProperties = None):
+        """
+        Publica uma mensagem em uma fila de worker. Lança 'FilaAusenteError' caso a fila não exista.
+            :param queue_name: Nome da fila (routing key no exchange).
+            :param body: Corpo da mensagem.
+            :param properties: Propriedades AMQP da mensagem.
+        """
+        self.consultar_fila(queue_name)
+
+        def publicar_msg(canal):
+            canal.basic_publish(exchange=self.exchange, routing_key=queue_name, body=body, properties=properties,
+                                mandatory=True)
+
+        try:
+            self._executar(publicar_msg)
+        except (UnroutableError, NackError):
+            # A fila deixou de existir desde a última consulta (por exemplo, o worker foi desligado)
+            self.invalidar_fila(queue_name)
+            self._contar(filas_ausentes=1)
+            raise FilaAusenteError(queue_name)
+
+        self._contar(publicacoes=1)
+
+    def publicar_lote(self, mensagens: list) -> list:
+        """
+        Publica um lote de mensagens utilizando um único canal do pool. As mensagens são publicadas em uma transação e
+        o servidor de filas confirma o lote inteiro de uma só vez.
+            :param mensagens: Lista de tuplas (nome da fila, corpo da mensagem, propriedades AMQP da mensagem ou None).
+            :return: Lista, na mesma ordem das mensagens, indicando se cada mensagem foi publicada (True) ou se a fila
+                     de destino não existe (False).
+        """
+        resultados = [None] * len(mensagens)
+
+        # Descarta logo as mensagens destinadas às filas que não existem
+        for fila in {m[0] for m in mensagens}:
+            try:
+                self.consultar_fila(fila)
+            except FilaAusenteError:
+                for i, m in enumerate(mensagens):
+                    if m[0] == fila:
+                        resultados[i] = False
+
+        def publicar_msgs(canal_lote):
+            # Em caso de reconexão a operação é repetida para as mensagens pendentes, pois a transação não confirmada
+            # é descartada pelo servidor de filas
+            canal, devolvidas = canal_lote
+            pendentes = [i for i, publicado in enumerate(resultados) if publicado is None]
+            devolvidas.clear()
+
+            for i in pendentes:
+                fila, body, properties = mensagens[i]
+                canal.basic_publish(exchange=self.exchange, routing_key=fila, body=body, properties=properties,
+                                    mandatory=True)
+
+            canal.tx_commit()
+
+            # As mensagens sem fila de destino são devolvidas pelo servidor antes da confirmação da transação
+            canal.connection.process_data_events(time_limit=0)
+
+            for i in pendentes:
+                fila, body, _ = mensagens[i]
+                resultados[i] = (fila, body) not in devolvidas
+
+                if not resultados[i]:
+                    self.invalidar_fila(fila)
+
+        if None in resultados:
+            self._executar(publicar_msgs, lote=True)
+
+        self._contar(publicacoes=resultados.count(True), filas_ausentes=resultados.count(False))
+        return resultados
+
+    def publicar_exchange(self, exchange: str, body: bytes, exchange_type: str = "fanout", routing_key: str = ""):
+        """
+        Publica uma mensagem em um exchange auxiliar (por exemplo, os avisos entre as instâncias da API). O exchange é
+        declarado na primeira publicação.
+            :param exchange: Nome do exchange.
+            :param body: Corpo da mensagem.
+            :param exchange_type: Tipo do exchange.
+            :param routing_key: Routing key da mensagem.
+        """
+        def publicar_msg(canal):
+            if exchange not in self._exchanges_declarados:
+                canal.exchange_declare(exchange=exchange, exchange_type=exchange_type, durable=True)
+                self._exchanges_declarados.add(exchange)
+
+            canal.basic_publish(exchange=exchange, routing_key=routing_key, body=body)
+
+        self._executar(publicar_msg)
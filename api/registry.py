@@ -0,0 +1,251 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Registro versionado das filas dos workers (modelo -> worker_id).
+#
+# Cada modelo é um documento próprio na coleção 'col_queue_models', atualizado de forma atômica (upsert por modelo)
+# e com uma versão obtida de um contador global. Quando uma instância da API altera o registro, ela avisa as demais
+# através de um exchange 'fanout' no servidor de filas, assim a mudança de rota chega em milissegundos. Como
+# alternativa, caso algum aviso se perca, cada instância lê periodicamente as versões de todos os modelos e aplica as que
+# forem mais novas que as conhecidas. A comparação é feita por modelo, pois as versões são obtidas antes da gravação e
+# um aviso de versão maior pode chegar antes de uma alteração de versão menor.
+#
+# O mesmo exchange também leva os avisos de versão nova de um modelo ('tipo' = "versao_modelo"), que invalidam os
+# resultados do modelo guardados no cache de cada instância. Sem esses avisos, só a instância que recebeu o registro do
+# worker ou o retorno do job saberia da versão nova (no modo 'lazy', o worker só informa as versões dos modelos
+# carregados).
+#
+# Cada modelo também guarda os formatos de mensagem ('wire_formats') que o worker informou decodificar e as
+# capacidades opcionais que o worker informou suportar ('capabilities', ex.: "claim_check"). Os workers de versões
+# anteriores não informam os formatos nem as capacidades e recebem as mensagens em JSON, sem os recursos opcionais.
+#
+# OBS.: o MongoDB da stack roda sem replica set, por isso não é possível utilizar change streams.
+# --------------------------------------------------------------------------------------------------------------------
+import orjson
+import pika
+import threading
+from time import time
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Exchange utilizado para avisar as instâncias da API sobre as alterações no registro
+EXCHANGE_REGISTRO = "mlapi_registry_exchange"
+
+
+class RegistroFilas:
+    """
+    Mantém, em memória, o registro das filas dos workers sincronizado entre as instâncias da API.
+    """
+    def __init__(self, bd, publicador, host: str, port: int, usuario: str, senha: str,
+                 intervalo_verificacao: float = 30.0, logger=None, ao_falhar=None, ao_mudar_versao_modelo=None):
+        """
+        :param bd: Base de dados (pymongo) onde o registro é persistido.
+        :param publicador: Instância de 'PoolPublicadores' utilizada para avisar as demais instâncias.
+        :param host: Endereço do servidor de filas.
+        :param port: Porta do servidor de filas.
+        :param usuario: Usuário para autenticação no servidor de filas.
+        :param senha: Senha para autenticação no servidor de filas.
+        :param intervalo_verificacao: Intervalo (em segundos) da verificação periódica da versão do registro.
+        :param logger: Logger utilizado para registrar os eventos do registro.
+        :param ao_falhar: Função chamada quando acontece uma falha no acesso ao banco de dados.
+        :param ao_mudar_versao_modelo: Função chamada com o nome e a versão do modelo quando outra instância avisa que
+                                       um modelo mudou de versão.
+        """
+        self._col = bd["col_queue_models"]
+        self._col_meta = bd["col_queue_registry"]
+        self._publicador = publicador
+        self._parametros = pika.ConnectionParameters(host=host, port=port, heartbeat=30,
+                                                     credentials=pika.PlainCredentials(usuario, senha))
+        self._intervalo_verificacao = intervalo_verificacao
+        self._logger = logger
+        self._ao_falhar = ao_falhar
+        self._ao_mudar_versao_modelo = ao_mudar_versao_modelo
+        self._lock = threading.Lock()
+
+        # Registro em memória: nome do modelo -> worker_id. O dicionário nunca é substituído, só alterado
+        self.filas = {}
+        self._versoes = {}  # nome do modelo -> versão do registro do modelo
+        self._formatos = {}  # nome do modelo -> formatos de mensagem aceitos pelo worker do modelo
+        self._capacidades = {}  # nome do modelo -> capacidades opcionais suportadas pelo worker do modelo
+
+    def _log_erro(self, msg: str):
+        if self._logger:
+            self._logger.error(msg)
+
+        if self._ao_falhar:
+            self._ao_falhar()
+
+    def carregar(self):
+        """
+        Carrega o registro do banco de dados. Caso ainda exista somente o registro antigo (um único documento com
+        todas as filas), migra os modelos para o novo formato.
+        """
+        docs = list(self._col.find({}))
+
+        if not docs:
+            legado = self._col_meta.find_one({'_id': ObjectId("000000000000aaaabbbbffff")})
+
+            if legado and legado.get('queue_registry'):
+                for model_name, worker_id in legado['queue_registry'].items():
+                    self.registrar(model_name, worker_id, avisar=False)
+
+                if self._logger:
+                    self._logger.info(f"Registro de filas migrado para a coleção 'col_queue_models': "
+                                      f"{list(legado['queue_registry'].keys())}")
+                return
+
+        for doc in docs:
+            self._aplicar(doc['_id'], doc['worker_id'], doc['version'], doc.get('wire_formats'),
+                          doc.get('capabilities'))
+
+    def _proxima_versao(self) -> int:
+        r = self._col_meta.find_one_and_update({'_id': "versao_registro"}, {'$inc': {'version': 1}}, upsert=True,
+                                               return_document=ReturnDocument.AFTER)
+        return r['version']
+
+    def _aplicar(self, model_name: str, worker_id: str, versao: int, formatos: list = None,
+                 capacidades: list = None) -> bool:
+        """
+        Aplica uma alteração no registro em memória, caso ela seja mais nova que a conhecida.
+            :return: True, se a alteração foi aplicada. False, caso contrário.
+        """
+        with self._lock:
+            if versao <= self._versoes.get(model_name, 0):
+                return False
+
+            self.filas[model_name] = worker_id
+            self._versoes[model_name] = versao
+            self._formatos[model_name] = formatos or ["json"]
+            self._capacidades[model_name] = capacidades or []
+            return True
+
+    def formatos(self, model_name: str) -> list:
+        """
+        Retorna os formatos de mensagem aceitos pelo worker de um modelo (somente JSON se o worker não os informou).
+        """
+        return self._formatos.get(model_name, ["json"])
+
+    def capacidades(self, model_name: str) -> list:
+        """
+        Retorna as capacidades opcionais suportadas pelo worker de um modelo (nenhuma se o worker não as informou).
+        """
+        return self._capacidades.get(model_name, [])
+
+    def registrar(self, model_name: str, worker_id: str, formatos: list = None, capacidades: list = None,
+                  avisar: bool = True) -> int:
+        """
+        Registra (ou altera) o worker responsável por um modelo e avisa as demais instâncias da API.
+            :param model_name: Nome do modelo.
+            :param worker_id: Worker ID (nome da fila) responsável pelo modelo.
+            :param formatos: Formatos de mensagem aceitos pelo worker. Se não for informado, somente JSON.
+            :param capacidades: Capacidades opcionais suportadas pelo worker. Se não for informado, nenhuma.
+            :param avisar: Indica se as demais instâncias devem ser avisadas.
+            :return: Versão do registro gerada para a alteração.
+        """
+        versao = self._proxima_versao()
+        formatos = formatos or ["json"]
+        capacidades = capacidades or []
+
+        try:
+            # Só sobrescreve se a versão gravada for mais antiga (outra instância pode ter gravado uma mais nova)
+            self._col.update_one({'_id': model_name, 'version': {'$lt': versao}},
+                                 {'$set': {'worker_id': worker_id, 'version': versao, 'wire_formats': formatos,
+                                           'capabilities': capacidades, 'updated_at': time()}},
+                                 upsert=True)
+        except DuplicateKeyError:
+            return versao  # Já existe uma versão mais nova para o modelo
+
+        self._aplicar(model_name, worker_id, versao, formatos, capacidades)
+
+        if avisar:
+            evento = {'model_name': model_name, 'worker_id': worker_id, 'version': versao, 'wire_formats': formatos,
+                      'capabilities': capacidades}
+
+            try:
+                self._publicador.publicar_exchange(EXCHANGE_REGISTRO, orjson.dumps(evento))
+            except BaseException as e:
+                # As demais instâncias vão obter a alteração na verificação periódica
+                if self._logger:
+                    self._logger.error(f"Não foi possível avisar as instâncias da API sobre a alteração no registro "
+                                       f"de filas: {e.__class__} - {e}")
+
+        return versao
+
+    def avisar_versao_modelo(self, model_name: str, model_version: str):
+        """
+        Avisa as demais instâncias da API que um modelo mudou de versão.
+            :param model_name: Nome do modelo.
+            :param model_version: Versão nova do modelo.
+        """
+        evento = {'tipo': "versao_modelo", 'model_name': model_name, 'model_version': model_version}
+
+        try:
+            self._publicador.publicar_exchange(EXCHANGE_REGISTRO, orjson.dumps(evento))
+        except BaseException as e:
+            # Os resultados antigos deixam de ser utilizados quando expirarem no cache das demais instâncias
+            if self._logger:
+                self._logger.error(f"Não foi possível avisar as instâncias da API sobre a versão nova do modelo "
+                                   f"'{model_name}': {e.__class__} - {e}")
+
+    def sincronizar(self):
+        """
+        Lê as versões de todos os modelos do registro (um documento pequeno por modelo) e aplica as alterações
+        desconhecidas.
+        """
+        for doc in self._col.find({}, {'worker_id': 1, 'version': 1, 'wire_formats': 1, 'capabilities': 1}):
+            if self._aplicar(doc['_id'], doc['worker_id'], doc['version'], doc.get('wire_formats'),
+                             doc.get('capabilities')) and self._logger:
+                self._logger.info(f"Registro de filas atualizado (verificação periódica): {doc['_id']} -> "
+                                  f"{doc['worker_id']}")
+
+    def iniciar(self):
+        """
+        Inicia as threads de escuta dos avisos de alteração e de verificação periódica do registro.
+        """
+        threading.Thread(target=self._escutar_avisos, daemon=True).start()
+        threading.Thread(target=self._verificar_periodicamente, daemon=True).start()
+
+    def _verificar_periodicamente(self):
+        while True:
+            threading.Event().wait(self._intervalo_verificacao)
+
+            try:
+                self.sincronizar()
+            except BaseException as e:
+                self._log_erro(f"Falha ao verificar a versão do registro de filas: {e.__class__} - {e}")
+
+    def _escutar_avisos(self):
+        while True:
+            try:
+                conexao = pika.BlockingConnection(self._parametros)
+                canal = conexao.channel()
+                canal.exchange_declare(exchange=EXCHANGE_REGISTRO, exchange_type="fanout", durable=True)
+                r = canal.queue_declare(queue="", exclusive=True, auto_delete=True)
+                canal.queue_bind(queue=r.method.queue, exchange=EXCHANGE_REGISTRO)
+                canal.basic_consume(queue=r.method.queue, on_message_callback=self._on_aviso, auto_ack=True)
+
+                # Avisos perdidos enquanto estava desconectado são recuperados pela leitura do banco
+                self.sincronizar()
+                canal.start_consuming()
+            except BaseException as e:
+                if self._logger:
+                    self._logger.error(f"Falha na escuta dos avisos do registro de filas. Reconectando em 5s: "
+                                       f"{e.__class__} - {e}")
+
+            threading.Event().wait(5)
+
+    def _on_aviso(self, _ch, _method, _properties, body):
+        try:
+            evento = orjson.loads(body)
+
+            if evento.get('tipo') == "versao_modelo":
+                if self._ao_mudar_versao_modelo:
+                    self._ao_mudar_versao_modelo(evento['model_name'], evento['model_version'])
+                return
+
+            if self._aplicar(evento['model_name'], evento['worker_id'], evento['version'],
+                             evento.get('wire_formats'), evento.get('capabilities')) and self._logger:
+                self._logger.info(f"Registro de filas atualizado (aviso): {evento['model_name']} -> "
+                                  f"{evento['worker_id']}")
+        except (orjson.JSONDecodeError, KeyError) as e:
+            if self._logger:
+                self._logger.error(f"Aviso de alteração do registro de filas inválido: {e.__class__} - {e}")
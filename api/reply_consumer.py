@@ -0,0 +1,76 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Consumidor das respostas diretas (AMQP reply-to) enviadas pelos workers.
+#
+# Cada instância da API declara uma fila exclusiva para receber os resultados dos jobs enviados no modo síncrono
+# ('/inference?wait=<ms>'). O worker publica o resultado nesta fila, com o 'correlation_id' igual ao job_id, e o
+# resultado é entregue diretamente para a requisição que está aguardando, sem passar pelo banco de dados.
+# --------------------------------------------------------------------------------------------------------------------
+import orjson
+import pika
+import threading
+
+
+class ConsumidorRespostas:
+    """
+    Consome, em uma thread própria, a fila exclusiva de respostas desta instância da API.
+    """
+    def __init__(self, host: str, port: int, usuario: str, senha: str, notificador, logger=None,
+                 espera_reconexao: float = 5.0):
+        """
+        :param host: Endereço do servidor de filas.
+        :param port: Porta do servidor de filas.
+        :param usuario: Usuário para autenticação no servidor de filas.
+        :param senha: Senha para autenticação no servidor de filas.
+        :param notificador: Instância de 'NotificadorJobs' que receberá os resultados.
+        :param logger: Logger utilizado para registrar os eventos do consumidor.
+        :param espera_reconexao: Tempo (em segundos) de espera antes de tentar reconectar.
+        """
+        self._parametros = pika.ConnectionParameters(host=host, port=port, heartbeat=30,
+                                                     credentials=pika.PlainCredentials(usuario, senha))
+        self._notificador = notificador
+        self._logger = logger
+        self._espera_reconexao = espera_reconexao
+        self._thread = threading.Thread(target=self._executar, daemon=True)
+
+        # Nome da fila de respostas (gerado pelo servidor de filas). Fica None enquanto não houver conexão
+        self.fila = None
+
+    def iniciar(self):
+        self._thread.start()
+
+    def _executar(self):
+        while True:
+            try:
+                conexao = pika.BlockingConnection(self._parametros)
+                canal = conexao.channel()
+                r = canal.queue_declare(queue="", exclusive=True, auto_delete=True)
+                canal.basic_consume(queue=r.method.queue, on_message_callback=self._on_message, auto_ack=True)
+                self.fila = r.method.queue
+
+                if self._logger:
+                    self._logger.info(f"Fila de respostas diretas dos workers: {self.fila}")
+
+                canal.start_consuming()
+            except BaseException as e:
+                if self._logger:
+                    self._logger.error(f"Falha no consumo da fila de respostas diretas. Reconectando em "
+                                       f"{self._espera_reconexao}s: {e.__class__} - {e}")
+
+            # Os jobs enviados para a fila antiga não terão resposta direta, os clientes vão consultar o '/status'
+            self.fila = None
+            threading.Event().wait(self._espera_reconexao)
+
+    def _on_message(self, _ch, _method, properties, body):
+        job_id = properties.correlation_id
+
+        if not job_id:
+            return
+
+        try:
+            resultado = orjson.loads(body)
+        except ValueError as e:
+            if self._logger:
+                self._logger.error(f"Resposta direta inválida para o job {job_id}: {e.__class__} - {e}")
+            return
+
+        self._notificador.notificar(job_id, resultado)
@@ -0,0 +1,200 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Cache dos resultados de 'predict'.
+#
+# A chave do cache é formada pelo nome do modelo, pela versão do modelo e pelo hash das features. A versão atual do
+# modelo só muda quando o worker se registra ('/advworkid') ou quando outra instância da API avisa (ver 'registry.py'):
+# nesse caso todos os resultados do modelo são descartados. Os retornos dos jobs não mudam a versão, pois durante a
+# troca de um modelo os workers ainda podem retornar jobs da versão anterior. Um retorno de uma versão diferente da
+# atual não é guardado; enquanto a versão não é conhecida, a do primeiro retorno é adotada.
+#
+# O cache é limitado pela quantidade de itens e pelo tamanho aproximado (em bytes) das respostas guardadas, com
+# descarte LRU, e cada item expira após um TTL.
+# --------------------------------------------------------------------------------------------------------------------
+import orjson
+import threading
+from time import time
+from hashlib import sha256
+from collections import OrderedDict
+
+
+def hash_features(features) -> str:
+    """
+    Gera o hash SHA-256 de uma lista de features.
+        :param features: Features de uma requisição de 'predict'.
+        :return: Hash gerado.
+    """
+    return sha256(orjson.dumps(features)).hexdigest()
+
+
+class CacheResultados:
+    """
+    Cache LRU, com TTL e limite de memória, dos resultados de 'predict' por (modelo, versão, hash das features).
+    """
+    def __init__(self, max_itens: int = 10000, max_bytes: int = 20 * 1024 * 1024, ttl_segundos: float = 600.0,
+                 max_jobs_pendentes: int = 50000, ttl_jobs_pendentes: float = 90.0):
+        """
+        :param max_itens: Quantidade máxima de resultados guardados. Se for 0, o cache fica desligado.
+        :param max_bytes: Tamanho máximo aproximado, em bytes, dos resultados guardados.
+        :param ttl_segundos: Tempo, em segundos, que um resultado fica válido no cache.
+        :param max_jobs_pendentes: Quantidade máxima de jobs enfileirados aguardando o retorno para preencher o cache.
+        :param ttl_jobs_pendentes: Tempo, em segundos, que um job enfileirado aguarda o retorno para preencher o cache.
+        """
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.ttl = ttl_segundos
+        self._max_jobs_pendentes = max_jobs_pendentes
+        self._ttl_jobs_pendentes = ttl_jobs_pendentes
+        self._lock = threading.Lock()
+
+        self._itens = OrderedDict()  # (modelo, versão, hash) -> {'response', 'expira', 'tamanho'}
+        self._bytes = 0
+        self._versoes = {}  # modelo -> versão atual conhecida
+        self._jobs_pendentes = OrderedDict()  # job_id -> (modelo, hash das features, timestamp)
+
+        self.stats = {'hits': 0, 'misses': 0, 'insercoes': 0, 'descartes_lru': 0, 'expirados': 0,
+                      'invalidacoes': 0}
+
+    @property
+    def ativo(self) -> bool:
+        return self.max_itens > 0
+
+    def _remover(self, chave):
+        item = self._itens.pop(chave)
+        self._bytes -= item['tamanho']
+
+    def definir_versao(self, model_name: str, model_version: str) -> bool:
+        """
+        Informa a versão atual de um modelo. Se for diferente da conhecida, descarta os resultados do modelo.
+            :param model_name: Nome do modelo.
+            :param model_version: Versão do modelo.
+            :return: True, se a versão informada é diferente da conhecida. False, caso contrário.
+        """
+        if not model_version:
+            return False
+
+        with self._lock:
+            versao_atual = self._versoes.get(model_name)
+
+            if versao_atual == model_version:
+                return False
+
+            self._versoes[model_name] = model_version
+
+            if versao_atual is not None:
+                for chave in [c for c in self._itens if c[0] == model_name]:
+                    self._remover(chave)
+
+                self.stats['invalidacoes'] += 1
+
+            return True
+
+    def obter(self, model_name: str, features_hash: str):
+        """
+        Busca o resultado de um 'predict' no cache.
+            :param model_name: Nome do modelo.
+            :param features_hash: Hash das features (ver 'hash_features').
+            :return: Tupla (versão do modelo, resposta) ou None, caso não esteja no cache.
+        """
+        if not self.ativo:
+            return None
+
+        with self._lock:
+            versao = self._versoes.get(model_name)
+            chave = (model_name, versao, features_hash)
+            item = self._itens.get(chave)
+
+            if item is None:
+                self.stats['misses'] += 1
+                return None
+
+            if item['expira'] < time():
+                self._remover(chave)
+                self.stats['expirados'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self._itens.move_to_end(chave)
+            self.stats['hits'] += 1
+            return versao, item['response']
+
+    def registrar_job(self, job_id: str, model_name: str, features_hash: str):
+        """
+        Guarda a associação de um job enfileirado com o hash das suas features, para preencher o cache no retorno.
+        """
+        if not self.ativo:
+            return
+
+        with self._lock:
+            self._jobs_pendentes[job_id] = (model_name, features_hash, time())
+
+            # Descarta os mais antigos (o retorno pode ter sido recebido por outra instância da API ou o job expirou)
+            limite = time() - self._ttl_jobs_pendentes
+
+            while self._jobs_pendentes:
+                _, (_, _, ts) = next(iter(self._jobs_pendentes.items()))
+
+                if ts >= limite and len(self._jobs_pendentes) <= self._max_jobs_pendentes:
+                    break
+
+                self._jobs_pendentes.popitem(last=False)
+
+    def registrar_retorno(self, job_id: str, status: str, model_version: str, response):
+        """
+        Preenche o cache com o resultado de um job de 'predict' enfileirado por esta instância da API. Somente os
+        resultados da versão atual do modelo são guardados.
+            :param job_id: Job ID.
+            :param status: Status do retorno. Somente os retornos 'Done' são guardados.
+            :param model_version: Versão do modelo que processou o job.
+            :param response: Resposta do modelo.
+        """
+        if not self.ativo:
+            return
+
+        with self._lock:
+            pendente = self._jobs_pendentes.pop(job_id, None)
+
+        if pendente is None or status != "Done" or not model_version:
+            return
+
+        model_name, features_hash, _ = pendente
+
+        with self._lock:
+            versao_atual = self._versoes.setdefault(model_name, model_version)
+
+        if versao_atual != model_version:
+            return  # Retorno de uma versão que não é a atual (ex.: durante a troca do modelo)
+
+        tamanho = len(orjson.dumps(response, default=str)) + len(model_name) + len(model_version) + len(features_hash)
+
+        if tamanho > self.max_bytes:
+            return
+
+        with self._lock:
+            chave = (model_name, model_version, features_hash)
+
+            if chave in self._itens:
+                self._remover(chave)
+
+            self._itens[chave] = {'response': response, 'expira': time() + self.ttl, 'tamanho': tamanho}
+            self._bytes += tamanho
+            self.stats['insercoes'] += 1
+
+            while len(self._itens) > self.max_itens or self._bytes > self.max_bytes:
+                self._remover(next(iter(self._itens)))
+                self.stats['descartes_lru'] += 1
+
+    def resumo(self) -> dict:
+        """
+        Retorna as estatísticas do cache: taxa de acerto, quantidade de itens e memória utilizada.
+        """
+        with self._lock:
+            consultas = self.stats['hits'] + self.stats['misses']
+            ret = dict(self.stats)
+            ret['hit_ratio'] = round(self.stats['hits'] / consultas, 4) if consultas else 0.0
+            ret['itens'] = len(self._itens)
+            ret['max_itens'] = self.max_itens
+            ret['bytes'] = self._bytes
+            ret['max_bytes'] = self.max_bytes
+            ret['jobs_pendentes'] = len(self._jobs_pendentes)
+            ret['versoes_modelos'] = dict(self._versoes)
+            return ret
@@ -0,0 +1,131 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Consumidor da fila de resultados dos workers.
+#
+# Os workers publicam as mudanças de status ('Running') e os retornos dos jobs no exchange de resultados, em vez de
+# chamar os endpoints '/attstatus' e '/retorno'. A fila de resultados é durável e compartilhada entre as instâncias da
+# API (cada mensagem é aplicada por uma só instância). As mensagens são lidas em lotes e aplicadas de uma só vez; o
+# reconhecimento (ack) é feito depois que o lote é aplicado e gravado no banco, assim uma falha não perde resultados.
+# --------------------------------------------------------------------------------------------------------------------
+import orjson
+import pika
+import threading
+from time import time
+
+# Exchange e fila onde os workers publicam os resultados dos jobs
+EXCHANGE_RESULTADOS = "mlapi_results_exchange"
+FILA_RESULTADOS = "mlapi_results"
+
+
+def declarar_fila_resultados(canal):
+    """
+    Declara o exchange e a fila de resultados. É idempotente e também é feito pelos workers.
+        :param canal: Canal pika.
+    """
+    canal.exchange_declare(exchange=EXCHANGE_RESULTADOS, exchange_type="direct", durable=True)
+    canal.queue_declare(queue=FILA_RESULTADOS, durable=True)
+    canal.queue_bind(queue=FILA_RESULTADOS, exchange=EXCHANGE_RESULTADOS, routing_key=FILA_RESULTADOS)
+
+
+class ConsumidorResultados:
+    """
+    Consome, em uma thread própria, a fila de resultados dos workers e aplica os resultados em lotes.
+    """
+    def __init__(self, host: str, port: int, usuario: str, senha: str, max_lote: int = 500,
+                 intervalo_ms: float = 10, logger=None, ao_falhar=None, espera_reconexao: float = 5.0):
+        """
+        :param host: Endereço do servidor de filas.
+        :param port: Porta do servidor de filas.
+        :param usuario: Usuário para autenticação no servidor de filas.
+        :param senha: Senha para autenticação no servidor de filas.
+        :param max_lote: Quantidade máxima de mensagens aplicadas em um lote (também é o prefetch do consumidor).
+        :param intervalo_ms: Tempo máximo, em milissegundos, de espera por mais mensagens para formar o lote.
+        :param logger: Logger utilizado para registrar os eventos do consumidor.
+        :param ao_falhar: Função chamada quando acontece uma falha na aplicação de um lote.
+        :param espera_reconexao: Tempo (em segundos) de espera antes de tentar reconectar.
+        """
+        self._parametros = pika.ConnectionParameters(host=host, port=port, heartbeat=30,
+                                                     credentials=pika.PlainCredentials(usuario, senha))
+        self.max_lote = max_lote
+        self._intervalo = intervalo_ms / 1000
+        self._logger = logger
+        self._ao_falhar = ao_falhar
+        self._espera_reconexao = espera_reconexao
+        self._aplicar = None
+        self._lote = []  # Tuplas (delivery_tag, mensagem)
+        self.stats = {'lotes': 0, 'mensagens': 0, 'invalidas': 0, 'falhas': 0}
+
+    def iniciar(self, aplicar_lote):
+        """
+        Inicia o consumo da fila de resultados.
+            :param aplicar_lote: Função que recebe a lista de mensagens (dicionários) de um lote e as aplica. Se lançar
+                                 uma exceção, as mensagens do lote voltam para a fila.
+        """
+        self._aplicar = aplicar_lote
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    def _executar(self):
+        while True:
+            try:
+                conexao = pika.BlockingConnection(self._parametros)
+                canal = conexao.channel()
+                declarar_fila_resultados(canal)
+                canal.basic_qos(prefetch_count=self.max_lote)
+                canal.basic_consume(queue=FILA_RESULTADOS, on_message_callback=self._on_message)
+
+                if self._logger:
+                    self._logger.info(f"Consumindo a fila de resultados dos workers: {FILA_RESULTADOS}")
+
+                while True:
+                    conexao.process_data_events(time_limit=None if not self._lote else 0)
+
+                    # Aguarda mais mensagens até completar o lote ou terminar o intervalo
+                    limite = time() + self._intervalo
+
+                    while self._lote and len(self._lote) < self.max_lote and time() < limite:
+                        conexao.process_data_events(time_limit=max(limite - time(), 0))
+
+                    if self._lote:
+                        self._aplicar_lote(canal)
+            except BaseException as e:
+                if self._logger:
+                    self._logger.error(f"Falha no consumo da fila de resultados dos workers. Reconectando em "
+                                       f"{self._espera_reconexao}s: {e.__class__} - {e}")
+
+            # As mensagens não reconhecidas voltam para a fila quando a conexão cai
+            self._lote = []
+            threading.Event().wait(self._espera_reconexao)
+
+    def _on_message(self, _ch, method, _properties, body):
+        try:
+            self._lote.append((method.delivery_tag, orjson.loads(body)))
+        except orjson.JSONDecodeError as e:
+            self.stats['invalidas'] += 1
+            _ch.basic_ack(method.delivery_tag)  # Mensagem inválida não adianta ser reprocessada
+
+            if self._logger:
+                self._logger.error(f"Mensagem inválida na fila de resultados dos workers: {e.__class__} - {e}")
+
+    def _aplicar_lote(self, canal):
+        lote = self._lote
+        self._lote = []
+        ultima_tag = lote[-1][0]
+
+        try:
+            self._aplicar([mensagem for _, mensagem in lote])
+        except BaseException as e:
+            self.stats['falhas'] += 1
+
+            if self._logger:
+                self._logger.error(f"Falha ao aplicar o lote de {len(lote)} resultado(s) dos workers. O lote volta "
+                                   f"para a fila: {e.__class__} - {e}")
+
+            if self._ao_falhar:
+                self._ao_falhar()
+
+            canal.basic_nack(delivery_tag=ultima_tag, multiple=True, requeue=True)
+            threading.Event().wait(1)  # Evita reprocessar o lote imediatamente enquanto a falha persiste
+            return
+
+        canal.basic_ack(delivery_tag=ultima_tag, multiple=True)
+        self.stats['lotes'] += 1
+        self.stats['mensagens'] += len(lote)
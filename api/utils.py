@@ -2,17 +2,29 @@
 # Funções, rotinas e variáveis úteis
 # --------------------------------------------------------------------------------------------------------------------
 import logging
-import json
+import orjson
+import asyncio
+import functools
 import pika
-from pika.exceptions import ChannelClosed
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, UpdateOne
 from pymongo.errors import ConnectionFailure, OperationFailure
 from hashlib import sha256
 from numpy import random
 from time import time
 from datetime import datetime
-from bson import ObjectId
 from os import environ as env
+from publisher import PoolPublicadores, FilaAusenteError
+from notifier import NotificadorJobs
+from reply_consumer import ConsumidorRespostas
+from write_behind import BufferEscrita
+from registry import RegistroFilas
+from result_cache import CacheResultados
+from admission import ControleAdmissao
+from results_consumer import ConsumidorResultados
+from feedback_aggregates import AgregadosFeedback, dia_timestamp
+from claim_check import ArmazemPayloads
+from wire_format import codificar, formato_disponivel
 
 
 def make_log() -> logging.Logger:
@@ -122,6 +134,144 @@ if not RABITMQ_PASS:
     gerar_arquivo_erro()
     exit(1)
 
+# Quantidade máxima de conexões/canais mantidos abertos com o servidor de filas para publicação dos jobs
+try:
+    RABBITMQ_POOL_SIZE = int(env.get('RABBITMQ_POOL_SIZE', "4"))
+except ValueError:
+    LOGGER.error("Informe um número inteiro válido na variável de ambiente 'RABBITMQ_POOL_SIZE'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Quantidade máxima de operações bloqueantes (banco de dados/fila) executadas em paralelo fora do event loop da API
+try:
+    DB_MAX_WORKERS = int(env.get('DB_MAX_WORKERS', "32"))
+except ValueError:
+    LOGGER.error("Informe um número inteiro válido na variável de ambiente 'DB_MAX_WORKERS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Parâmetros do buffer de escrita (write-behind) dos jobs: quantidade de operações que dispara a gravação de um lote,
+# intervalo máximo entre as gravações e quantidade máxima de jobs com operações pendentes (backpressure)
+try:
+    WRITE_BEHIND_MAX_OPS = int(env.get('WRITE_BEHIND_MAX_OPS', "500"))
+    WRITE_BEHIND_INTERVAL_MS = float(env.get('WRITE_BEHIND_INTERVAL_MS', "5"))
+    WRITE_BEHIND_MAX_PENDING = int(env.get('WRITE_BEHIND_MAX_PENDING', "10000"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'WRITE_BEHIND_MAX_OPS', "
+                 "'WRITE_BEHIND_INTERVAL_MS' e 'WRITE_BEHIND_MAX_PENDING'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Intervalo, em segundos, da verificação periódica da versão do registro de filas. É só uma garantia para o caso de
+# algum aviso de alteração se perder, pois as alterações são avisadas imediatamente a todas as instâncias da API
+try:
+    REGISTRY_POLL_SECONDS = float(env.get('REGISTRY_POLL_SECONDS', "30"))
+except ValueError:
+    LOGGER.error("Informe um número válido na variável de ambiente 'REGISTRY_POLL_SECONDS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Parâmetros do controle de admissão dos jobs: espera máxima prevista, em segundos, para aceitar um job em uma fila
+# (deve ser igual ao TTL das filas dos workers; 0 desliga o controle) e intervalo mínimo, em milissegundos, entre as
+# consultas da profundidade de cada fila
+try:
+    ADMISSION_MAX_WAIT_SECONDS = float(env.get('ADMISSION_MAX_WAIT_SECONDS', "90"))
+    ADMISSION_REFRESH_MS = float(env.get('ADMISSION_REFRESH_MS', "1000"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'ADMISSION_MAX_WAIT_SECONDS' e "
+                 "'ADMISSION_REFRESH_MS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Parâmetros do consumidor da fila de resultados dos workers: quantidade máxima de resultados aplicados em um lote,
+# tempo máximo, em milissegundos, de espera por mais resultados para formar o lote e tempo máximo, em segundos, de
+# espera pela gravação do lote no banco antes de devolvê-lo para a fila
+try:
+    RESULTS_BATCH_MAX = int(env.get('RESULTS_BATCH_MAX', "500"))
+    RESULTS_BATCH_INTERVAL_MS = float(env.get('RESULTS_BATCH_INTERVAL_MS', "10"))
+    RESULTS_FLUSH_TIMEOUT_SECONDS = float(env.get('RESULTS_FLUSH_TIMEOUT_SECONDS', "10"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'RESULTS_BATCH_MAX', "
+                 "'RESULTS_BATCH_INTERVAL_MS' e 'RESULTS_FLUSH_TIMEOUT_SECONDS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Filas por método: os jobs de 'evaluate', 'get_feedback' e 'info' são enviados para uma fila separada do worker
+# ('<worker_id>_batch'), atendida por threads próprias, assim não atrasam os jobs de 'predict'. Caso o worker não tenha
+# a fila separada (versões anteriores), os jobs vão para a fila principal
+API_METHOD_LANES = env.get('API_METHOD_LANES', "1") == "1"
+
+# Parâmetros do cache de resultados de 'predict': quantidade máxima de itens (0 desliga o cache), tamanho máximo em MB
+# e tempo de validade de cada resultado em segundos
+try:
+    RESULT_CACHE_MAX_ITEMS = int(env.get('RESULT_CACHE_MAX_ITEMS', "10000"))
+    RESULT_CACHE_MAX_MB = float(env.get('RESULT_CACHE_MAX_MB', "20"))
+    RESULT_CACHE_TTL_SECONDS = float(env.get('RESULT_CACHE_TTL_SECONDS', "600"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'RESULT_CACHE_MAX_ITEMS', "
+                 "'RESULT_CACHE_MAX_MB' e 'RESULT_CACHE_TTL_SECONDS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Parâmetros do feedback: intervalo, em milissegundos, entre as gravações dos agregados diários de feedback e
+# intervalos mínimos, em segundos, entre as solicitações de 'get_feedback' de um mesmo modelo e entre modelos diferentes
+# quando o período é atendido só pelos agregados. Quando o período inclui dias anteriores aos agregados, os jobs são
+# lidos do banco e valem os intervalos de 30 minutos por modelo e 2 minutos entre modelos
+try:
+    FEEDBACK_AGG_INTERVAL_MS = float(env.get('FEEDBACK_AGG_INTERVAL_MS', "1000"))
+    FEEDBACK_MODEL_INTERVAL_SECONDS = float(env.get('FEEDBACK_MODEL_INTERVAL_SECONDS', "60"))
+    FEEDBACK_GLOBAL_INTERVAL_SECONDS = float(env.get('FEEDBACK_GLOBAL_INTERVAL_SECONDS', "5"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'FEEDBACK_AGG_INTERVAL_MS', "
+                 "'FEEDBACK_MODEL_INTERVAL_SECONDS' e 'FEEDBACK_GLOBAL_INTERVAL_SECONDS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Envia os labels do 'get_feedback' codificados (vocabulário e arrays de códigos) para os workers que informam a
+# capacidade "encoded_labels" no '/advworkid'. Os workers de versões anteriores recebem as listas 'y_pred' e 'y_true'.
+# Desligue ('0') para enviar as listas para todos os workers
+FEEDBACK_ENCODED_LABELS = env.get('FEEDBACK_ENCODED_LABELS', "1") == "1"
+
+# Quantidade máxima de labels analisados em um 'get_feedback' (os mais recentes)
+FEEDBACK_MAX_LABELS = 30000
+
+# Claim-check dos payloads grandes: tipo de armazenamento ('fs', 's3' ou vazio para desligar), pasta compartilhada com
+# os workers (tipo 'fs'), bucket (tipo 's3'), tamanho a partir do qual o job vai para o armazenamento e idade a partir
+# da qual um payload não lido pelos workers é removido. O tipo 's3' utiliza o endpoint e as credenciais do MinIO. Só
+# os workers que informam a capacidade "claim_check" no '/advworkid' recebem jobs por referência
+CLAIM_CHECK_BACKEND = env.get('CLAIM_CHECK_BACKEND', "")
+CLAIM_CHECK_DIR = env.get('CLAIM_CHECK_DIR', "/claim_check")
+CLAIM_CHECK_BUCKET = env.get('CLAIM_CHECK_BUCKET', "mlapi-claim-check")
+
+try:
+    CLAIM_CHECK_THRESHOLD_BYTES = int(env.get('CLAIM_CHECK_THRESHOLD_BYTES', "262144"))
+    CLAIM_CHECK_MAX_AGE_SECONDS = float(env.get('CLAIM_CHECK_MAX_AGE_SECONDS', "3600"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'CLAIM_CHECK_THRESHOLD_BYTES' e "
+                 "'CLAIM_CHECK_MAX_AGE_SECONDS'")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Formato preferido das mensagens dos jobs publicadas nas filas dos workers ('msgpack' ou 'json'), tamanho, em bytes, a
+# partir do qual a mensagem em msgpack é comprimida com zstd (0 não comprime) e nível de compressão. O msgpack só é
+# utilizado para os modelos cujo worker informou, no '/advworkid', que o decodifica; os demais recebem JSON
+JOB_WIRE_FORMAT = env.get('JOB_WIRE_FORMAT', "msgpack")
+
+try:
+    JOB_WIRE_COMPRESS_BYTES = int(env.get('JOB_WIRE_COMPRESS_BYTES', "1024"))
+    JOB_WIRE_ZSTD_LEVEL = int(env.get('JOB_WIRE_ZSTD_LEVEL', "3"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'JOB_WIRE_COMPRESS_BYTES' e "
+                 "'JOB_WIRE_ZSTD_LEVEL'")
+    gerar_arquivo_erro()
+    exit(1)
+
+if not formato_disponivel(JOB_WIRE_FORMAT):
+    LOGGER.error(f"Formato de mensagem inválido ou indisponível na variável de ambiente 'JOB_WIRE_FORMAT': "
+                 f"'{JOB_WIRE_FORMAT}'. Deve ser 'msgpack' (requer os pacotes 'msgpack' e 'zstandard') ou 'json'")
+    gerar_arquivo_erro()
+    exit(1)
+
 # Obtém o token para utilizar nesta instância da API
 TOKEN = env.get("API_TOKEN")
 if not TOKEN:
@@ -151,7 +301,10 @@ def connect_db(database_name: str):
         :param database_name: Nome da base de dados.
         :return: Instância de client conectado à base de dados.
     """
-    client = MongoClient(f"mongodb://%s:%s@{DB_SERVER_NAME}" % (DB_USERNAME, DB_PASSWORD), authSource=DB_AUTH_SOURCE)
+    # O pool de conexões do client acompanha a quantidade de threads do executor, para que nenhuma thread fique
+    # esperando por uma conexão livre
+    client = MongoClient(f"mongodb://%s:%s@{DB_SERVER_NAME}" % (DB_USERNAME, DB_PASSWORD), authSource=DB_AUTH_SOURCE,
+                         maxPoolSize=DB_MAX_WORKERS)
 
     try:
         client.admin.command('ping')
@@ -184,66 +337,235 @@ def connect_db(database_name: str):
 # Conecta ao banco de dados 'ml_api_db'
 CLIENT_BD = connect_db("ml_api_db")
 
+# Buffer de escrita dos jobs. As inserções e atualizações do ciclo de vida dos jobs são gravadas em lotes
+BUFFER_JOBS = BufferEscrita(CLIENT_BD["col_jobs"], chave="job_id", max_ops_lote=WRITE_BEHIND_MAX_OPS,
+                            intervalo_ms=WRITE_BEHIND_INTERVAL_MS, max_pendentes=WRITE_BEHIND_MAX_PENDING,
+                            logger=LOGGER, ao_falhar=gerar_arquivo_erro)
 
-def get_queue_registry_startup():
+# Agregados diários de feedback dos modelos, atualizados pelos retornos de 'predict' e pelo '/feedback'
+try:
+    AGREGADOS_FEEDBACK = AgregadosFeedback(CLIENT_BD["col_feedback_daily"], CLIENT_BD["col_feedback_jobs"],
+                                           intervalo_ms=FEEDBACK_AGG_INTERVAL_MS, logger=LOGGER,
+                                           ao_falhar=gerar_arquivo_erro)
+except BaseException as e:
+    LOGGER.error(f"Falha ao preparar as coleções 'col_feedback_daily' e 'col_feedback_jobs': {e.__class__} - {e}")
+    gerar_arquivo_erro()
+    exit(1)
+
+# Armazenamento dos payloads grandes dos jobs. A limpeza dos payloads abandonados é iniciada junto com a API
+ARMAZEM_PAYLOADS = None
+
+if CLAIM_CHECK_BACKEND:
+    try:
+        ARMAZEM_PAYLOADS = ArmazemPayloads(CLAIM_CHECK_BACKEND, diretorio=CLAIM_CHECK_DIR, bucket=CLAIM_CHECK_BUCKET,
+                                           endpoint=env.get('MLFLOW_S3_ENDPOINT_URL'), logger=LOGGER)
+    except BaseException as e:
+        LOGGER.error(f"Não foi possível preparar o armazenamento dos payloads grandes dos jobs "
+                     f"('CLAIM_CHECK_BACKEND'={CLAIM_CHECK_BACKEND}): {e.__class__} - {e}")
+        gerar_arquivo_erro()
+        exit(1)
+
+# Executor limitado para as chamadas bloqueantes (pymongo/pika). Assim, um round trip lento no banco não trava o event
+# loop e as demais requisições em andamento continuam sendo atendidas
+EXECUTOR_BLOQUEANTE = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="api_bloqueante")
+
+
+async def executar_bloqueante(funcao, *args, **kwargs):
     """
-    Obtém o registro das filas cadastradas, no início da API. Caso não exista, cria um.
-         :return: Dicionário contendo o registro das filas.
+    Executa uma função bloqueante (acesso ao banco de dados, publicação na fila, etc.) no executor da API, sem
+    bloquear o event loop.
+        :param funcao: Função que será executada.
+        :param args: Argumentos posicionais da função.
+        :param kwargs: Argumentos nomeados da função.
+        :return: Retorno da função.
     """
-    col = CLIENT_BD["col_queue_registry"]
-    obj_id = ObjectId("000000000000aaaabbbbffff")  # Fixa o _id para facilitar nas buscas e evitar duplicidade de filas
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR_BLOQUEANTE, functools.partial(funcao, *args, **kwargs))
+
+
+# Pool de publicadores persistente (as conexões são abertas sob demanda e reaproveitadas entre as requisições)
+POOL_PUBLICADOR = PoolPublicadores(host=RABBITMQ_SERVER, port=RABBITMQ_PORT, usuario=RABITMQ_USER,
+                                   senha=RABITMQ_PASS, tamanho_pool=RABBITMQ_POOL_SIZE, logger=LOGGER)
+
 
+# Cache dos resultados de 'predict' por (modelo, versão do modelo, hash das features)
+CACHE_RESULTADOS = CacheResultados(max_itens=RESULT_CACHE_MAX_ITEMS, max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+                                   ttl_segundos=RESULT_CACHE_TTL_SECONDS)
+
+# Registro das filas dos workers, sincronizado entre as instâncias da API. Também repassa ao cache de resultados os
+# avisos de versão nova dos modelos
+REGISTRO_FILAS = RegistroFilas(CLIENT_BD, POOL_PUBLICADOR, host=RABBITMQ_SERVER, port=RABBITMQ_PORT,
+                               usuario=RABITMQ_USER, senha=RABITMQ_PASS, intervalo_verificacao=REGISTRY_POLL_SECONDS,
+                               logger=LOGGER, ao_falhar=gerar_arquivo_erro,
+                               ao_mudar_versao_modelo=CACHE_RESULTADOS.definir_versao)
+
+
+def definir_versao_modelo(model_name: str, model_version: str):
+    """
+    Informa ao cache de resultados a versão atual de um modelo. Se a versão mudou, avisa as demais instâncias da API
+    para que também descartem os resultados da versão anterior.
+        :param model_name: Nome do modelo.
+        :param model_version: Versão do modelo.
+    """
+    if CACHE_RESULTADOS.ativo and CACHE_RESULTADOS.definir_versao(model_name, model_version):
+        REGISTRO_FILAS.avisar_versao_modelo(model_name, model_version)
+
+
+def get_queue_registry_startup():
+    """
+    Obtém o registro das filas cadastradas, no início da API.
+         :return: Dicionário contendo o registro das filas (nome do modelo -> worker_id). O dicionário é mantido
+                  atualizado com as alterações feitas por qualquer instância da API.
+    """
     try:
-        result = col.find_one({'_id': obj_id})
+        REGISTRO_FILAS.carregar()
     except BaseException as e:
         LOGGER.error(f"Falha ao buscar o registro de filas. Mensagem: {e.__class__} - {e}")
         gerar_arquivo_erro()
         exit(1)
 
-    if not result:
-        result = {'_id': obj_id, 'queue_registry': {}}
+    return REGISTRO_FILAS.filas
 
-        try:
-            col.insert_one(result)
-        except BaseException as e:
-            LOGGER.error(f"Não foi possível criar o registro de filas. Mensagem: {e.__class__} - {e}")
-            gerar_arquivo_erro()
-            exit(1)
 
-    return result['queue_registry']
+# Controle de admissão: recusa os jobs que expirariam na fila antes de serem atendidos pelos workers
+CONTROLE_ADMISSAO = ControleAdmissao(POOL_PUBLICADOR, espera_maxima=ADMISSION_MAX_WAIT_SECONDS,
+                                     intervalo_consulta=ADMISSION_REFRESH_MS / 1000, logger=LOGGER)
+
+# Notificador da conclusão dos jobs e consumidor das respostas diretas dos workers (modo síncrono do '/inference').
+# O consumidor é iniciado junto com a API
+NOTIFICADOR = NotificadorJobs()
+CONSUMIDOR_RESPOSTAS = ConsumidorRespostas(host=RABBITMQ_SERVER, port=RABBITMQ_PORT, usuario=RABITMQ_USER,
+                                           senha=RABITMQ_PASS, notificador=NOTIFICADOR, logger=LOGGER)
+
+# Consumidor da fila de resultados dos workers (status 'Running' e retornos dos jobs). É iniciado junto com a API
+CONSUMIDOR_RESULTADOS = ConsumidorResultados(host=RABBITMQ_SERVER, port=RABBITMQ_PORT, usuario=RABITMQ_USER,
+                                             senha=RABITMQ_PASS, max_lote=RESULTS_BATCH_MAX,
+                                             intervalo_ms=RESULTS_BATCH_INTERVAL_MS, logger=LOGGER,
+                                             ao_falhar=gerar_arquivo_erro)
+
+
+# Sufixo e métodos da fila separada dos workers (devem ser iguais aos do worker: 'SUFIXO_FILA_LOTE')
+SUFIXO_FILA_LOTE = "_batch"
+METODOS_FILA_LOTE = ("evaluate", "get_feedback", "info")
+
+# Workers sem a fila separada: worker_id -> timestamp até quando a ausência é considerada (evita consultas repetidas)
+FILAS_LOTE_AUSENTES = {}
 
+# Workers cuja fila separada já foi encontrada por esta instância da API
+FILAS_LOTE_PRESENTES = set()
 
-def enfileirar_job(queue_name, model_name, info_client_host, req_info) -> dict:
+
+def fila_metodo(worker_id, method, consultar: bool = True):
+    """
+    Obtém a fila do worker que deve receber os jobs de um método. Pode fazer uma consulta ao servidor de filas, por
+    isso deve ser executado fora do event loop quando o método não for 'predict'.
+        :param worker_id: Worker ID (nome da fila principal do worker).
+        :param method: Método do job.
+        :param consultar: Se for False, utiliza somente o que já se sabe sobre a fila separada, sem consultar o
+                          servidor de filas.
+        :return: Nome da fila.
+    """
+    if not worker_id or not API_METHOD_LANES or method not in METODOS_FILA_LOTE:
+        return worker_id
+
+    if FILAS_LOTE_AUSENTES.get(worker_id, 0) > time():
+        return worker_id
+
+    if not consultar:
+        return f"{worker_id}{SUFIXO_FILA_LOTE}" if worker_id in FILAS_LOTE_PRESENTES else worker_id
+
+    fila = f"{worker_id}{SUFIXO_FILA_LOTE}"
+
+    try:
+        POOL_PUBLICADOR.consultar_fila(fila)
+    except FilaAusenteError:
+        FILAS_LOTE_AUSENTES[worker_id] = time() + 30
+        FILAS_LOTE_PRESENTES.discard(worker_id)
+        return worker_id
+    except BaseException as e:
+        LOGGER.error(f"Não foi possível consultar a fila '{fila}'. O job será enviado para a fila principal do "
+                     f"worker: {e.__class__} - {e}")
+        return worker_id
+
+    FILAS_LOTE_PRESENTES.add(worker_id)
+    return fila
+
+
+def serializar_job(req_info: dict) -> tuple:
     """
-    Enfileira um job no servidor de filas.
+    Serializa um job para publicação na fila, no formato configurado em 'JOB_WIRE_FORMAT', caso o worker do modelo o
+    aceite (senão, em JSON). Se o job ultrapassar o tamanho limite, o claim-check estiver ligado e o worker do modelo
+    informar que suporta o claim-check, o job é gravado no armazenamento de payloads e a mensagem leva só a
+    referência, o formato do payload e os campos utilizados pelo worker antes de ler o payload. Caso a gravação no
+    armazenamento falhe, o job é enviado completo na mensagem.
+        :param req_info: Requisição utilizada para gerar o job que será enfileirado.
+        :return: Tupla contendo: corpo da mensagem, 'content_type' e 'content_encoding' da mensagem.
+    """
+    formato = JOB_WIRE_FORMAT if JOB_WIRE_FORMAT in REGISTRO_FILAS.formatos(req_info.get('model_name')) else "json"
+    corpo, content_type, content_encoding = codificar(req_info, formato, JOB_WIRE_COMPRESS_BYTES, JOB_WIRE_ZSTD_LEVEL)
+
+    if ARMAZEM_PAYLOADS is None or len(corpo) <= CLAIM_CHECK_THRESHOLD_BYTES or \
+            "claim_check" not in REGISTRO_FILAS.capacidades(req_info.get('model_name')):
+        return corpo, content_type, content_encoding
+
+    try:
+        referencia = ARMAZEM_PAYLOADS.guardar(req_info['job_id'], corpo, content_type=content_type)
+    except BaseException as e:
+        # O armazenamento é só uma otimização: a falha afeta somente este job, que segue completo na mensagem
+        LOGGER.error(f"Não foi possível gravar o payload do job {req_info['job_id']} no armazenamento de payloads. O "
+                     f"job será enviado completo na mensagem: {e.__class__} - {e}")
+        return corpo, content_type, content_encoding
+    mensagem = {chave: req_info[chave] for chave in ("job_id", "model_name", "method", "token", "datetime",
+                                                     "datetime_temp_queue") if chave in req_info}
+    mensagem['claim_check'] = referencia
+    mensagem['claim_check_content_type'] = content_type
+    mensagem['claim_check_content_encoding'] = content_encoding
+    return codificar(mensagem, formato, 0)
+
+
+def mensagem_job(req_info: dict, reply_to=None) -> tuple:
+    """
+    Serializa um job e monta as propriedades AMQP da mensagem, que informam ao worker o formato do corpo. O job ID e
+    os campos utilizados no retorno ficam também nas propriedades, para que o worker consiga retornar um erro mesmo
+    quando não consegue decodificar o corpo.
+        :param req_info: Requisição utilizada para gerar o job que será enfileirado.
+        :param reply_to: Fila onde o worker deve publicar o resultado do job (modo síncrono). Opcional.
+        :return: Tupla contendo: corpo e propriedades AMQP da mensagem.
+    """
+    corpo, content_type, content_encoding = serializar_job(req_info)
+    # Os cabeçalhos AMQP não aceitam float, por isso o timestamp vai como texto
+    cabecalhos = {chave: str(req_info[chave]) for chave in ("model_name", "method", "datetime") if chave in req_info}
+    properties = pika.BasicProperties(content_type=content_type, content_encoding=content_encoding,
+                                      message_id=req_info['job_id'], headers=cabecalhos)
+
+    if reply_to:
+        properties.reply_to = reply_to
+        properties.correlation_id = req_info['job_id']
+
+    return corpo, properties
+
+
+def enfileirar_job(queue_name, model_name, info_client_host, req_info, reply_to=None) -> dict:
+    """
+    Enfileira um job no servidor de filas, utilizando um canal já aberto do pool de publicadores.
         :param queue_name: Nome da fila.
         :param model_name: Nome do modelo.
         :param info_client_host: Informações adicionais do cliente que solicitou a execução do job.
         :param req_info: Requisição utilizada para gerar o job que será enfileirado.
+        :param reply_to: Fila onde o worker deve publicar o resultado do job (modo síncrono). Opcional.
         :return: Dicionário com status do enfileiramento e mensagem adicional.
     """
     try:
-        # Conecta na fila
-        credentials = pika.PlainCredentials(RABITMQ_USER, RABITMQ_PASS)
-        parameters = pika.ConnectionParameters(host=RABBITMQ_SERVER, port=RABBITMQ_PORT, credentials=credentials)
-        connection = pika.BlockingConnection(parameters)
-        channel = connection.channel()
-
-        try:
-            channel.queue_declare(queue=queue_name, passive=True)
-        except ChannelClosed:
-            LOGGER.error(f"Origem da requisição: IP={info_client_host}. Erro reportado: Não foi possível enviar o "
-                         f"job para a fila '{queue_name}'. A fila está fechada/ausente porque não existem workers "
-                         f"escutando esta fila. Modelo: '{model_name}'")
-            msg = f"Não foi possível enviar o job para a fila porque não há workers para processá-lo. Verifique " \
-                  f"se o modelo '{model_name}' está em produção."
-            return {'job_id': "n/a", 'status': "Error", 'response': msg}
-
         # Envia o job para fila
-        payload_encoded = json.dumps(req_info)
-        channel.basic_publish(exchange="mlapi_exchange", routing_key=queue_name,
-                              body=bytes(payload_encoded.encode("utf-8")))
-        connection.close()
+        corpo, properties = mensagem_job(req_info, reply_to)
+        POOL_PUBLICADOR.publicar(queue_name, corpo, properties=properties)
+    except FilaAusenteError:
+        LOGGER.error(f"Origem da requisição: IP={info_client_host}. Erro reportado: Não foi possível enviar o "
+                     f"job para a fila '{queue_name}'. A fila está fechada/ausente porque não existem workers "
+                     f"escutando esta fila. Modelo: '{model_name}'")
+        msg = f"Não foi possível enviar o job para a fila porque não há workers para processá-lo. Verifique " \
+              f"se o modelo '{model_name}' está em produção."
+        return {'job_id': "n/a", 'status': "Error", 'response': msg}
     except BaseException as e:
         msg = "Não foi possível enviar o job para a fila. Falha ao tentar conectar no servidor de filas"
         LOGGER.error(f"Origem da requisição: IP={info_client_host}. {msg}. Fila: '{queue_name}'. Modelo: "
@@ -251,9 +573,43 @@ def enfileirar_job(queue_name, model_name, info_client_host, req_info) -> dict:
         gerar_arquivo_erro()
         return {'job_id': "n/a", 'status': "Error", 'response': msg}
 
+    CONTROLE_ADMISSAO.registrar_envio(queue_name)
     return {'status': "Done", 'response': ""}
 
 
+def enfileirar_jobs_lote(jobs: list, info_client_host) -> list:
+    """
+    Enfileira um lote de jobs no servidor de filas, utilizando um único canal do pool de publicadores.
+        :param jobs: Lista de tuplas (nome da fila, nome do modelo, requisição do job).
+        :param info_client_host: Informações adicionais do cliente que solicitou a execução dos jobs.
+        :return: Lista, na mesma ordem dos jobs, com o status do enfileiramento de cada um e mensagem adicional.
+    """
+    try:
+        mensagens = [(queue_name, *mensagem_job(req_info)) for queue_name, _, req_info in jobs]
+        publicados = POOL_PUBLICADOR.publicar_lote(mensagens)
+    except BaseException as e:
+        msg = "Não foi possível enviar os jobs para a fila. Falha ao tentar conectar no servidor de filas"
+        LOGGER.error(f"Origem da requisição: IP={info_client_host}. {msg}: {e.__class__} - {e}")
+        gerar_arquivo_erro()
+        return [{'job_id': "n/a", 'status': "Error", 'response': msg}] * len(jobs)
+
+    resultados = []
+
+    for (queue_name, model_name, _), publicado in zip(jobs, publicados):
+        if publicado:
+            CONTROLE_ADMISSAO.registrar_envio(queue_name)
+            resultados.append({'status': "Done", 'response': ""})
+        else:
+            LOGGER.error(f"Origem da requisição: IP={info_client_host}. Erro reportado: Não foi possível enviar o "
+                         f"job para a fila '{queue_name}'. A fila está fechada/ausente porque não existem workers "
+                         f"escutando esta fila. Modelo: '{model_name}'")
+            msg = f"Não foi possível enviar o job para a fila porque não há workers para processá-lo. Verifique " \
+                  f"se o modelo '{model_name}' está em produção."
+            resultados.append({'job_id': "n/a", 'status': "Error", 'response': msg})
+
+    return resultados
+
+
 def insert_doc(colecao, doc):
     """
     Insere um documento no banco de dados.
@@ -271,6 +627,23 @@ def insert_doc(colecao, doc):
     return result
 
 
+def insert_docs(colecao, docs: list):
+    """
+    Insere vários documentos no banco de dados com uma única operação.
+        :param colecao: Coleção onde os documentos serão inseridos.
+        :param docs: Lista de documentos que serão inseridos no banco.
+        :return: Resultado da inserção.
+    """
+    try:
+        col = CLIENT_BD[colecao]
+        result = col.insert_many(docs, ordered=False)
+    except BaseException as e:
+        gerar_arquivo_erro()
+        raise e
+
+    return result
+
+
 def retrieve_doc(colecao, chave, valor):
     """
     Busca e retorna um documento do banco de dados.
@@ -289,14 +662,175 @@ def retrieve_doc(colecao, chave, valor):
     return result
 
 
-def retrieve_docs_feedback(colecao, nome_modelo, initial_date, end_date) -> dict:
+def retrieve_docs(colecao, chave, valores: list) -> list:
     """
-    Busca e retorna um conjunto de documentos do banco de dados para realização de feedback de um modelo.
+    Busca e retorna os documentos do banco de dados cuja chave possui um dos valores informados.
         :param colecao: Coleção onde os documentos serão procurados.
+        :param chave: Chave que será utilizada para buscar os documentos.
+        :param valores: Lista de valores da chave que serão utilizados para buscar os documentos.
+        :return: Lista com os documentos encontrados.
+    """
+    try:
+        col = CLIENT_BD[colecao]
+        result = list(col.find({chave: {'$in': valores}}))
+    except BaseException as e:
+        gerar_arquivo_erro()
+        raise e
+
+    return result
+
+
+def insert_job(doc: dict):
+    """
+    Agenda a inserção de um job no buffer de escrita. Aguarda caso o buffer esteja cheio.
+        :param doc: Documento do job.
+    """
+    try:
+        BUFFER_JOBS.inserir(doc)
+    except BaseException as e:
+        gerar_arquivo_erro()
+        raise e
+
+
+def insert_jobs(docs: list):
+    """
+    Agenda a inserção de vários jobs no buffer de escrita. Aguarda caso o buffer esteja cheio.
+        :param docs: Lista com os documentos dos jobs.
+    """
+    try:
+        BUFFER_JOBS.inserir_varios(docs)
+    except BaseException as e:
+        gerar_arquivo_erro()
+        raise e
+
+
+# Status que um job precisa ter para passar para cada status. Evita que mensagens aplicadas fora de ordem (ex.: o
+# 'Running' que chega depois do retorno) sobrescrevam um job que já terminou
+STATUS_ANTERIORES = {'Queued': ["Queued"], 'Running': ["Queued"], 'Done': ["Queued", "Running"],
+                     'Error': ["Queued", "Running"]}
+
+
+def update_job(job_id, chaves_alterar: dict) -> bool:
+    """
+    Agenda a atualização de um job no buffer de escrita. Aguarda caso o buffer esteja cheio. A atualização não cria o
+    job e, quando altera o status, só é gravada se o status atual do job permitir a mudança.
+        :param job_id: Job ID do job que será atualizado.
+        :param chaves_alterar: Dicionário contendo as chaves que terão seus valores alterados; e seus
+                               respectivos valores.
+        :return: False se a atualização foi descartada porque o status do job não permite a mudança, True caso
+                 contrário.
+    """
+    condicao = None
+
+    if 'status' in chaves_alterar:
+        condicao = {'status': STATUS_ANTERIORES.get(chaves_alterar['status'], [])}
+
+    try:
+        return BUFFER_JOBS.atualizar(job_id, chaves_alterar, condicao)
+    except BaseException as e:
+        gerar_arquivo_erro()
+        raise e
+
+
+def marcar_jobs_running(job_ids: list):
+    """
+    Atualiza para 'Running', em uma única operação, os jobs que ainda estão com o status 'Queued'. A condição evita
+    que o retorno de um job, aplicado antes por outra instância da API, seja sobrescrito.
+        :param job_ids: Lista de job_ids.
+    """
+    ops = [UpdateOne({'job_id': job_id, 'status': "Queued"}, {'$set': {'status': "Running"}}) for job_id in job_ids]
+
+    try:
+        CLIENT_BD["col_jobs"].bulk_write(ops, ordered=False)
+    except BaseException as e:
+        gerar_arquivo_erro()
+        raise e
+
+
+def retrieve_job(job_id):
+    """
+    Busca e retorna um job, considerando as escritas que ainda estão no buffer.
+        :param job_id: Job ID do job.
+        :return: Documento do job, caso seja encontrado, None caso contrário.
+    """
+    return BUFFER_JOBS.ler(job_id, functools.partial(retrieve_doc, "col_jobs", "job_id", job_id))
+
+
+def retrieve_jobs(job_ids: list) -> list:
+    """
+    Busca e retorna vários jobs, considerando as escritas que ainda estão no buffer.
+        :param job_ids: Lista de job_ids.
+        :return: Lista com os documentos dos jobs encontrados.
+    """
+    encontrados = {doc['job_id']: doc for doc in retrieve_docs("col_jobs", "job_id", job_ids)}
+    docs = [BUFFER_JOBS.ler(job_id, functools.partial(encontrados.get, job_id)) for job_id in job_ids]
+    return [doc for doc in docs if doc is not None]
+
+
+def agregar_pares_jobs(col, query_jobs_feedback: dict, tamanho_bloco: int = 5000) -> list:
+    """
+    Agrupa, no banco de dados, os pares (label predito, label do feedback) dos jobs que possuem feedback. Somente os
+    campos 'response' e 'feedback' são lidos e a API recebe cada par distinto uma única vez, com a sua quantidade, em
+    blocos colunares (listas 'pred', 'true' e 'n' com até 'tamanho_bloco' pares cada).
+        :param col: Coleção dos jobs.
+        :param query_jobs_feedback: Filtro dos jobs que possuem feedback.
+        :param tamanho_bloco: Quantidade máxima de pares em cada bloco retornado pelo banco de dados.
+        :return: Lista de tuplas (label predito, label do feedback, quantidade).
+    """
+    pipeline = [
+        {'$match': query_jobs_feedback},
+        {'$project': {'_id': 0, 'response': 1, 'feedback': 1}},
+        # Um job com 'response' ou 'feedback' que não seja lista (ex.: documento antigo ou corrompido) é ignorado, em
+        # vez de fazer o '$zip' falhar e derrubar a agregação inteira
+        {'$project': {'par': {'$cond': [{'$and': [{'$isArray': "$response"}, {'$isArray': "$feedback"}]},
+                                        {'$zip': {'inputs': ["$response", "$feedback"]}}, []]}}},
+        {'$unwind': "$par"},
+        {'$group': {'_id': "$par", 'n': {'$sum': 1}}},
+        {'$setWindowFields': {'sortBy': {'_id': 1}, 'output': {'pos': {'$documentNumber': {}}}}},
+        {'$group': {'_id': {'$floor': {'$divide': [{'$subtract': ["$pos", 1]}, tamanho_bloco]}},
+                    'pred': {'$push': {'$arrayElemAt': ["$_id", 0]}},
+                    'true': {'$push': {'$arrayElemAt': ["$_id", 1]}},
+                    'n': {'$push': "$n"}}}
+    ]
+
+    pares = []
+
+    with col.aggregate(pipeline, hint="idx_getfeedback", allowDiskUse=True) as blocos:
+        for bloco in blocos:
+            pares += zip(bloco['pred'], bloco['true'], bloco['n'])
+
+    return pares
+
+
+def limitar_pares(pares: list, limite: int) -> tuple:
+    """
+    Limita a quantidade de labels de uma lista de pares, reduzindo a quantidade de cada par na mesma proporção.
+        :param pares: Lista de tuplas (label predito, label do feedback, quantidade).
+        :param limite: Quantidade máxima de labels.
+        :return: Tupla contendo: pares limitados e quantidade de labels que ficaram de fora.
+    """
+    total = sum(quantidade for _, _, quantidade in pares)
+
+    if total <= limite:
+        return pares, 0
+
+    fator = max(limite, 0) / total
+    limitados = [(pred, true, int(quantidade * fator)) for pred, true, quantidade in pares]
+    limitados = [par for par in limitados if par[2] > 0]
+    return limitados, total - sum(quantidade for _, _, quantidade in limitados)
+
+
+def retrieve_docs_feedback(colecao, nome_modelo, initial_date, end_date) -> dict:
+    """
+    Busca e retorna os dados para realização de feedback de um modelo: os pares de labels dos agregados diários e,
+    para os dias anteriores aos agregados, os pares de labels agrupados a partir dos jobs que possuem feedback. A
+    quantidade de labels é limitada a 'FEEDBACK_MAX_LABELS', priorizando os dias mais recentes.
+        :param colecao: Coleção onde os documentos dos jobs serão procurados.
         :param nome_modelo: Nome do modelo.
         :param initial_date: Data inicial (formato dd/mm/yyyy) para realização do feedback.
         :param end_date: Data final (formato dd/mm/yyyy) para realização do feedback.
-        :return: Dicionário contendo: status e conjunto de documentos (caso sejam encontrados), ou status e mensagem
+        :return: Dicionário contendo: status, totais de jobs e pares de labels (lista de tuplas (label predito, label
+                 do feedback, quantidade)) e quantidade de labels deixados de fora pelo limite, ou status e mensagem
                  de erro caso ocorra.
     """
     # A chave 'bloqueia_novo_feedback' será utilizada pela API para ajudar a prevenir o monopólio de recursos
@@ -333,56 +867,73 @@ def retrieve_docs_feedback(colecao, nome_modelo, initial_date, end_date) -> dict
                                 f"feedback é de 90 dias"
         return resultado
 
-    # Forma a query para pesquisar os jobs que tem feedback (vai utilizar o índice 'idx_getfeedback' no mongoDB)
-    query_jobs_feedback = {
-             'model_name': nome_modelo,
-             'method': "predict",
-             'status': "Done",
-             'has_feedback': True,
-             'datetime': {'$gte': data_epoch_inicial, '$lt': data_epoch_final_mais_1d}
-    }
+    resultado['status'] = "Done"
+    resultado['total_jobs_predict_done'] = 0
+    resultado['total_jobs_has_feedback'] = 0
+    resultado['pares'] = []
+    resultado['labels_deixados'] = 0
 
-    col = CLIENT_BD[colecao]
+    # Os dias a partir do início dos agregados são lidos dos agregados diários (no máximo um documento por dia)
+    inicio_agregados = AGREGADOS_FEEDBACK.inicio
+    dia_inicial = dia_timestamp(data_epoch_inicial)
+    dia_final = dia_timestamp(data_epoch_final)
 
-    # Conta a quantidade de jobs para validar a quantidade máxima, assumindo que cada job terá um único label predito.
-    # A quantidade real de labels será validada na API.
-    try:
-        total_jobs_has_feedback = col.count_documents(filter=query_jobs_feedback, hint="idx_getfeedback")
-    except BaseException as e:
-        gerar_arquivo_erro()
-        raise e
+    if dia_final >= inicio_agregados:
+        try:
+            agregados = AGREGADOS_FEEDBACK.consultar(nome_modelo, max(dia_inicial, inicio_agregados), dia_final,
+                                                     limite_labels=FEEDBACK_MAX_LABELS)
+        except BaseException as e:
+            gerar_arquivo_erro()
+            raise e
 
-    if total_jobs_has_feedback == 0:
-        resultado['status'] = "Error"
-        resultado['response'] = f"Não foram encontrados jobs com feedback entre as datas {initial_date} e " \
-                                f"{end_date}. Escolha outro intervalo de datas e consulte novamente após 30 minutos"
-    elif (total_jobs_has_feedback <= 30000) or (initial_date == end_date):  # Considera o intervalo mínimo de um dia
-        # Forma a query para pesquisar os jobs de predict que estão 'Done' (vai utilizar o índice 'idx_jobs_pred_done')
-        query_jobs_done = {
-            'model_name': nome_modelo,
-            'method': "predict",
-            'status': "Done",
+        resultado['total_jobs_predict_done'] = agregados['predict_done']
+        resultado['total_jobs_has_feedback'] = agregados['jobs_feedback']
+        resultado['pares'] = agregados['pares']
+        resultado['labels_deixados'] = agregados['labels_deixados']
+
+    # Os dias anteriores ao início dos agregados são calculados a partir dos jobs, agrupados no banco de dados
+    resultado['dias_legados'] = dia_inicial < inicio_agregados
+
+    if resultado['dias_legados']:
+        data_epoch_final_legado = min(data_epoch_final_mais_1d,
+                                      datetime.timestamp(datetime.strptime(inicio_agregados, "%Y-%m-%d")))
+
+        # Forma a query para pesquisar os jobs que tem feedback (vai utilizar o índice 'idx_getfeedback' no mongoDB)
+        query_jobs_feedback = {
+                 'model_name': nome_modelo,
+                 'method': "predict",
+                 'status': "Done",
+                 'has_feedback': True,
+                 'datetime': {'$gte': data_epoch_inicial, '$lt': data_epoch_final_legado}
         }
 
-        try:
-            # Auxilia nas estatísticas lá na API
-            total_jobs_predict_done = col.count_documents(filter=query_jobs_done, hint="idx_jobs_pred_done")
-
-            resultado['status'] = "Done"
-            resultado['total_jobs_predict_done'] = total_jobs_predict_done
-            resultado['total_jobs_has_feedback'] = total_jobs_has_feedback
+        col = CLIENT_BD[colecao]
 
-            # Traz na ordem decrescente do campo 'datetime' e limita caso no intervalo de 1 dia existam muitos jobs
-            resultado['docs'] = col.find(query_jobs_feedback, hint="idx_getfeedback").sort("datetime", -1).limit(30000)
+        try:
+            total_jobs_has_feedback = col.count_documents(filter=query_jobs_feedback, hint="idx_getfeedback")
+
+            if total_jobs_has_feedback > 0:
+                # Jobs de predict que estão 'Done' no período, com ou sem feedback (também utiliza o 'idx_getfeedback')
+                query_jobs_done = dict(query_jobs_feedback)
+                query_jobs_done['has_feedback'] = {'$in': [True, False]}
+
+                # Auxilia nas estatísticas lá na API
+                resultado['total_jobs_predict_done'] += col.count_documents(filter=query_jobs_done,
+                                                                            hint="idx_getfeedback")
+                resultado['total_jobs_has_feedback'] += total_jobs_has_feedback
+                # Os dias anteriores aos agregados são os mais antigos: ficam com os labels que sobraram do limite
+                restante = FEEDBACK_MAX_LABELS - sum(quantidade for _, _, quantidade in resultado['pares'])
+                pares, labels_deixados = limitar_pares(agregar_pares_jobs(col, query_jobs_feedback), restante)
+                resultado['pares'] += pares
+                resultado['labels_deixados'] += labels_deixados
         except BaseException as e:
             gerar_arquivo_erro()
             raise e
-    else:
+
+    if resultado['status'] == "Done" and resultado['total_jobs_has_feedback'] == 0:
         resultado['status'] = "Error"
-        resultado['response'] = f"Foram encontrados {total_jobs_has_feedback} jobs com feedback entre as datas " \
-                                f"{initial_date} e {end_date}. Esta quantidade de jobs ultrapassou a quantidade " \
-                                f"máxima (30000) permitida para a consulta de feedback. Escolha um intervalo menor " \
-                                f"entre datas e consulte novamente após 30 minutos"
+        resultado['response'] = f"Não foram encontrados jobs com feedback entre as datas {initial_date} e " \
+                                f"{end_date}. Escolha outro intervalo de datas e consulte novamente mais tarde"
 
     # Bloqueia, pois se chegou até aqui é porque consultou o banco de dados
     resultado['bloqueia_novo_feedback'] = True
@@ -427,6 +978,17 @@ def generate_hash(key: str = "key n/a") -> str:
     return h.hexdigest()
 
 
+def generate_hashes(key: str, quantidade: int) -> list:
+    """
+    Gera vários hashes SHA-256 a partir de um único hash aleatório base. Utilizado para gerar os job_ids de um lote.
+        :param key: Chave adicional para gerar o hash base.
+        :param quantidade: Quantidade de hashes que serão gerados.
+        :return: Lista com os hashes SHA-256 gerados.
+    """
+    base = generate_hash(key)
+    return [sha256(f"{base}:{i}".encode('utf-8')).hexdigest() for i in range(quantidade)]
+
+
 def validate_request(job_id, job_status, client_host):
     """
     Valida alguns dados da requisição.
@@ -457,23 +1019,17 @@ def validate_request(job_id, job_status, client_host):
     return {'status': "Done", 'response': ""}
 
 
-def save_queue_registry(queue_registry: dict) -> dict:
+def save_queue_registry(model_name: str, worker_id: str, formatos: list = None, capacidades: list = None) -> dict:
     """
-    Persiste o registro de filas no banco de dados.
-        :param queue_registry: Registro de filas.
-        :return: True, caso a persistência ocorra com sucesso. False, caso contrário. Também retorna uma mensagem de
-                 erro se houver falha.
+    Persiste, no registro de filas, o worker responsável por um modelo e avisa as demais instâncias da API.
+        :param model_name: Nome do modelo.
+        :param worker_id: Worker ID (nome da fila) responsável pelo modelo.
+        :param formatos: Formatos de mensagem aceitos pelo worker. Se não for informado, somente JSON.
+        :param capacidades: Capacidades opcionais suportadas pelo worker. Se não for informado, nenhuma.
+        :return: Dicionário com o status da persistência e mensagem de erro, caso ocorra.
     """
-    obj_id = ObjectId("000000000000aaaabbbbffff")  # Fixa o _id para facilitar nas buscas e evitar duplicidade de filas
-
     try:
-        r = update_doc("col_queue_registry", "_id", obj_id, {'queue_registry': queue_registry})
-
-        if r.modified_count == 0:
-            msg = "O registro de filas não foi encontrado"
-            LOGGER.error(msg)
-            gerar_arquivo_erro()
-            return {'status': "Error", 'response': msg}
+        REGISTRO_FILAS.registrar(model_name, worker_id, formatos, capacidades)
     except BaseException as e:
         msg = f"Não foi possível salvar o registro de filas: {e.__class__} - {e}"
         LOGGER.error(msg)
@@ -0,0 +1,116 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Formato das mensagens dos jobs enviadas pela API para as filas dos workers.
+#
+# As mensagens podem ser enviadas em JSON (formato original) ou em msgpack, versionado no 'content_type' da mensagem
+# AMQP. As mensagens maiores que o limite de compressão são comprimidas com zstd, indicado no 'content_encoding'. O
+# worker decodifica cada mensagem de acordo com as propriedades AMQP, assim as mensagens em JSON (sem 'content_type' ou
+# com 'application/json') continuam sendo aceitas durante a atualização da Stack. Os workers informam os formatos que
+# decodificam no '/advworkid' e a API só utiliza o msgpack para os modelos cujo worker informou que o aceita.
+#
+# OBS.: este arquivo é o mesmo na API ('api/') e no worker ('workers/worker_pub/'). Altere os dois.
+# --------------------------------------------------------------------------------------------------------------------
+import orjson
+import threading
+
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    msgpack = None
+    zstandard = None
+
+# Tipos de conteúdo das mensagens. Uma mudança incompatível no formato binário deve gerar uma nova versão ('v2'), e a
+# versão anterior deve continuar sendo decodificada enquanto existirem mensagens dela nas filas
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK_V1 = "application/vnd.mlapi.job.v1+msgpack"
+CONTENT_ENCODING_ZSTD = "zstd"
+
+# Os compressores/descompressores do zstd não podem ser utilizados por várias threads ao mesmo tempo
+_locais = threading.local()
+
+
+def formato_disponivel(formato: str) -> bool:
+    """
+    Informa se um formato de mensagem é conhecido e se as bibliotecas necessárias estão instaladas.
+    """
+    return formato == "json" or (formato == "msgpack" and msgpack is not None)
+
+
+def formatos_disponiveis() -> list:
+    """
+    Retorna os formatos de mensagem disponíveis, informados pelo worker para a API no '/advworkid'.
+    """
+    return [formato for formato in ("json", "msgpack") if formato_disponivel(formato)]
+
+
+def _compressor(nivel: int):
+    compressor = getattr(_locais, "compressor", None)
+
+    if compressor is None or _locais.nivel != nivel:
+        compressor = zstandard.ZstdCompressor(level=nivel)
+        _locais.compressor = compressor
+        _locais.nivel = nivel
+
+    return compressor
+
+
+def _descompressor():
+    descompressor = getattr(_locais, "descompressor", None)
+
+    if descompressor is None:
+        descompressor = zstandard.ZstdDecompressor()
+        _locais.descompressor = descompressor
+
+    return descompressor
+
+
+def codificar(mensagem: dict, formato: str = "msgpack", limite_compressao: int = 1024, nivel: int = 3) -> tuple:
+    """
+    Codifica uma mensagem.
+        :param mensagem: Mensagem (dicionário) que será codificada.
+        :param formato: 'json' ou 'msgpack'.
+        :param limite_compressao: Tamanho, em bytes, a partir do qual a mensagem em msgpack é comprimida (0 não
+                                  comprime).
+        :param nivel: Nível de compressão do zstd.
+        :return: Tupla contendo: corpo da mensagem, 'content_type' e 'content_encoding' (None quando não comprimida).
+    """
+    if formato == "json":
+        return orjson.dumps(mensagem), CONTENT_TYPE_JSON, None
+
+    if not formato_disponivel(formato):
+        raise ValueError(f"Formato de mensagem indisponível: '{formato}'")
+
+    corpo = msgpack.packb(mensagem, use_bin_type=True)
+
+    if 0 < limite_compressao < len(corpo):
+        return _compressor(nivel).compress(corpo), CONTENT_TYPE_MSGPACK_V1, CONTENT_ENCODING_ZSTD
+
+    return corpo, CONTENT_TYPE_MSGPACK_V1, None
+
+
+def decodificar(corpo: bytes, content_type: str = None, content_encoding: str = None) -> dict:
+    """
+    Decodifica uma mensagem de acordo com as suas propriedades AMQP.
+        :param corpo: Corpo da mensagem.
+        :param content_type: 'content_type' da mensagem. Se não for informado, a mensagem é considerada JSON.
+        :param content_encoding: 'content_encoding' da mensagem ('zstd' ou None).
+        :return: Mensagem decodificada.
+    """
+    if content_encoding == CONTENT_ENCODING_ZSTD:
+        if zstandard is None:
+            raise ValueError("A mensagem está comprimida com zstd, mas o 'zstandard' não está instalado")
+
+        corpo = _descompressor().decompress(corpo)
+    elif content_encoding not in (None, "", "identity"):
+        raise ValueError(f"Codificação de mensagem não suportada: '{content_encoding}'")
+
+    if content_type in (None, "", CONTENT_TYPE_JSON):
+        return orjson.loads(corpo)
+
+    if content_type == CONTENT_TYPE_MSGPACK_V1:
+        if msgpack is None:
+            raise ValueError("A mensagem está em msgpack, mas o 'msgpack' não está instalado")
+
+        return msgpack.unpackb(corpo, raw=False)
+
+    raise ValueError(f"Tipo de mensagem não suportado: '{content_type}'")
@@ -0,0 +1,384 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Buffer de escrita (write-behind) para os documentos dos jobs.
+#
+# As inserções e atualizações dos jobs são acumuladas em memória e gravadas no banco de dados em lotes ('bulk_write'
+# não ordenado), a cada poucos milissegundos ou quando o lote atinge uma quantidade máxima de operações. As operações
+# de um mesmo job que ainda não foram gravadas são combinadas em uma só (por exemplo, a inserção do job com status
+# 'Queued' e a atualização para 'Done' de um job rápido viram uma única inserção).
+#
+# Enquanto não são gravadas, as operações ficam visíveis para leitura através do método 'ler', que aplica as operações
+# pendentes sobre o documento que está no banco.
+#
+# Somente a inserção é gravada com upsert. As atualizações nunca criam documentos: uma atualização de um documento que
+# não existe (ex.: job desconhecido) não altera nada. As atualizações podem ter uma condição sobre os valores atuais de
+# alguns campos (ex.: não sobrescrever o status 'Done' com 'Running'), avaliada em memória quando o valor do campo já
+# está no buffer e, caso contrário, no filtro da gravação.
+# --------------------------------------------------------------------------------------------------------------------
+import threading
+from time import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+class BufferCheioError(Exception):
+    """
+    Indica que o buffer atingiu a quantidade máxima de operações pendentes e não foi esvaziado a tempo.
+    """
+    pass
+
+
+class BufferEscrita:
+    """
+    Acumula as escritas de uma coleção e as grava em lotes, em uma thread própria.
+    """
+    # Quantidade de tentativas de gravação de uma operação que falhou individualmente no lote
+    MAX_TENTATIVAS = 3
+
+    def __init__(self, colecao, chave: str = "job_id", max_ops_lote: int = 500, intervalo_ms: float = 5,
+                 max_pendentes: int = 10000, timeout_backpressure: float = 10.0, logger=None, ao_falhar=None):
+        """
+        :param colecao: Coleção do pymongo onde os documentos serão gravados.
+        :param chave: Chave que identifica os documentos (utilizada para combinar as operações e nas atualizações).
+        :param max_ops_lote: Quantidade de operações pendentes que dispara a gravação imediata do lote.
+        :param intervalo_ms: Intervalo máximo, em milissegundos, entre as gravações dos lotes.
+        :param max_pendentes: Quantidade máxima de documentos com operações pendentes. Quando atingida, as novas
+                              escritas aguardam a gravação do lote (backpressure).
+        :param timeout_backpressure: Tempo máximo, em segundos, que uma escrita aguarda por espaço no buffer.
+        :param logger: Logger utilizado para registrar os eventos do buffer.
+        :param ao_falhar: Função chamada quando acontece uma falha na gravação de um lote.
+        """
+        self._colecao = colecao
+        self._chave = chave
+        self.max_ops_lote = max_ops_lote
+        self.intervalo = intervalo_ms / 1000
+        self.max_pendentes = max_pendentes
+        self._timeout_backpressure = timeout_backpressure
+        self._logger = logger
+        self._ao_falhar = ao_falhar
+
+        # Operações pendentes por documento: valor da chave -> {'doc': documento completo (inserção) ou None,
+        # 'set': campos alterados, 'cond': condição da gravação}. O dicionário mantém a ordem de chegada
+        self._pendentes = {}
+
+        # Operações do lote que está sendo gravado. Continuam visíveis para leitura até a gravação terminar
+        self._em_voo = {}
+
+        # Número do lote que recebe as novas operações e do último lote gravado. Um lote que falha volta para o buffer
+        # e é gravado junto com o seguinte, por isso a gravação de um lote também confirma a dos anteriores
+        self._lote_atual = 1
+        self._lote_gravado = 0
+
+        self._cond = threading.Condition()
+        self.stats = {'lotes': 0, 'operacoes_recebidas': 0, 'operacoes_gravadas': 0, 'operacoes_descartadas': 0,
+                      'falhas': 0}
+
+        self._thread = threading.Thread(target=self._executar, daemon=True)
+        self._thread.start()
+
+    def _aguardar_espaco(self, valor):
+        """
+        Bloqueia enquanto o buffer estiver cheio. Deve ser chamado com o lock adquirido.
+        """
+        if valor in self._pendentes or len(self._pendentes) < self.max_pendentes:
+            return
+
+        self._cond.notify_all()  # Acorda a thread de gravação
+
+        if not self._cond.wait_for(lambda: len(self._pendentes) < self.max_pendentes,
+                                   timeout=self._timeout_backpressure):
+            raise BufferCheioError(f"O buffer de escrita está cheio ({self.max_pendentes} operações pendentes)")
+
+    @staticmethod
+    def _combinar(entrada: dict, campos: dict, condicao: dict = None) -> bool:
+        """
+        Combina uma atualização com as operações pendentes de um documento. A condição é avaliada com os valores que já
+        estão na entrada e, para os campos desconhecidos, acrescentada à condição da gravação.
+            :param entrada: Operações pendentes do documento.
+            :param campos: Campos que serão alterados.
+            :param condicao: Valores permitidos para alguns campos do documento: {campo: [valores]}.
+            :return: True se a atualização foi combinada, False se foi descartada pela condição.
+        """
+        conhecidos = entrada['doc'] if entrada['doc'] is not None else entrada['set']
+        cond = dict(entrada['cond'])
+
+        for campo, permitidos in (condicao or {}).items():
+            if campo in conhecidos:
+                if conhecidos[campo] not in permitidos:
+                    return False
+
+                # O valor pendente também depende de uma condição: se ela falhar no banco, esta atualização ainda
+                # pode ser aplicada sobre o valor que já está gravado
+                if campo in cond:
+                    cond[campo] = cond[campo] + [v for v in permitidos if v not in cond[campo]]
+            elif campo in cond:
+                cond[campo] = [v for v in cond[campo] if v in permitidos]
+            else:
+                cond[campo] = list(permitidos)
+
+        entrada['cond'] = cond
+
+        if entrada['doc'] is not None:
+            entrada['doc'].update(campos)  # Ainda não foi inserido, basta alterar o documento
+        else:
+            entrada['set'].update(campos)
+
+        return True
+
+    def _registrar(self, valor, doc=None, campos=None, condicao=None) -> bool:
+        with self._cond:
+            self._aguardar_espaco(valor)
+            entrada = self._pendentes.get(valor)
+
+            if entrada is None:
+                entrada = {'doc': None, 'set': {}, 'cond': {}}
+                self._pendentes[valor] = entrada
+
+            if doc is not None:
+                entrada['doc'] = dict(doc)
+                entrada['set'] = {}  # A inserção substitui as alterações anteriores
+                entrada['cond'] = {}
+
+            combinado = True
+
+            if campos:
+                combinado = self._combinar(entrada, campos, condicao)
+
+                if not combinado:
+                    self.stats['operacoes_descartadas'] += 1
+
+                    if entrada['doc'] is None and not entrada['set']:
+                        del self._pendentes[valor]
+
+            self.stats['operacoes_recebidas'] += 1
+
+            if len(self._pendentes) >= self.max_ops_lote:
+                self._cond.notify_all()
+
+            return combinado
+
+    def inserir(self, doc: dict):
+        """
+        Agenda a inserção de um documento.
+            :param doc: Documento que será inserido.
+        """
+        self._registrar(doc[self._chave], doc=doc)
+
+    def inserir_varios(self, docs: list):
+        """
+        Agenda a inserção de vários documentos.
+            :param docs: Lista de documentos que serão inseridos.
+        """
+        for doc in docs:
+            self._registrar(doc[self._chave], doc=doc)
+
+    def atualizar(self, valor, campos: dict, condicao: dict = None) -> bool:
+        """
+        Agenda a atualização ('$set') de um documento. A atualização não cria o documento caso ele não exista.
+            :param valor: Valor da chave do documento.
+            :param campos: Campos que serão alterados.
+            :param condicao: Valores permitidos para alguns campos do documento no momento da atualização:
+                             {campo: [valores]}. Se não for atendida, a atualização é descartada.
+            :return: False se a atualização foi descartada pela condição já na chegada, True caso contrário.
+        """
+        return self._registrar(valor, campos=campos, condicao=condicao)
+
+    def marco(self) -> int:
+        """
+        Retorna o número do lote que contém as operações agendadas até este momento (ver 'aguardar_gravacao').
+        """
+        with self._cond:
+            if self._pendentes:
+                return self._lote_atual
+
+            if self._em_voo:
+                return self._lote_atual - 1  # Lote em gravação
+
+            return self._lote_gravado  # Nada pendente
+
+    def aguardar_gravacao(self, marco: int, timeout: float = None) -> bool:
+        """
+        Aguarda a gravação, no banco de dados, das operações agendadas até o marco informado.
+            :param marco: Número do lote retornado por 'marco'.
+            :param timeout: Tempo máximo de espera, em segundos. Se não for informado, aguarda indefinidamente.
+            :return: True se as operações foram gravadas, False se o tempo de espera terminou antes.
+        """
+        with self._cond:
+            self._cond.notify_all()  # Acorda a thread de gravação
+            return self._cond.wait_for(lambda: self._lote_gravado >= marco, timeout=timeout)
+
+    def pendente(self, valor) -> bool:
+        """
+        Informa se um documento possui operações que ainda não foram gravadas no banco.
+        """
+        with self._cond:
+            return valor in self._pendentes or valor in self._em_voo
+
+    def ler(self, valor, buscar_banco):
+        """
+        Lê um documento considerando as operações que ainda não foram gravadas (leitura 'read-through').
+            :param valor: Valor da chave do documento.
+            :param buscar_banco: Função sem parâmetros que busca o documento no banco de dados.
+            :return: Documento atualizado ou None, caso não seja encontrado.
+        """
+        with self._cond:
+            # Primeiro as operações mais antigas (em gravação) e depois as mais novas
+            entradas = [{'doc': dict(e['doc']) if e['doc'] is not None else None, 'set': dict(e['set']),
+                         'cond': e['cond']}
+                        for e in (self._em_voo.get(valor), self._pendentes.get(valor)) if e is not None]
+
+        doc = None
+        carregado = False
+
+        for e in entradas:
+            if e['doc'] is not None:
+                doc = e['doc']  # Inserção pendente: já contém todas as alterações feitas antes dela
+                carregado = True
+                continue
+
+            if not carregado:
+                doc = buscar_banco()
+                carregado = True
+
+            # Uma atualização cuja condição não é atendida não será gravada
+            if doc is not None and all(doc.get(campo) in permitidos for campo, permitidos in e['cond'].items()):
+                doc.update(e['set'])
+
+        if not carregado:
+            doc = buscar_banco()
+
+        return doc
+
+    def _montar_operacoes(self, lote: dict) -> tuple:
+        valores = []
+        ops = []
+
+        for valor, entrada in lote.items():
+            # Cada documento gera uma única operação, pois a ordem das operações não é garantida no lote
+            if entrada['doc'] is not None:
+                # Os campos do documento já gravado prevalecem sobre os da inserção ('$literal' evita que valores
+                # iniciados com '$' sejam interpretados como expressões)
+                ops.append(UpdateOne({self._chave: valor},
+                                     [{'$replaceRoot': {'newRoot': {'$mergeObjects': [{'$literal': entrada['doc']},
+                                                                                      "$$ROOT"]}}}],
+                                     upsert=True))
+            elif entrada['set']:
+                filtro = {self._chave: valor}
+                filtro.update({campo: {'$in': permitidos} for campo, permitidos in entrada['cond'].items()})
+                ops.append(UpdateOne(filtro, {'$set': entrada['set']}))
+            else:
+                continue
+
+            valores.append(valor)
+
+        return valores, ops
+
+    def _devolver(self, lote: dict):
+        """
+        Devolve operações que não foram gravadas para o buffer, sem sobrescrever as operações que chegaram depois.
+        """
+        with self._cond:
+            for valor, entrada in lote.items():
+                nova = self._pendentes.get(valor)
+
+                if nova is not None:
+                    if nova['doc'] is not None:
+                        continue  # A inserção mais nova substitui a antiga
+
+                    if nova['set'] and not self._combinar(entrada, nova['set'], nova['cond']):
+                        self.stats['operacoes_descartadas'] += 1
+
+                self._pendentes[valor] = entrada
+
+            self._em_voo = {}
+
+    def _gravar(self, lote: dict) -> bool:
+        """
+        Grava um lote de operações.
+            :param lote: Operações pendentes por documento.
+            :return: True se todas as operações do lote foram gravadas (ou descartadas por erro permanente), False se
+                     alguma operação voltou para o buffer.
+        """
+        valores, ops = self._montar_operacoes(lote)
+
+        try:
+            self._colecao.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # As demais operações foram gravadas. As que falharam são repetidas algumas vezes e depois descartadas
+            # (ex.: documento maior que o limite do banco)
+            self.stats['falhas'] += 1
+            erros = e.details.get('writeErrors', [])
+            repetir = {}
+
+            for erro in erros:
+                valor = valores[erro['index']]
+                entrada = lote[valor]
+                entrada['tentativas'] = entrada.get('tentativas', 0) + 1
+
+                if entrada['tentativas'] < self.MAX_TENTATIVAS:
+                    repetir[valor] = entrada
+                else:
+                    self.stats['operacoes_descartadas'] += 1
+
+            if self._logger:
+                self._logger.error(f"Falha na gravação de {len(erros)} operação(ões) do lote ({len(repetir)} serão "
+                                   f"gravadas novamente): {erros[:3]}")
+
+            if self._ao_falhar:
+                self._ao_falhar()
+
+            if repetir:
+                self._devolver(repetir)
+                return False
+
+            return True
+        except BaseException as e:
+            # Falha de conexão: devolve o lote inteiro para o buffer
+            self.stats['falhas'] += 1
+
+            if self._logger:
+                self._logger.error(f"Falha na gravação do lote de {len(ops)} operação(ões). O lote será gravado "
+                                   f"novamente: {e.__class__} - {e}")
+
+            if self._ao_falhar:
+                self._ao_falhar()
+
+            self._devolver(lote)
+            threading.Event().wait(1)  # Evita martelar o banco enquanto ele está indisponível
+            return False
+
+        self.stats['lotes'] += 1
+        self.stats['operacoes_gravadas'] += len(ops)
+        return True
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pendentes) >= self.max_ops_lote, timeout=self.intervalo)
+
+                if not self._pendentes:
+                    continue
+
+                lote = self._pendentes
+                numero_lote = self._lote_atual
+                self._pendentes = {}
+                self._em_voo = lote
+                self._lote_atual += 1
+                self._cond.notify_all()  # Libera as escritas que aguardavam espaço no buffer
+
+            inicio = time()
+            gravado = self._gravar(lote)
+
+            with self._cond:
+                if self._em_voo is lote:
+                    self._em_voo = {}
+
+                if gravado:
+                    self._lote_gravado = numero_lote
+                    self._cond.notify_all()  # Libera quem aguarda a gravação do lote
+
+            # Respeita o intervalo mínimo entre lotes, exceto quando o buffer já está cheio novamente
+            restante = self.intervalo - (time() - inicio)
+
+            if restante > 0:
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self._pendentes) >= self.max_ops_lote, timeout=restante)
@@ -120,6 +120,20 @@ then
         exit 1
     fi
 
+    # Os módulos compartilhados entre a API e o Worker devem ser iguais nas duas pastas
+    modulos_diferentes=""
+
+    for modulo in claim_check.py wire_format.py; do
+        if ! cmp -s "$base_path/api/$modulo" "$base_path/workers/worker_pub/$modulo"; then
+            modulos_diferentes=$modulos_diferentes"$modulo "
+        fi
+    done
+
+    if [ "${modulos_diferentes}" != "" ]; then
+        echo -e "\n\e[1;31mERRO: Estes arquivos estão diferentes nas pastas 'api' e 'workers/worker_pub': $modulos_diferentes\e[0m\n"
+        exit 1
+    fi
+
     if [ -d "$base_path/workers_deploy" ]; then
         echo -e "\n>>> Removendo arquivos de deploys anteriores da pasta 'workers'...\n"
         rm -vfR $base_path/workers_deploy
@@ -132,6 +146,9 @@ then
     cp -vR $base_path/publicar/worker_retrain $base_path/workers_deploy/
     cp -v $base_path/workers/worker_pub/ml_a2edadc4ecb2b9f74bc34.py $base_path/workers_deploy/worker_pub/
     cp -v $base_path/workers/worker_pub/health_check_77zvyn8tefzal7jg.py $base_path/workers_deploy/worker_pub/
+    cp -v $base_path/workers/worker_pub/artifact_cache.py $base_path/workers_deploy/worker_pub/
+    cp -v $base_path/workers/worker_pub/claim_check.py $base_path/workers_deploy/worker_pub/
+    cp -v $base_path/workers/worker_pub/wire_format.py $base_path/workers_deploy/worker_pub/
     cp -v $base_path/workers/worker_retrain/retrain_46b1c135cdef278ddc3b2.py $base_path/workers_deploy/worker_retrain/
     cp -v $base_path/workers/training_model/Dockerfile $base_path/workers_deploy/training_model
     cp -v $base_path/workers/worker_pub/Dockerfile $base_path/workers_deploy/worker_pub
@@ -0,0 +1,214 @@
+# ----------------------------------------------------------------------------------------------------------------------
+# Este script compara a leitura dos jobs com feedback feita pelo 'get_feedback' no caminho antigo da API com o caminho
+# atual (dias anteriores aos agregados diários de feedback). Para executar é necessário um MongoDB acessível (ex.: o da
+# Stack de ML ou 'docker run -p 27017:27017 mongo') e o 'pymongo', o 'orjson' e o 'numpy' instalados
+# (pip install pymongo orjson numpy).
+#
+# - Antigo: 'find' dos documentos completos dos jobs (limitado a 30000) e montagem das listas de labels em um loop
+#   Python ('y_pred += doc["response"]'), seguido de 'list(set(y_true))'.
+# - Atual: pipeline de agregação que projeta só 'response'/'feedback', agrupa os pares de labels no banco de dados e
+#   devolve os pares distintos em blocos colunares (mesmo pipeline da função 'agregar_pares_jobs' da API), limitados a
+#   30000 labels.
+#
+# Os dois caminhos incluem a preparação dos labels e a serialização da mensagem do job enviada ao worker: listas
+# 'y_pred'/'y_true' no antigo; no atual, os pares codificados no formato de matriz de confusão (mesma codificação da
+# função 'codificar_labels_feedback' da API) e, para os workers de versões anteriores, as listas montadas a partir dos
+# pares ('atual_lst').
+#
+# A coleção de teste é populada uma única vez com 'QTD_JOBS' jobs (padrão: 10 milhões, o que pode levar alguns minutos),
+# dos quais 'QTD_JOBS_FEEDBACK' têm feedback no dia consultado. São mostrados, para cada caminho, os bytes enviados pelo
+# banco de dados (contador 'network.bytesOut' do 'serverStatus'), o tamanho da mensagem do job, o tempo de CPU gasto
+# pela API e o tempo total.
+#
+# Variáveis de ambiente: MONGO_URI (padrão: mongodb://localhost:27017), QTD_JOBS e QTD_JOBS_FEEDBACK.
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import base64
+import orjson
+import numpy as np
+from time import perf_counter, process_time
+from random import choice, random
+from hashlib import sha256
+from pymongo import MongoClient
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+
+# Quantidade total de jobs da coleção e quantidade de jobs com feedback no dia consultado
+QTD_JOBS = int(os.environ.get("QTD_JOBS", "10000000"))
+QTD_JOBS_FEEDBACK = int(os.environ.get("QTD_JOBS_FEEDBACK", "30000"))
+
+# Quantidade máxima de labels analisados em um 'get_feedback' (mesmo valor de 'FEEDBACK_MAX_LABELS' da API)
+MAX_LABELS = 30000
+
+# Dia consultado (timestamp do início do dia) e labels do modelo fictício
+DIA_CONSULTA = 1700000000.0
+LABELS = ["not_cyberbullying", "gender", "religion", "other_cyberbullying", "age", "ethnicity"]
+
+# Códigos para impressão de mensagens coloridas no terminal
+GREEN = "\033[0;32m"
+RESET = "\033[0;0m"
+
+
+def gerar_job(i: int, com_feedback: bool) -> dict:
+    response = [choice(LABELS)]
+    return {'job_id': sha256(str(i).encode()).hexdigest(), 'model_name': "model_a", 'model_version': "3",
+            'method': "predict", 'status': "Done", 'ttl': 90000,
+            'datetime': DIA_CONSULTA + random() * 86000 if com_feedback else DIA_CONSULTA - 86400 * (1 + i % 300),
+            'queue_response_time_sec': random(), 'total_response_time_sec': random(), 'response': response,
+            'feedback': [choice(LABELS) if random() < 0.2 else response[0]] if com_feedback else "",
+            'has_feedback': com_feedback}
+
+
+def popular(col):
+    """
+    Popula a coleção de teste, caso ainda não tenha a quantidade de jobs esperada.
+    """
+    if col.estimated_document_count() == QTD_JOBS:
+        return
+
+    col.drop()
+    col.create_index([("model_name", 1), ("method", 1), ("status", 1), ("has_feedback", 1), ("datetime", 1)],
+                     name="idx_getfeedback")
+    lote = []
+
+    for i in range(QTD_JOBS):
+        lote.append(gerar_job(i, i < QTD_JOBS_FEEDBACK))
+
+        if len(lote) == 10000:
+            col.insert_many(lote, ordered=False)
+            lote = []
+            print(f"\rPopulando a coleção de teste: {i + 1}/{QTD_JOBS} jobs", end="")
+
+    if lote:
+        col.insert_many(lote, ordered=False)
+
+    print()
+
+
+def leitura_antiga(col, query: dict):
+    y_pred = []
+    y_true = []
+    qtd_labels = 0
+
+    for doc in col.find(query, hint="idx_getfeedback").sort("datetime", -1).limit(30000):
+        if qtd_labels + len(doc['response']) > 30000:
+            break
+
+        y_pred += doc['response']
+        y_true += doc['feedback']
+        qtd_labels += len(doc['response'])
+
+    metricas_api = {'feedback_labels_types': list(set(y_true))}
+    return orjson.dumps({'y_pred': y_pred, 'y_true': y_true, 'api_metrics': metricas_api})
+
+
+def limitar_pares(pares: list, limite: int) -> list:
+    total = sum(quantidade for _, _, quantidade in pares)
+
+    if total <= limite:
+        return pares
+
+    return [(pred, true, int(quantidade * limite / total)) for pred, true, quantidade in pares
+            if int(quantidade * limite / total) > 0]
+
+
+def codificar_labels(pares: list) -> dict:
+    vocabulario = []
+    codigos = {}
+
+    for pred, true, _ in pares:
+        for label in (pred, true):
+            chave = orjson.dumps(label)
+
+            if chave not in codigos:
+                codigos[chave] = len(vocabulario)
+                vocabulario.append(label)
+
+    dtype = np.uint8 if len(vocabulario) <= 256 else np.uint16 if len(vocabulario) <= 65536 else np.uint32
+    quantidades = np.fromiter((quantidade for _, _, quantidade in pares), dtype=np.uint32, count=len(pares))
+    codigos_pred = np.fromiter((codigos[orjson.dumps(pred)] for pred, _, _ in pares), dtype=dtype, count=len(pares))
+    codigos_true = np.fromiter((codigos[orjson.dumps(true)] for _, true, _ in pares), dtype=dtype, count=len(pares))
+
+    return {'vocabulary': vocabulario, 'dtype': np.dtype(dtype).name,
+            'y_pred': base64.b64encode(codigos_pred.tobytes()).decode(),
+            'y_true': base64.b64encode(codigos_true.tobytes()).decode(),
+            'counts': base64.b64encode(quantidades.tobytes()).decode()}
+
+
+def leitura_atual(col, query: dict, listas: bool = False, tamanho_bloco: int = 5000):
+    pipeline = [
+        {'$match': query},
+        {'$project': {'_id': 0, 'response': 1, 'feedback': 1}},
+        {'$project': {'par': {'$zip': {'inputs': ["$response", "$feedback"]}}}},
+        {'$unwind': "$par"},
+        {'$group': {'_id': "$par", 'n': {'$sum': 1}}},
+        {'$setWindowFields': {'sortBy': {'_id': 1}, 'output': {'pos': {'$documentNumber': {}}}}},
+        {'$group': {'_id': {'$floor': {'$divide': [{'$subtract': ["$pos", 1]}, tamanho_bloco]}},
+                    'pred': {'$push': {'$arrayElemAt': ["$_id", 0]}},
+                    'true': {'$push': {'$arrayElemAt': ["$_id", 1]}},
+                    'n': {'$push': "$n"}}}
+    ]
+    pares = []
+
+    with col.aggregate(pipeline, hint="idx_getfeedback", allowDiskUse=True) as blocos:
+        for bloco in blocos:
+            pares += zip(bloco['pred'], bloco['true'], bloco['n'])
+
+    pares = limitar_pares(pares, MAX_LABELS)
+    metricas_api = {'feedback_labels_types': list({true for _, true, _ in pares})}
+
+    if not listas:
+        return orjson.dumps({'encoded_labels': codificar_labels(pares), 'api_metrics': metricas_api})
+
+    y_pred = []
+    y_true = []
+
+    for pred, true, quantidade in pares:
+        y_pred += [pred] * quantidade
+        y_true += [true] * quantidade
+
+    return orjson.dumps({'y_pred': y_pred, 'y_true': y_true, 'api_metrics': metricas_api})
+
+
+def medir(client, funcao, *args) -> tuple:
+    """
+    Executa uma leitura e mede os bytes enviados pelo banco de dados, o tamanho da mensagem do job, o tempo de CPU da
+    API e o tempo total.
+        :param client: Client do MongoDB (utilizado para consultar o 'serverStatus').
+        :param funcao: Função de leitura, que retorna a mensagem do job serializada.
+        :param args: Argumentos da função de leitura.
+        :return: Tupla contendo: bytes enviados, bytes da mensagem, tempo de CPU (s) e tempo total (s).
+    """
+    bytes_inicio = client.admin.command("serverStatus")['network']['bytesOut']
+    cpu_inicio = process_time()
+    inicio = perf_counter()
+    mensagem = funcao(*args)
+    duracao = perf_counter() - inicio
+    cpu = process_time() - cpu_inicio
+    return client.admin.command("serverStatus")['network']['bytesOut'] - bytes_inicio, len(mensagem), cpu, duracao
+
+
+if __name__ == "__main__":
+    client = MongoClient(MONGO_URI)
+    col = client["benchmark_feedback"]["col_jobs"]
+    popular(col)
+
+    query = {'model_name': "model_a", 'method': "predict", 'status': "Done", 'has_feedback': True,
+             'datetime': {'$gte': DIA_CONSULTA, '$lt': DIA_CONSULTA + 86400}}
+
+    leitura_antiga(col, query)  # Aquecimento (cache do banco de dados)
+    antigo = medir(client, leitura_antiga, col, query)
+    atual = medir(client, leitura_atual, col, query)
+    atual_lst = medir(client, leitura_atual, col, query, True)
+
+    print(f"Jobs na coleção: {QTD_JOBS} | Jobs com feedback no dia consultado: {QTD_JOBS_FEEDBACK}\n")
+    print(f"{'':<10} {'bytes enviados':>16} | {'bytes da mensagem':>17} | {'CPU da API (ms)':>16} | "
+          f"{'tempo total (ms)':>17}")
+
+    for nome, (bytes_enviados, bytes_mensagem, cpu, duracao) in (("antigo", antigo), ("atual", atual),
+                                                                 ("atual_lst", atual_lst)):
+        print(f"{nome:<10} {bytes_enviados:>16} | {bytes_mensagem:>17} | {cpu * 1000:>16.1f} | "
+              f"{duracao * 1000:>17.1f}")
+
+    print(f"\n{GREEN}{antigo[0] / max(atual[0], 1):.1f}x menos bytes do banco | {antigo[1] / max(atual[1], 1):.1f}x "
+          f"menos bytes na mensagem | {antigo[2] / max(atual[2], 1e-6):.1f}x menos CPU na API{RESET}")
@@ -0,0 +1,89 @@
+# ----------------------------------------------------------------------------------------------------------------------
+# Este script compara o custo de (de)serialização JSON do caminho antigo da API com o caminho atual, sem precisar da
+# Stack de ML em execução. Para executar é necessário instalar o 'orjson' e o 'pydantic' (pip install orjson pydantic).
+#
+# Cenários medidos:
+#
+# - 'inference': requisição de 'predict' com 100 features, no mesmo caminho percorrido pelo FastAPI: leitura do corpo
+#   com o 'json' da biblioteca padrão (feita pelo Starlette em 'request.json()') e validação do modelo do pydantic. No
+#   caminho antigo, o 'await info.json()' do endpoint devolvia o JSON já guardado pelo Starlette (sem nova leitura) e o
+#   job era serializado com 'json.dumps'. No caminho atual, o job é montado com 'model_dump' e serializado com
+#   'orjson'. A diferença vem somente da serialização do job.
+# - 'get_feedback': serialização da resposta do 'get_feedback' com 30000 labels.
+# - 'retorno': leitura, pela API, do payload enviado pelo worker no '/retorno'.
+#
+# Os resultados são mostrados em microssegundos por requisição (média de 'REPETICOES' execuções).
+# ----------------------------------------------------------------------------------------------------------------------
+import json
+import orjson
+from time import perf_counter
+from typing import Optional
+from pydantic import BaseModel
+from random import random, choice
+
+# Quantidade de execuções de cada cenário
+REPETICOES = 2000
+
+# Códigos para impressão de mensagens coloridas no terminal
+GREEN = "\033[0;32m"
+RESET = "\033[0;0m"
+
+
+class InferenceRequest(BaseModel):
+    # Mesmo modelo do endpoint '/inference' da API
+    model_name: str
+    features: Optional[list] = None
+    targets: Optional[list] = None
+    method: str
+
+
+def medir(funcao, repeticoes: int = REPETICOES) -> float:
+    """
+    Executa uma função várias vezes e retorna o tempo médio de cada execução.
+        :param funcao: Função sem parâmetros que será medida.
+        :param repeticoes: Quantidade de execuções.
+        :return: Tempo médio, em microssegundos.
+    """
+    funcao()  # Aquecimento
+    inicio = perf_counter()
+
+    for _ in range(repeticoes):
+        funcao()
+
+    return (perf_counter() - inicio) / repeticoes * 1e6
+
+
+def mostrar(cenario: str, antigo: float, atual: float):
+    print(f"{cenario:<14} antigo: {antigo:10.1f} µs | atual: {atual:10.1f} µs | "
+          f"{GREEN}{antigo / atual:5.1f}x mais rápido{RESET}")
+
+
+if __name__ == "__main__":
+    corpo_inference = json.dumps({'model_name': "model_a", 'method': "predict",
+                                  'features': [[random() for _ in range(100)]]}).encode("utf-8")
+    job_extra = {'job_id': "a" * 64, 'token': "t" * 64, 'datetime': 1700000000.0, 'ttl': 90000}
+
+    def inference_antigo():
+        req_info = json.loads(corpo_inference)  # Starlette ('request.json()'), reaproveitado pelo 'await info.json()'
+        InferenceRequest.model_validate(req_info)  # FastAPI
+        req_info.update(job_extra)
+        return json.dumps(req_info).encode("utf-8")
+
+    def inference_atual():
+        cr = InferenceRequest.model_validate(json.loads(corpo_inference))  # Starlette e FastAPI
+        req_info = cr.model_dump(exclude_unset=True)
+        req_info.update(job_extra)
+        return orjson.dumps(req_info)
+
+    labels = ["classe_a", "classe_b", "classe_c", "classe_d"]
+    resposta_feedback = {'status': "Done", 'response': {'y_pred': [choice(labels) for _ in range(30000)],
+                                                        'y_true': [choice(labels) for _ in range(30000)]}}
+
+    corpo_retorno = json.dumps({'job_id': "a" * 64, 'status': "Done", 'model_version': "1",
+                                'response': [[random() for _ in range(10)]]}).encode("utf-8")
+
+    print(f"Repetições por cenário: {REPETICOES}\n")
+    mostrar("inference", medir(inference_antigo), medir(inference_atual))
+    mostrar("get_feedback", medir(lambda: json.dumps(resposta_feedback).encode("utf-8"), 200),
+            medir(lambda: orjson.dumps(resposta_feedback), 200))
+    mostrar("retorno", medir(lambda: json.loads(corpo_retorno)), medir(lambda: orjson.loads(corpo_retorno)))
@@ -0,0 +1,108 @@
+# ----------------------------------------------------------------------------------------------------------------------
+# Este script compara os formatos das mensagens dos jobs publicadas pela API nas filas dos workers, sem precisar da
+# Stack de ML em execução. Para executar é necessário instalar o 'orjson', o 'msgpack' e o 'zstandard'
+# (pip install orjson msgpack zstandard).
+#
+# Formatos comparados (ver 'api/wire_format.py'):
+#
+# - 'json': formato original ('orjson').
+# - 'msgpack': msgpack sem compressão.
+# - 'msgpack+zstd': msgpack comprimido com zstd (nível 'NIVEL_ZSTD'), utilizado nas mensagens maiores que
+#   'JOB_WIRE_COMPRESS_BYTES'.
+#
+# Cenários medidos:
+#
+# - 'predict_num': job de 'predict' com 100 features numéricas.
+# - 'predict_texto': job de 'predict' com 20 textos de aproximadamente 1000 caracteres.
+# - 'feedback_listas': job de 'get_feedback' com as listas 'y_pred' e 'y_true' de 30000 labels.
+# - 'feedback_cod': job de 'get_feedback' com os labels codificados (vocabulário e arrays de códigos em base64).
+#
+# São mostrados, para cada cenário e formato, os bytes por job e o tempo médio, em microssegundos, da codificação (API)
+# e da decodificação (worker).
+# ----------------------------------------------------------------------------------------------------------------------
+import base64
+import orjson
+import msgpack
+import zstandard
+from time import perf_counter
+from random import random, choice, randrange
+
+# Quantidade de execuções de cada cenário (os cenários de 'get_feedback' utilizam um décimo)
+REPETICOES = 2000
+
+# Nível de compressão do zstd (mesmo padrão da variável 'JOB_WIRE_ZSTD_LEVEL' da API)
+NIVEL_ZSTD = 3
+
+# Códigos para impressão de mensagens coloridas no terminal
+GREEN = "\033[0;32m"
+RESET = "\033[0;0m"
+
+PALAVRAS = ["processo", "requerimento", "pedido", "análise", "documento", "secretaria", "estado", "servidor",
+            "protocolo", "atendimento", "solicitação", "prazo", "resposta", "cidadão", "informação", "órgão"]
+
+
+def medir(funcao, repeticoes: int = REPETICOES) -> float:
+    """
+    Executa uma função várias vezes e retorna o tempo médio de cada execução.
+        :param funcao: Função sem parâmetros que será medida.
+        :param repeticoes: Quantidade de execuções.
+        :return: Tempo médio, em microssegundos.
+    """
+    funcao()  # Aquecimento
+    inicio = perf_counter()
+
+    for _ in range(repeticoes):
+        funcao()
+
+    return (perf_counter() - inicio) / repeticoes * 1e6
+
+
+def gerar_jobs() -> dict:
+    base = {'job_id': "a" * 64, 'token': "t" * 64, 'datetime': 1700000000.0, 'ttl': 90000, 'model_name': "model_a"}
+    labels = ["not_cyberbullying", "gender", "religion", "other_cyberbullying", "age", "ethnicity"]
+    codigos_pred = bytes(randrange(len(labels)) for _ in range(30000))
+    codigos_true = bytes(randrange(len(labels)) for _ in range(30000))
+
+    return {
+        'predict_num': {**base, 'method': "predict", 'features': [[random() for _ in range(100)]]},
+        'predict_texto': {**base, 'method': "predict",
+                          'features': [" ".join(choice(PALAVRAS) for _ in range(100)) for _ in range(20)]},
+        'feedback_listas': {**base, 'method': "get_feedback", 'datetime_temp_queue': 1700000000.0,
+                            'y_pred': [choice(labels) for _ in range(30000)],
+                            'y_true': [choice(labels) for _ in range(30000)]},
+        'feedback_cod': {**base, 'method': "get_feedback", 'datetime_temp_queue': 1700000000.0,
+                         'encoded_labels': {'vocabulary': labels, 'dtype': "uint8",
+                                            'y_pred': base64.b64encode(codigos_pred).decode(),
+                                            'y_true': base64.b64encode(codigos_true).decode()}}
+    }
+
+
+if __name__ == "__main__":
+    compressor = zstandard.ZstdCompressor(level=NIVEL_ZSTD)
+    descompressor = zstandard.ZstdDecompressor()
+
+    formatos = {
+        'json': (orjson.dumps, orjson.loads),
+        'msgpack': (lambda job: msgpack.packb(job, use_bin_type=True), lambda corpo: msgpack.unpackb(corpo, raw=False)),
+        'msgpack+zstd': (lambda job: compressor.compress(msgpack.packb(job, use_bin_type=True)),
+                         lambda corpo: msgpack.unpackb(descompressor.decompress(corpo), raw=False))
+    }
+
+    print(f"Repetições por cenário: {REPETICOES} | Nível do zstd: {NIVEL_ZSTD}\n")
+    print(f"{'cenário':<16} {'formato':<13} {'bytes/job':>10} | {'codificação (µs)':>17} | "
+          f"{'decodificação (µs)':>19}")
+
+    for cenario, job in gerar_jobs().items():
+        repeticoes = REPETICOES if cenario.startswith("predict") else REPETICOES // 10
+        bytes_json = None
+
+        for formato, (codificar, decodificar) in formatos.items():
+            corpo = codificar(job)
+            assert decodificar(corpo) == job
+            bytes_json = bytes_json or len(corpo)
+            tempo_cod = medir(lambda: codificar(job), repeticoes)
+            tempo_dec = medir(lambda: decodificar(corpo), repeticoes)
+            print(f"{cenario:<16} {formato:<13} {len(corpo):>10} | {tempo_cod:>17.1f} | {tempo_dec:>19.1f} "
+                  f"{GREEN}{bytes_json / len(corpo):5.1f}x menos bytes{RESET}")
+
+        print()
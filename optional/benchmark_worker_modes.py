@@ -0,0 +1,90 @@
+# ----------------------------------------------------------------------------------------------------------------------
+# Este script compara os modos de execução dos modelos do worker ('WORKER_EXECUTION_MODE'): 'thread' (pool de threads
+# em um único processo) e 'process' (processos filhos criados via fork depois que o modelo foi carregado), sem precisar
+# da Stack de ML em execução.
+#
+# É utilizado um modelo fictício com um 'predict' CPU-bound escrito em Python puro, como acontece em muitos modelos
+# de pré-processamento de texto. O modelo é carregado uma única vez no processo principal, assim como no worker, e os
+# processos filhos o recebem via fork (copy-on-write).
+#
+# Para cada quantidade de threads/processos (de 1 até a quantidade de núcleos da máquina) é mostrada a vazão em
+# jobs/segundo de cada modo. No modo 'thread' a vazão não aumenta com a quantidade de threads por causa do GIL.
+#
+# OBS.: o modo 'process' depende do fork, portanto só funciona em Linux/macOS (o mesmo ambiente dos containers).
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import multiprocessing
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Quantidade de jobs processados em cada medição
+QTD_JOBS = 64
+
+# Quantidade de itens (features) de cada job
+ITENS_POR_JOB = 20
+
+# Códigos para impressão de mensagens coloridas no terminal
+GREEN = "\033[0;32m"
+RESET = "\033[0;0m"
+
+
+class ModeloFicticio:
+    """
+    Modelo fictício com um vocabulário grande em memória e um 'predict' CPU-bound.
+    """
+    def __init__(self):
+        self.vocabulario = {f"termo_{i}": i % 7 for i in range(500000)}
+
+    def predict(self, dataset: list) -> list:
+        retorno = []
+
+        for texto in dataset:
+            pontos = 0
+
+            for i in range(5000):
+                pontos += self.vocabulario.get(f"termo_{(hash(texto) + i) % 500000}", 0)
+
+            retorno.append(f"classe_{pontos % 3}")
+
+        return retorno
+
+
+# Carregado uma única vez, antes da criação dos processos (igual ao 'MODELOS' do worker)
+MODELO = ModeloFicticio()
+
+
+def executar_job(dataset: list) -> list:
+    return MODELO.predict(dataset=dataset)
+
+
+def medir(executor, jobs: list) -> float:
+    """
+    Processa todos os jobs no executor e retorna a vazão.
+        :param executor: Pool de threads ou de processos.
+        :param jobs: Lista com as features de cada job.
+        :return: Vazão, em jobs/segundo.
+    """
+    inicio = perf_counter()
+    list(executor.map(executar_job, jobs))
+    return len(jobs) / (perf_counter() - inicio)
+
+
+if __name__ == "__main__":
+    jobs = [[f"texto {j}-{i}" for i in range(ITENS_POR_JOB)] for j in range(QTD_JOBS)]
+    contexto_fork = multiprocessing.get_context("fork")
+    nucleos = os.cpu_count() or 1
+    qtds = sorted({1, 2, 4, nucleos} & set(range(1, nucleos + 1)))
+
+    print(f"Núcleos: {nucleos} | Jobs por medição: {QTD_JOBS} | Itens por job: {ITENS_POR_JOB}\n")
+    print(f"{'Threads/processos':>18} | {'thread (jobs/s)':>16} | {'process (jobs/s)':>17} | {'ganho':>7}")
+
+    for qtd in qtds:
+        with ThreadPoolExecutor(max_workers=qtd) as executor:
+            vazao_thread = medir(executor, jobs)
+
+        with ProcessPoolExecutor(max_workers=qtd, mp_context=contexto_fork) as executor:
+            executor.submit(os.getpid).result()  # Cria os processos antes da medição
+            vazao_processo = medir(executor, jobs)
+
+        print(f"{qtd:>18} | {vazao_thread:>16.1f} | {vazao_processo:>17.1f} | "
+              f"{GREEN}{vazao_processo / vazao_thread:>6.2f}x{RESET}")
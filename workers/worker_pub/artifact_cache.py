@@ -0,0 +1,332 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Cache local (em disco) dos artefatos dos modelos baixados do Model Registry (MLflow/MinIO).
+#
+# A cada inicialização do worker, a mllibprodest carrega o modelo de produção ('models:/<modelo>@production') e baixa
+# todos os artefatos da run ('runs:/<run_id>/'), mesmo que a mesma run tenha sido carregada um minuto antes. O cache
+# intercepta essas duas chamadas do MLflow ('mlflow.pyfunc.load_model' e 'mlflow.artifacts.download_artifacts'):
+#
+# - O alias do modelo é resolvido para o endereço imutável dos artefatos da versão (consulta leve ao MLflow). Os
+#   endereços imutáveis ('runs:/<run_id>/...' e o 'source' da versão do modelo) são a chave dos manifestos.
+# - Cada manifesto lista os arquivos baixados com o hash (sha256) e o tamanho de cada um. O conteúdo dos arquivos fica
+#   em 'blobs', endereçado pelo hash, assim um arquivo igual em runs diferentes é guardado uma única vez.
+# - Ao utilizar o cache, os arquivos são copiados para o destino e o hash é conferido na cópia. Um arquivo corrompido
+#   invalida o manifesto e os artefatos são baixados novamente.
+# - O tamanho do cache é limitado: os manifestos usados há mais tempo são removidos, junto com os blobs que não são
+#   mais referenciados.
+#
+# O diretório do cache pode ser compartilhado entre as réplicas do worker (volume). As gravações são atômicas (arquivo
+# temporário + rename) e a limpeza é protegida por um lock de arquivo.
+# --------------------------------------------------------------------------------------------------------------------
+import os
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import weakref
+import orjson
+from pathlib import Path
+from time import time
+
+# Tamanho dos blocos utilizados na leitura/cópia dos arquivos
+TAMANHO_BLOCO = 1024 * 1024
+
+
+class IntegridadeError(Exception):
+    """
+    Indica que o conteúdo de um arquivo do cache não confere com o hash do manifesto.
+    """
+
+
+class CacheArtefatos:
+    """
+    Cache local, endereçado por conteúdo, dos artefatos baixados do Model Registry.
+    """
+    def __init__(self, diretorio: str, max_mb: float = 5120, logger=None):
+        """
+        :param diretorio: Diretório do cache (pode ser um volume compartilhado entre as réplicas do worker).
+        :param max_mb: Tamanho máximo, em MB, do conteúdo guardado no cache.
+        :param logger: Logger utilizado para registrar os eventos do cache.
+        """
+        self._dir = Path(diretorio)
+        self._dir_blobs = self._dir / "blobs"
+        self._dir_manifestos = self._dir / "manifests"
+        self._dir_temp = self._dir / "tmp"
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._logger = logger
+        self._lock = threading.Lock()
+        self.stats = {'acertos': 0, 'faltas': 0, 'falhas_integridade': 0, 'manifestos_removidos': 0,
+                      'segundos_economizados': 0.0}
+
+        for d in (self._dir_blobs, self._dir_manifestos, self._dir_temp):
+            d.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _chave(uri: str) -> str:
+        return hashlib.sha256(uri.encode("utf-8")).hexdigest()
+
+    def _caminho_blob(self, hash_arquivo: str) -> Path:
+        return self._dir_blobs / hash_arquivo[:2] / hash_arquivo
+
+    def _caminho_manifesto(self, uri: str) -> Path:
+        return self._dir_manifestos / f"{self._chave(uri)}.json"
+
+    def obter(self, uri: str, destino: str, baixar) -> str:
+        """
+        Coloca no destino os artefatos de um endereço imutável, utilizando o cache ou baixando-os.
+            :param uri: Endereço imutável dos artefatos (ex.: 'runs:/<run_id>/').
+            :param destino: Diretório local de destino dos artefatos.
+            :param baixar: Função que recebe o diretório de destino, baixa os artefatos e retorna o caminho local
+                           retornado pelo MLflow.
+            :return: Caminho local dos artefatos (o mesmo que o MLflow retornaria).
+        """
+        caminho_manifesto = self._caminho_manifesto(uri)
+
+        if caminho_manifesto.exists():
+            try:
+                return self._materializar(caminho_manifesto, destino)
+            except IntegridadeError as e:
+                self.stats['falhas_integridade'] += 1
+                self._log(f"Artefatos em cache inválidos para '{uri}'. Os artefatos serão baixados novamente: {e}")
+                caminho_manifesto.unlink(missing_ok=True)
+            except (OSError, ValueError, KeyError) as e:
+                self._log(f"Não foi possível utilizar os artefatos em cache de '{uri}'. Os artefatos serão baixados "
+                          f"novamente: {e.__class__} - {e}")
+
+        self.stats['faltas'] += 1
+        inicio = time()
+        retorno = baixar(destino)
+        tempo_download = time() - inicio
+
+        try:
+            self._guardar(uri, destino, retorno, tempo_download)
+            self._limpar()
+        except BaseException as e:
+            # O cache é só uma otimização: os artefatos já foram baixados para o destino
+            self._log(f"Não foi possível guardar os artefatos de '{uri}' no cache: {e.__class__} - {e}")
+
+        return retorno
+
+    def _materializar(self, caminho_manifesto: Path, destino: str) -> str:
+        inicio = time()
+        manifesto = orjson.loads(caminho_manifesto.read_bytes())
+        destino = Path(destino)
+
+        for caminho_relativo, info in manifesto['arquivos'].items():
+            caminho_destino = destino / caminho_relativo
+            caminho_destino.parent.mkdir(parents=True, exist_ok=True)
+            self._copiar_conferindo(self._caminho_blob(info['sha256']), caminho_destino, info['sha256'])
+
+        # Marca o manifesto como usado recentemente (ordem de remoção da limpeza)
+        os.utime(caminho_manifesto)
+
+        with self._lock:
+            self.stats['acertos'] += 1
+            self.stats['segundos_economizados'] += max(manifesto['tempo_download'] - (time() - inicio), 0)
+
+        return str(destino / manifesto['retorno']) if manifesto['retorno'] != "." else str(destino)
+
+    @staticmethod
+    def _copiar_conferindo(origem: Path, destino: Path, hash_esperado: str):
+        h = hashlib.sha256()
+
+        try:
+            with open(origem, "rb") as arq_origem, open(destino, "wb") as arq_destino:
+                while bloco := arq_origem.read(TAMANHO_BLOCO):
+                    h.update(bloco)
+                    arq_destino.write(bloco)
+        except FileNotFoundError:
+            raise IntegridadeError(f"O arquivo '{origem.name}' não existe no cache") from None
+
+        if h.hexdigest() != hash_esperado:
+            origem.unlink(missing_ok=True)
+            raise IntegridadeError(f"O hash do arquivo '{destino.name}' não confere com o manifesto")
+
+    def _guardar(self, uri: str, destino: str, retorno: str, tempo_download: float):
+        destino = Path(destino)
+        caminho_retorno = Path(retorno)
+        arquivos = {}
+
+        if caminho_retorno.is_dir():
+            lista = [p for p in caminho_retorno.rglob("*") if p.is_file()]
+        else:
+            lista = [caminho_retorno]
+
+        for caminho in lista:
+            hash_arquivo, tamanho = self._guardar_blob(caminho)
+            arquivos[str(caminho.relative_to(destino))] = {'sha256': hash_arquivo, 'tamanho': tamanho}
+
+        manifesto = {'uri': uri, 'retorno': os.path.relpath(caminho_retorno, destino), 'arquivos': arquivos,
+                     'tempo_download': tempo_download, 'criado_em': time()}
+        self._gravar_atomico(self._caminho_manifesto(uri), orjson.dumps(manifesto))
+
+    def _guardar_blob(self, caminho: Path) -> tuple:
+        h = hashlib.sha256()
+        fd, temp = tempfile.mkstemp(dir=self._dir_temp)
+
+        try:
+            with open(caminho, "rb") as arq_origem, os.fdopen(fd, "wb") as arq_temp:
+                while bloco := arq_origem.read(TAMANHO_BLOCO):
+                    h.update(bloco)
+                    arq_temp.write(bloco)
+
+            hash_arquivo = h.hexdigest()
+            caminho_blob = self._caminho_blob(hash_arquivo)
+
+            if caminho_blob.exists():
+                os.unlink(temp)  # Conteúdo já guardado (mesmo arquivo em outra run)
+            else:
+                caminho_blob.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp, caminho_blob)
+        except BaseException:
+            Path(temp).unlink(missing_ok=True)
+            raise
+
+        return hash_arquivo, caminho.stat().st_size
+
+    def _gravar_atomico(self, caminho: Path, conteudo: bytes):
+        fd, temp = tempfile.mkstemp(dir=self._dir_temp)
+
+        with os.fdopen(fd, "wb") as arq:
+            arq.write(conteudo)
+
+        os.replace(temp, caminho)
+
+    def _limpar(self):
+        """
+        Remove os manifestos usados há mais tempo até o conteúdo referenciado caber no tamanho máximo e, em seguida,
+        remove os blobs que não são mais referenciados.
+        """
+        with open(self._dir / ".lock", "w") as arq_lock:
+            fcntl.flock(arq_lock, fcntl.LOCK_EX)
+
+            manifestos = []
+
+            for caminho in self._dir_manifestos.glob("*.json"):
+                try:
+                    manifestos.append((caminho.stat().st_mtime, caminho, orjson.loads(caminho.read_bytes())))
+                except (OSError, ValueError):
+                    caminho.unlink(missing_ok=True)
+
+            manifestos.sort(key=lambda m: m[0])
+
+            def tamanho_referenciado():
+                blobs = {}
+
+                for _, _, manifesto in manifestos:
+                    for info in manifesto['arquivos'].values():
+                        blobs[info['sha256']] = info['tamanho']
+
+                return blobs
+
+            referenciados = tamanho_referenciado()
+
+            # O manifesto mais recente sempre é mantido, mesmo que seja maior que o cache
+            while len(manifestos) > 1 and sum(referenciados.values()) > self.max_bytes:
+                _, caminho, _ = manifestos.pop(0)
+                caminho.unlink(missing_ok=True)
+                self.stats['manifestos_removidos'] += 1
+                referenciados = tamanho_referenciado()
+
+            # Um blob gravado por outra réplica antes do seu manifesto também pode ser removido aqui; neste caso, a
+            # conferência do hash falha no próximo uso e os artefatos são baixados novamente
+            for caminho_blob in self._dir_blobs.glob("*/*"):
+                if caminho_blob.name not in referenciados:
+                    caminho_blob.unlink(missing_ok=True)
+
+    def resumo(self) -> dict:
+        """
+        Retorna as estatísticas do cache.
+        """
+        ret = dict(self.stats)
+        ret['segundos_economizados'] = round(ret['segundos_economizados'], 1)
+        return ret
+
+    def _log(self, msg: str):
+        if self._logger:
+            self._logger.error(msg)
+
+
+def instalar_cache_mlflow(cache: CacheArtefatos):
+    """
+    Faz o MLflow (utilizado pela mllibprodest) passar pelo cache ao carregar os modelos e baixar os artefatos das runs.
+        :param cache: Instância do cache de artefatos.
+    """
+    import mlflow
+    from mlflow.tracking import MlflowClient
+
+    download_original = mlflow.artifacts.download_artifacts
+    load_model_original = mlflow.pyfunc.load_model
+
+    # Diretório da versão carregada por último de cada modelo e quantidade de instâncias vivas carregadas de cada
+    # diretório. O diretório de uma versão só é removido quando não é o atual e nenhuma instância o utiliza mais
+    atuais = {}
+    em_uso = {}
+    lock = threading.RLock()  # Reentrante: a liberação pode ser chamada pelo coletor de lixo com o lock adquirido
+
+    def liberar(dir_modelo: Path, destino: Path):
+        with lock:
+            em_uso[destino] -= 1
+
+            if em_uso[destino] or atuais.get(dir_modelo) == destino:
+                return
+
+            del em_uso[destino]
+
+        shutil.rmtree(destino, ignore_errors=True)
+
+    def download_artifacts(artifact_uri: str = None, *args, dst_path: str = None, **kwargs):
+        # Somente os endereços das runs são imutáveis; os demais são baixados normalmente
+        if args or not dst_path or kwargs.get('run_id') or kwargs.get('artifact_path') or \
+                type(artifact_uri) is not str or not artifact_uri.startswith("runs:/"):
+            return download_original(artifact_uri, *args, dst_path=dst_path, **kwargs)
+
+        return cache.obter(artifact_uri, dst_path,
+                           lambda destino: download_original(artifact_uri=artifact_uri, dst_path=destino, **kwargs))
+
+    def load_model(model_uri, *args, **kwargs):
+        if type(model_uri) is not str or not model_uri.startswith("models:/") or kwargs.get('dst_path'):
+            return load_model_original(model_uri, *args, **kwargs)
+
+        # Resolve o alias (ou o número da versão) para o endereço imutável dos artefatos da versão do modelo
+        nome, _, referencia = model_uri[len("models:/"):].partition("@")
+
+        if referencia:
+            versao = MlflowClient().get_model_version_by_alias(nome, referencia)
+        else:
+            nome, _, numero = nome.partition("/")
+
+            if not numero.isdigit():
+                return load_model_original(model_uri, *args, **kwargs)
+
+            versao = MlflowClient().get_model_version(nome, numero)
+
+        # Um diretório fixo por versão (reaproveitado a cada carregamento). O diretório de uma versão anterior é
+        # removido quando a instância que o utiliza é liberada (ex.: depois da troca do modelo), assim fica no disco só
+        # a versão em uso de cada modelo
+        dir_modelo = Path(tempfile.gettempdir()) / "mlflow_models" / CacheArtefatos._chave(nome)
+        destino = dir_modelo / CacheArtefatos._chave(versao.source)
+        destino.mkdir(parents=True, exist_ok=True)
+        caminho_local = cache.obter(versao.source, str(destino),
+                                    lambda d: download_original(artifact_uri=versao.source, dst_path=d))
+        modelo = load_model_original(caminho_local, *args, **kwargs)
+
+        with lock:
+            atuais[dir_modelo] = destino
+
+            try:
+                weakref.finalize(modelo, liberar, dir_modelo, destino)
+                em_uso[destino] = em_uso.get(destino, 0) + 1
+            except TypeError:
+                pass  # O objeto não aceita referência fraca: o diretório é mantido
+
+            # Versões que não são utilizadas por nenhuma instância (ex.: deixadas por uma execução anterior do worker)
+            antigos = [outro for outro in dir_modelo.iterdir() if outro != destino and not em_uso.get(outro)]
+
+        for outro in antigos:
+            shutil.rmtree(outro, ignore_errors=True)
+
+        return modelo
+
+    mlflow.artifacts.download_artifacts = download_artifacts
+    mlflow.pyfunc.load_model = load_model
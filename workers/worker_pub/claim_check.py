@@ -0,0 +1,193 @@
+# --------------------------------------------------------------------------------------------------------------------
+# Armazenamento dos payloads grandes dos jobs ('claim-check').
+#
+# Os jobs com payload acima de um limite (ex.: 'get_feedback' com as listas 'y_pred' e 'y_true') não trafegam inteiros
+# pelo servidor de filas. A API grava o job serializado no armazenamento e publica na fila só uma mensagem pequena com a
+# referência ('claim_check'). O worker lê o payload em blocos a partir da referência e o remove após processar o job.
+#
+# Armazenamentos disponíveis:
+#
+# - 'fs': pasta local compartilhada entre a API e os workers (volume). As referências são 'fs:<chave>'.
+# - 's3': bucket no MinIO (serviço 'storage') ou outro serviço compatível com S3, acessado com o 'boto3'. As referências
+#   são 's3://<bucket>/<chave>'. O bucket é criado com uma regra de expiração de um dia para os payloads abandonados.
+#
+# Os payloads abandonados (jobs que expiraram na fila) são removidos pela limpeza periódica ('iniciar_limpeza').
+#
+# OBS.: este arquivo é o mesmo na API ('api/') e no worker ('workers/worker_pub/'). Altere os dois.
+# --------------------------------------------------------------------------------------------------------------------
+import os
+import threading
+from time import time
+from pathlib import Path
+
+
+class ReferenciaInvalidaError(Exception):
+    """
+    Indica que a referência de um payload não pertence ao armazenamento configurado.
+    """
+    pass
+
+
+class ArmazemPayloads:
+    """
+    Grava, lê e remove os payloads grandes dos jobs.
+    """
+    def __init__(self, tipo: str, diretorio: str = "", bucket: str = "", endpoint: str = None,
+                 tamanho_bloco: int = 1048576, logger=None):
+        """
+        :param tipo: Tipo de armazenamento: 'fs' ou 's3'.
+        :param diretorio: Pasta compartilhada onde os payloads são gravados (tipo 'fs').
+        :param bucket: Bucket onde os payloads são gravados (tipo 's3').
+        :param endpoint: URL do serviço S3 (ex.: http://storage:9000/). Se não for informada, utiliza a da AWS.
+        :param tamanho_bloco: Tamanho, em bytes, de cada bloco lido do armazenamento.
+        :param logger: Logger utilizado para registrar os eventos do armazenamento.
+        """
+        if tipo not in ("fs", "s3"):
+            raise ValueError(f"Tipo de armazenamento de payloads inválido: '{tipo}'. Deve ser 'fs' ou 's3'")
+
+        self.tipo = tipo
+        self._tamanho_bloco = tamanho_bloco
+        self._logger = logger
+        self.stats = {'gravados': 0, 'bytes_gravados': 0, 'lidos': 0, 'removidos': 0, 'expirados': 0}
+
+        if tipo == "fs":
+            self._diretorio = Path(diretorio)
+            self._diretorio.mkdir(parents=True, exist_ok=True)
+        else:
+            import boto3  # Só é necessário no armazenamento 's3'
+
+            self._bucket = bucket
+            self._s3 = boto3.client("s3", endpoint_url=endpoint)
+            self._preparar_bucket()
+
+    def _preparar_bucket(self):
+        try:
+            self._s3.head_bucket(Bucket=self._bucket)
+            return
+        except self._s3.exceptions.ClientError:
+            pass
+
+        try:
+            self._s3.create_bucket(Bucket=self._bucket)
+        except (self._s3.exceptions.BucketAlreadyOwnedByYou, self._s3.exceptions.BucketAlreadyExists):
+            return  # Criado ao mesmo tempo por outra instância
+
+        self._s3.put_bucket_lifecycle_configuration(
+            Bucket=self._bucket,
+            LifecycleConfiguration={'Rules': [{'ID': "expira_payloads", 'Status': "Enabled", 'Filter': {'Prefix': ""},
+                                               'Expiration': {'Days': 1}}]})
+
+    def _caminho(self, chave: str) -> Path:
+        return self._diretorio / f"{chave}.json"
+
+    def _chave(self, referencia: str) -> str:
+        prefixo = "fs:" if self.tipo == "fs" else f"s3://{self._bucket}/"
+
+        if not referencia.startswith(prefixo):
+            raise ReferenciaInvalidaError(f"A referência '{referencia}' não pertence ao armazenamento de payloads "
+                                          f"configurado ('{self.tipo}')")
+
+        chave = referencia[len(prefixo):]
+
+        if not chave or "/" in chave or chave.startswith("."):
+            raise ReferenciaInvalidaError(f"A referência '{referencia}' é inválida")
+
+        return chave
+
+    def guardar(self, chave: str, dados: bytes, content_type: str = "application/json") -> str:
+        """
+        Grava um payload.
+            :param chave: Chave do payload (normalmente o job_id).
+            :param dados: Payload serializado.
+            :param content_type: Tipo do conteúdo do payload (utilizado no armazenamento 's3').
+            :return: Referência do payload, que vai na mensagem publicada na fila.
+        """
+        if self.tipo == "fs":
+            # Grava em um arquivo temporário e renomeia, assim o worker nunca lê um payload incompleto
+            caminho = self._caminho(chave)
+            temp = caminho.with_suffix(".tmp")
+            temp.write_bytes(dados)
+            os.replace(temp, caminho)
+            referencia = f"fs:{chave}"
+        else:
+            self._s3.put_object(Bucket=self._bucket, Key=chave, Body=dados, ContentType=content_type)
+            referencia = f"s3://{self._bucket}/{chave}"
+
+        self.stats['gravados'] += 1
+        self.stats['bytes_gravados'] += len(dados)
+        return referencia
+
+    def ler(self, referencia: str) -> bytes:
+        """
+        Lê um payload em blocos, sem cópias intermediárias do payload inteiro.
+            :param referencia: Referência do payload.
+            :return: Payload serializado.
+        """
+        chave = self._chave(referencia)
+        dados = bytearray()
+
+        if self.tipo == "fs":
+            with open(self._caminho(chave), "rb") as arq:
+                while bloco := arq.read(self._tamanho_bloco):
+                    dados += bloco
+        else:
+            corpo = self._s3.get_object(Bucket=self._bucket, Key=chave)['Body']
+
+            try:
+                for bloco in corpo.iter_chunks(chunk_size=self._tamanho_bloco):
+                    dados += bloco
+            finally:
+                corpo.close()
+
+        self.stats['lidos'] += 1
+        return bytes(dados)
+
+    def remover(self, referencia: str):
+        """
+        Remove um payload. Não faz nada se o payload já foi removido.
+            :param referencia: Referência do payload.
+        """
+        chave = self._chave(referencia)
+
+        if self.tipo == "fs":
+            self._caminho(chave).unlink(missing_ok=True)
+        else:
+            self._s3.delete_object(Bucket=self._bucket, Key=chave)
+
+        self.stats['removidos'] += 1
+
+    def limpar_expirados(self, idade_maxima: float):
+        """
+        Remove os payloads gravados há mais de 'idade_maxima' segundos (jobs que expiraram na fila). No armazenamento
+        's3', a remoção é feita pela regra de expiração do bucket.
+        """
+        if self.tipo != "fs":
+            return
+
+        limite = time() - idade_maxima
+
+        for caminho in self._diretorio.iterdir():
+            try:
+                if caminho.stat().st_mtime < limite:
+                    caminho.unlink(missing_ok=True)
+                    self.stats['expirados'] += 1
+            except OSError:
+                pass  # Removido ao mesmo tempo pelo worker
+
+    def iniciar_limpeza(self, intervalo: float, idade_maxima: float):
+        """
+        Inicia, em uma thread própria, a limpeza periódica dos payloads abandonados.
+            :param intervalo: Intervalo, em segundos, entre as limpezas.
+            :param idade_maxima: Idade, em segundos, a partir da qual um payload é considerado abandonado.
+        """
+        def executar():
+            while True:
+                threading.Event().wait(intervalo)
+
+                try:
+                    self.limpar_expirados(idade_maxima)
+                except BaseException as e:
+                    if self._logger:
+                        self._logger.error(f"Falha na limpeza dos payloads abandonados: {e.__class__} - {e}")
+
+        threading.Thread(target=executar, daemon=True).start()
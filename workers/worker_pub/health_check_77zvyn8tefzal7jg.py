@@ -1,16 +1,37 @@
 # -------------------------------------------------------------------------------------------------------------------
 # Script responsável por fazer um health check para verificar se o Worker está com os modelos atualizados. Caso
 # exista algum modelo desatualizado, coloca o container no estado 'unhealthy'.
+#
+# Com a recarga a quente habilitada ('WORKER_MODEL_RELOAD_SECONDS'), o próprio Worker carrega as versões novas e
+# atualiza o arquivo de versões. Neste caso, o container só fica 'unhealthy' se o modelo continuar desatualizado depois
+# do prazo 'WORKER_MODEL_RELOAD_GRACE_SECONDS' (ex.: a versão nova não pôde ser carregada).
+#
+# Só são verificados os modelos que estão no arquivo de versões, ou seja, os carregados pelo Worker. No carregamento sob
+# demanda ('WORKER_LAZY_MODELS'), um modelo que não está em memória é carregado na versão mais atual no próximo job.
 # -------------------------------------------------------------------------------------------------------------------
 import warnings
 import pickle
+from time import time
 from mllibprodest.utils import make_log
 from mllibprodest.providers_types.utils import get_models_versions_providers
+from os import environ as env
 from pathlib import Path
 
 # Cria (ou abre) o arquivo de logs para o script e retorna o logger para geração dos logs
 LOGGER = make_log("worker_pub_health_check.log")
 
+try:
+    RECARGA_A_QUENTE = float(env.get('WORKER_MODEL_RELOAD_SECONDS', "0")) > 0 and \
+                       env.get('WORKER_EXECUTION_MODE', "thread") == "thread"
+    PRAZO_RECARGA = float(env.get('WORKER_MODEL_RELOAD_GRACE_SECONDS', "900"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'WORKER_MODEL_RELOAD_SECONDS' e "
+                 "'WORKER_MODEL_RELOAD_GRACE_SECONDS'")
+    exit(1)
+
+# Guarda o momento em que os modelos desatualizados foram detectados, enquanto aguarda a recarga a quente
+ARQ_DESATUALIZADOS = Path("/tmp/MR-models_outdated_since")
+
 
 def convert_artifact_to_object(file_name: str, path: str):
     """
@@ -70,15 +91,28 @@ def verificar_dados_modelos():
     dados_modelos = convert_artifact_to_object(file_name="MR-models_versions.pkl", path="/tmp")
 
     # Compara os run_ids dos modelos carregados pelo Worker com os modelos carregados para verificação e guarda os que
-    # estão diferentes, ou seja, desatualizados
+    # estão diferentes, ou seja, desatualizados. Os modelos que não estão carregados no Worker são ignorados
     for nome_modelo, versao_modelo in MODELOS_VERSOES.items():
-        if versao_modelo != dados_modelos[nome_modelo]:
+        if nome_modelo in dados_modelos and versao_modelo != dados_modelos[nome_modelo]:
             modelos_desatualizados.append(nome_modelo)
 
     if modelos_desatualizados:
         LOGGER.warning(f"Os seguintes modelos foram atualizados e precisam ser recarregados: {modelos_desatualizados}")
+
+        if RECARGA_A_QUENTE:
+            if not ARQ_DESATUALIZADOS.exists():
+                ARQ_DESATUALIZADOS.write_text(str(time()))
+
+            aguardando = time() - float(ARQ_DESATUALIZADOS.read_text())
+
+            if aguardando < PRAZO_RECARGA:
+                LOGGER.info(f"Aguardando a recarga a quente dos modelos pelo Worker ({aguardando:.0f}s de "
+                            f"{PRAZO_RECARGA:.0f}s)")
+                return 0
+
         return 1
     else:
+        ARQ_DESATUALIZADOS.unlink(missing_ok=True)
         LOGGER.info("Todos os modelos estão na versão mais atual, não é necessário recarregá-los!")
         return 0
 
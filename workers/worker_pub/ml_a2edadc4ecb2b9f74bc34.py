@@ -5,23 +5,36 @@
 # >> FLUXO (simplificado!):
 #
 # - O worker pega/recebe um job que está na fila.
-# - Atualiza o status através do endpoint '/attstatus' para 'Running'.
-# - Atende ao job e informa o resultado através do endpoint '/retorno'.
+# - Atualiza o status para 'Running', publicando na fila de resultados (ou através do endpoint '/attstatus').
+# - Atende ao job e informa o resultado, publicando na fila de resultados (ou através do endpoint '/retorno').
 #
 # ATENÇÃO: Várias partes deste código foram retiradas/inspiradas em um exemplo do repositório oficial da lib pika:
 # https://github.com/pika/pika/blob/main/examples/basic_consumer_threaded.py
 # --------------------------------------------------------------------------------------------------------------------
+import os
 import pika
-import json
+import orjson
+import pickle
+import multiprocessing
 import requests
 import threading
 import functools
 import weakref
-from json import dumps
+import importlib
+import collections
+import gc
+import base64
+import numpy as np
 from time import time
-from mllibprodest.utils import make_log
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from mllibprodest.utils import make_log, get_models_params
 from mllibprodest.initiators.model_initiator import InitModels as Im
 from mllibprodest.providers_types.utils import get_models_versions_providers
+from artifact_cache import CacheArtefatos, instalar_cache_mlflow
+from claim_check import ArmazemPayloads
+from wire_format import decodificar, formatos_disponiveis
 from os import environ as env
 from pika.exchange_type import ExchangeType
 
@@ -72,15 +85,626 @@ if not RABITMQ_PASS:
     LOGGER.error("Não foi possível obter a variável de ambiente 'RABBITMQ_DEFAULT_PASS'")
     exit(1)
 
-LOGGER.info("[*] Instanciando o(s) modelo(s) de ML...")
+# Quantidade de jobs processados em paralelo pelo worker e quantidade de mensagens entregues pelo servidor de filas sem
+# reconhecimento (prefetch). Por padrão, o prefetch é igual ao tamanho do pool, assim sempre há um job pronto para cada
+# thread livre e nenhuma mensagem fica parada no worker esperando por uma thread
 try:
-    MODELOS = Im.init_models()
+    WORKER_POOL_SIZE = int(env.get('WORKER_POOL_SIZE', "4"))
+    WORKER_PREFETCH = int(env.get('WORKER_PREFETCH', str(WORKER_POOL_SIZE)))
+    WORKER_METRICS_SECONDS = float(env.get('WORKER_METRICS_SECONDS', "60"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'WORKER_POOL_SIZE', 'WORKER_PREFETCH' e "
+                 "'WORKER_METRICS_SECONDS'")
+    exit(1)
+
+if WORKER_POOL_SIZE < 1 or WORKER_PREFETCH < 1:
+    LOGGER.error("As variáveis de ambiente 'WORKER_POOL_SIZE' e 'WORKER_PREFETCH' devem ser maiores que zero")
+    exit(1)
+
+# Opções do orjson na serialização dos retornos: aceita os arrays do NumPy e as chaves não textuais (int, float, bool e
+# None) que os modelos podem devolver (ex.: métricas por classe), como fazia o 'json' da biblioteca padrão
+OPCOES_JSON_RETORNO = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Envia as mudanças de status e os retornos dos jobs pela fila de resultados, em vez dos endpoints '/attstatus' e
+# '/retorno' da API. Se a publicação falhar, o retorno é enviado pelo endpoint
+WORKER_RESULTS_VIA_QUEUE = env.get('WORKER_RESULTS_VIA_QUEUE', "1") == "1"
+
+# Envio em lotes das chamadas aos endpoints '/attstatus' e '/retorno' (quando a fila de resultados não é utilizada):
+# quantidade máxima de itens por requisição (1 envia cada item individualmente), tempo máximo, em milissegundos, de
+# espera por outros itens para formar o lote e tempo máximo, em segundos, de cada requisição. Os lotes só devem ser
+# ligados depois que todas as instâncias da API aceitarem listas nesses endpoints (as versões anteriores recusam)
+try:
+    WORKER_HTTP_BATCH_MAX = int(env.get('WORKER_HTTP_BATCH_MAX', "1"))
+    WORKER_HTTP_BATCH_MS = float(env.get('WORKER_HTTP_BATCH_MS', "10"))
+    WORKER_HTTP_TIMEOUT_SECONDS = float(env.get('WORKER_HTTP_TIMEOUT_SECONDS', "30"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'WORKER_HTTP_BATCH_MAX', "
+                 "'WORKER_HTTP_BATCH_MS' e 'WORKER_HTTP_TIMEOUT_SECONDS'")
+    exit(1)
+
+# Fila separada para os métodos 'evaluate', 'get_feedback' e 'info', atendida por um pool de threads próprio, assim os
+# jobs pesados destes métodos não atrasam os jobs de 'predict'. O sufixo deve ser igual ao da API ('api/utils.py')
+WORKER_METHOD_LANES = env.get('WORKER_METHOD_LANES', "1") == "1"
+SUFIXO_FILA_LOTE = "_batch"
+
+try:
+    WORKER_BATCH_POOL_SIZE = int(env.get('WORKER_BATCH_POOL_SIZE', "1"))
+    WORKER_BATCH_PREFETCH = int(env.get('WORKER_BATCH_PREFETCH', str(WORKER_BATCH_POOL_SIZE)))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'WORKER_BATCH_POOL_SIZE' e "
+                 "'WORKER_BATCH_PREFETCH'")
+    exit(1)
+
+if WORKER_METHOD_LANES and (WORKER_BATCH_POOL_SIZE < 1 or WORKER_BATCH_PREFETCH < 1):
+    LOGGER.error("As variáveis de ambiente 'WORKER_BATCH_POOL_SIZE' e 'WORKER_BATCH_PREFETCH' devem ser maiores que "
+                 "zero")
+    exit(1)
+
+# Exchange e fila de resultados dos jobs (devem ser iguais aos da API: 'api/results_consumer.py')
+EXCHANGE_RESULTADOS = "mlapi_results_exchange"
+FILA_RESULTADOS = "mlapi_results"
+
+# Canal da conexão do worker utilizado para publicar os resultados, em modo 'publisher confirms'. É separado do canal de
+# consumo e só é utilizado na thread da conexão
+CANAL_RESULTADOS = None
+
+# Micro-lotes de 'predict' (opcional): quantidade máxima de itens (features) de um lote, 0 desliga, e tempo máximo, em
+# milissegundos, que um job aguarda a chegada de outros jobs do mesmo modelo para formar o lote
+try:
+    PREDICT_BATCH_MAX_ITEMS = int(env.get('PREDICT_BATCH_MAX_ITEMS', "0"))
+    PREDICT_BATCH_WAIT_MS = float(env.get('PREDICT_BATCH_WAIT_MS', "5"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'PREDICT_BATCH_MAX_ITEMS' e "
+                 "'PREDICT_BATCH_WAIT_MS'")
+    exit(1)
+
+# Modo de execução dos modelos: 'thread' (os modelos são executados nas threads do pool de execução, no mesmo
+# processo) ou 'process' (os modelos são executados em processos filhos, criados via fork depois que os modelos são
+# carregados, assim os jobs CPU-bound utilizam vários núcleos sem o limite do GIL)
+WORKER_EXECUTION_MODE = env.get('WORKER_EXECUTION_MODE', "thread")
+
+if WORKER_EXECUTION_MODE not in ("thread", "process"):
+    LOGGER.error("A variável de ambiente 'WORKER_EXECUTION_MODE' deve ser 'thread' ou 'process'")
+    exit(1)
+
+try:
+    WORKER_PROCESSES = int(env.get('WORKER_PROCESSES', str(os.cpu_count() or 1)))
+except ValueError:
+    LOGGER.error("Informe um número inteiro válido na variável de ambiente 'WORKER_PROCESSES'")
+    exit(1)
+
+if WORKER_EXECUTION_MODE == "process" and WORKER_POOL_SIZE < WORKER_PROCESSES:
+    LOGGER.warning(f"O 'WORKER_POOL_SIZE' ({WORKER_POOL_SIZE}) é menor que o 'WORKER_PROCESSES' "
+                   f"({WORKER_PROCESSES}), portanto alguns processos ficarão ociosos")
+
+# Recarga a quente dos modelos: intervalo, em segundos, da verificação de versões novas no Model Registry (0 desliga e
+# as versões novas só são carregadas com a reinicialização do container, feita a partir do health check)
+try:
+    WORKER_MODEL_RELOAD_SECONDS = float(env.get('WORKER_MODEL_RELOAD_SECONDS', "0"))
+except ValueError:
+    LOGGER.error("Informe um valor numérico válido na variável de ambiente 'WORKER_MODEL_RELOAD_SECONDS'")
+    exit(1)
+
+if WORKER_MODEL_RELOAD_SECONDS > 0 and WORKER_EXECUTION_MODE == "process":
+    # Os processos filhos guardam uma cópia dos modelos feita no fork, que não pode ser trocada
+    LOGGER.warning("A recarga a quente dos modelos não está disponível no modo 'process'. As versões novas serão "
+                   "carregadas com a reinicialização do container")
+    WORKER_MODEL_RELOAD_SECONDS = 0
+
+# Aquecimento dos modelos antes do registro do worker na API: pasta com as amostras de features de cada modelo (arquivo
+# '<nome do modelo>.json' contendo uma lista de lotes de features para o 'predict'), quantidade máxima de rodadas e
+# variação máxima da latência entre duas rodadas seguidas para considerar o modelo aquecido
+WORKER_WARMUP_DIR = env.get('WORKER_WARMUP_DIR', "warmup")
+
+try:
+    WORKER_WARMUP_MAX_ROUNDS = int(env.get('WORKER_WARMUP_MAX_ROUNDS', "20"))
+    WORKER_WARMUP_TOLERANCE = float(env.get('WORKER_WARMUP_TOLERANCE', "0.1"))
+except ValueError:
+    LOGGER.error("Informe valores numéricos válidos nas variáveis de ambiente 'WORKER_WARMUP_MAX_ROUNDS' e "
+                 "'WORKER_WARMUP_TOLERANCE'")
+    exit(1)
+
+# Carregamento sob demanda dos modelos: os modelos são registrados na inicialização, mas só são carregados no primeiro
+# job. 'WORKER_MODELS_MEMORY_MB' é o limite de memória dos modelos carregados (0 não limita); ao ultrapassá-lo, os
+# modelos usados há mais tempo são descarregados. Os modelos de 'WORKER_PINNED_MODELS' (separados por vírgula) são
+# carregados na inicialização e nunca são descarregados
+WORKER_LAZY_MODELS = env.get('WORKER_LAZY_MODELS', "0") == "1"
+WORKER_PINNED_MODELS = [nome.strip() for nome in env.get('WORKER_PINNED_MODELS', "").split(",") if nome.strip()]
+
+try:
+    WORKER_MODELS_MEMORY_MB = float(env.get('WORKER_MODELS_MEMORY_MB', "0"))
+except ValueError:
+    LOGGER.error("Informe um valor numérico válido na variável de ambiente 'WORKER_MODELS_MEMORY_MB'")
+    exit(1)
+
+if WORKER_LAZY_MODELS and WORKER_EXECUTION_MODE == "process":
+    # Os processos filhos só compartilham (via fork) os modelos carregados antes da criação do pool
+    LOGGER.warning("O carregamento sob demanda dos modelos não está disponível no modo 'process'. Todos os modelos "
+                   "serão carregados na inicialização")
+    WORKER_LAZY_MODELS = False
+
+
+# Cache local dos artefatos dos modelos: diretório do cache (vazio desliga), que pode ser um volume compartilhado entre
+# as réplicas do worker, e tamanho máximo em MB
+WORKER_ARTIFACT_CACHE_DIR = env.get('WORKER_ARTIFACT_CACHE_DIR', "")
+
+try:
+    WORKER_ARTIFACT_CACHE_MAX_MB = float(env.get('WORKER_ARTIFACT_CACHE_MAX_MB', "5120"))
+except ValueError:
+    LOGGER.error("Informe um valor numérico válido na variável de ambiente 'WORKER_ARTIFACT_CACHE_MAX_MB'")
+    exit(1)
+
+CACHE_ARTEFATOS = None
+
+if WORKER_ARTIFACT_CACHE_DIR:
+    try:
+        CACHE_ARTEFATOS = CacheArtefatos(WORKER_ARTIFACT_CACHE_DIR, WORKER_ARTIFACT_CACHE_MAX_MB, logger=LOGGER)
+        instalar_cache_mlflow(CACHE_ARTEFATOS)
+        LOGGER.info(f"[*] Cache de artefatos dos modelos habilitado: '{WORKER_ARTIFACT_CACHE_DIR}' (máximo "
+                    f"{WORKER_ARTIFACT_CACHE_MAX_MB}MB)")
+    except BaseException as e:
+        # Sem o cache, os artefatos são baixados do Model Registry como antes
+        LOGGER.error(f"Não foi possível habilitar o cache de artefatos dos modelos: {e.__class__} - {e}")
+        CACHE_ARTEFATOS = None
+
+# Claim-check dos payloads grandes: os jobs grandes chegam com uma referência ('claim_check') para o payload gravado
+# pela API no armazenamento. Tipo ('fs' ou 's3'), pasta e bucket devem ser iguais aos da API ('api/utils.py')
+CLAIM_CHECK_BACKEND = env.get('CLAIM_CHECK_BACKEND', "")
+ARMAZEM_PAYLOADS = None
+
+if CLAIM_CHECK_BACKEND:
+    try:
+        ARMAZEM_PAYLOADS = ArmazemPayloads(CLAIM_CHECK_BACKEND, diretorio=env.get('CLAIM_CHECK_DIR', "/claim_check"),
+                                           bucket=env.get('CLAIM_CHECK_BUCKET', "mlapi-claim-check"),
+                                           endpoint=env.get('MLFLOW_S3_ENDPOINT_URL'), logger=LOGGER)
+    except BaseException as e:
+        LOGGER.error(f"Não foi possível preparar o armazenamento dos payloads grandes dos jobs "
+                     f"('CLAIM_CHECK_BACKEND'={CLAIM_CHECK_BACKEND}): {e.__class__} - {e}")
+        exit(1)
+
+
+def capacidades_worker() -> list:
+    """
+    Retorna as capacidades opcionais suportadas pelo worker, informadas à API no '/advworkid'. A API só utiliza um
+    recurso opcional com os workers que o informam.
+        :return: Lista com os nomes das capacidades.
+    """
+    # Decodifica os labels do 'get_feedback' enviados codificados (ver 'decodificar_labels')
+    capacidades = ["encoded_labels"]
+
+    if ARMAZEM_PAYLOADS is not None:
+        capacidades.append("claim_check")  # Lê os payloads dos jobs grandes gravados pela API no armazenamento
+
+    return capacidades
+
+
+def instanciar_modelo(model_name: str):
+    """
+    Cria uma nova instância de um modelo, que carrega a versão de produção do artefato. Utiliza os mesmos parâmetros
+    ('params.conf') e a mesma classe ('ModeloCLF') do 'init_models' da mllibprodest.
+        :param model_name: Nome do modelo.
+        :return: Instância do modelo.
+    """
+    params = get_models_params()[model_name]
+
+    if params['model_class'] != "ModeloCLF":
+        raise ValueError(f"O worker só atende modelos da classe 'ModeloCLF', mas o modelo '{model_name}' é da classe "
+                         f"'{params['model_class']}'")
+
+    modulo = importlib.import_module(f"models.{params['source_file']}")
+    return modulo.ModeloCLF(model_name=model_name, model_provider_name=params['model_provider_name'])
+
+
+def memoria_residente() -> int:
+    """
+    Retorna a memória residente (RSS) do processo, em bytes. Retorna 0 se não for possível obtê-la (fora do Linux).
+    """
+    try:
+        with open("/proc/self/statm") as arq:
+            return int(arq.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# Serializa as gravações do arquivo de versões do health check (carregamentos e recarga a quente)
+LOCK_HEALTH_CHECK = threading.Lock()
+
+
+def gravar_versoes_health_check(versoes: dict):
+    """
+    Grava as versões dos modelos (obtidas do Model Registry) que estão carregadas no worker. O arquivo é utilizado pelo
+    health check do container, que só verifica os modelos presentes nele.
+        :param versoes: Dicionário com o nome de cada modelo como chave e a respectiva versão como valor.
+    """
+    # Mesmo formato do 'convert_artifact_to_pickle' dos modelos, sem precisar carregar um modelo. O arquivo é trocado
+    # de uma vez, para que o health check nunca leia um arquivo incompleto
+    with LOCK_HEALTH_CHECK:
+        with open("/tmp/MR-models_versions.pkl.tmp", "wb") as arq:
+            pickle.dump(versoes, arq)
+
+        os.replace("/tmp/MR-models_versions.pkl.tmp", "/tmp/MR-models_versions.pkl")
+
+
+class _ContadorBytes:
+    """
+    Arquivo de escrita que só conta os bytes recebidos (utilizado pelo 'tamanho_modelo').
+    """
+    def __init__(self):
+        self.total = 0
+
+    def write(self, dados) -> int:
+        tamanho = memoryview(dados).nbytes
+        self.total += tamanho
+        return tamanho
+
+
+def tamanho_modelo(modelo) -> int:
+    """
+    Estima a memória de um modelo pelo tamanho da sua serialização com o pickle. Os bytes são apenas contados (não são
+    guardados), por isso a estimativa não depende dos jobs que estão executando ao mesmo tempo.
+        :param modelo: Instância do modelo.
+        :return: Tamanho estimado, em bytes. Retorna 0 se o modelo não puder ser serializado.
+    """
+    contador = _ContadorBytes()
+
+    try:
+        pickle.Pickler(contador, protocol=pickle.HIGHEST_PROTOCOL).dump(modelo)
+    except BaseException:
+        return 0
+
+    return contador.total
+
+
+class ModelosResidentes:
+    """
+    Mantém os modelos do worker em memória. Os modelos são registrados pelo nome e carregados no primeiro acesso; os
+    modelos carregados são mantidos em ordem de uso (LRU) e, quando a memória estimada ultrapassa o limite, os usados há
+    mais tempo são descarregados. Os modelos fixados nunca são descarregados.
+
+    A memória de cada modelo é estimada pelo tamanho da sua serialização ('tamanho_modelo'). Se o modelo não puder ser
+    serializado, é utilizado o aumento da memória residente do processo durante o carregamento; por isso os
+    carregamentos (inclusive os da recarga a quente) são feitos um de cada vez. Um modelo descarregado só é liberado da
+    memória depois que os jobs que estão utilizando a instância terminam.
+
+    Também guarda a versão (do Model Registry) de cada modelo carregado, que é gravada no arquivo do health check: só os
+    modelos carregados são verificados.
+    """
+    def __init__(self, nomes: list, limite_mb: float = 0, fixados: list = None):
+        """
+        :param nomes: Nomes dos modelos atendidos pelo worker.
+        :param limite_mb: Limite de memória, em MB, dos modelos carregados. Se for 0, não há limite.
+        :param fixados: Nomes dos modelos que nunca são descarregados.
+        """
+        self.nomes = list(nomes)
+        self._limite = limite_mb * 1024 * 1024
+        self._fixados = set(fixados or [])
+        self._lock = threading.Lock()
+        self._lock_carga = threading.Lock()
+        self._carregados = collections.OrderedDict()  # nome do modelo -> instância, do menos para o mais usado
+        self._tamanhos = {}  # nome do modelo -> memória estimada (bytes) do último carregamento
+        self._versoes = {}  # nome do modelo -> versão (do Model Registry) da instância carregada
+        self.stats = {'carregamentos': 0, 'descarregamentos': 0, 'falhas_carregamento': 0}
+        self._stats_modelos = {nome: {'carregamentos': 0, 'descarregamentos': 0} for nome in self.nomes}
+
+    def __contains__(self, model_name) -> bool:
+        return model_name in self._stats_modelos
+
+    def __len__(self) -> int:
+        return len(self.nomes)
+
+    def __iter__(self):
+        return iter(self.nomes)
+
+    def keys(self) -> list:
+        return list(self.nomes)
+
+    def __getitem__(self, model_name: str):
+        """
+        Retorna a instância do modelo, carregando-o caso ainda não esteja em memória.
+        """
+        with self._lock:
+            modelo = self._carregados.get(model_name)
+
+            if modelo is not None:
+                self._carregados.move_to_end(model_name)
+                return modelo
+
+        if model_name not in self:
+            raise KeyError(model_name)
+
+        return self.carregar(model_name)
+
+    def get(self, model_name: str, default=None):
+        return self[model_name] if model_name in self else default
+
+    def trocar(self, model_name: str, modelo, tamanho: int, versao):
+        """
+        Troca a instância de um modelo carregado (recarga a quente).
+            :param model_name: Nome do modelo.
+            :param modelo: Instância nova, criada pelo 'instanciar'.
+            :param tamanho: Memória estimada da instância nova, retornada pelo 'instanciar'.
+            :param versao: Versão (do Model Registry) da instância nova.
+        """
+        with self._lock:
+            self._carregados[model_name] = modelo
+            self._carregados.move_to_end(model_name)
+            self._tamanhos[model_name] = tamanho
+            self._versoes[model_name] = versao
+
+    def residente(self, model_name: str) -> bool:
+        return model_name in self._carregados
+
+    def residentes(self) -> dict:
+        """
+        Retorna os modelos que estão carregados em memória (nome -> instância).
+        """
+        with self._lock:
+            return dict(self._carregados)
+
+    def versoes(self) -> dict:
+        """
+        Retorna as versões (do Model Registry) dos modelos que estão carregados em memória.
+        """
+        with self._lock:
+            return {nome: self._versoes.get(nome) for nome in self._carregados}
+
+    def registrar_versoes(self, versoes: dict):
+        """
+        Registra as versões dos modelos carregados que ainda não possuem versão (ex.: os adicionados pelo 'adicionar'),
+        sem substituir as versões obtidas no carregamento.
+            :param versoes: Dicionário com o nome de cada modelo como chave e a respectiva versão como valor.
+        """
+        with self._lock:
+            for model_name in self._carregados:
+                if model_name not in self._versoes and model_name in versoes:
+                    self._versoes[model_name] = versoes[model_name]
+
+    def adicionar(self, modelos: dict, fixar: bool = False):
+        """
+        Adiciona modelos já instanciados (ex.: pelo 'init_models').
+            :param modelos: Dicionário com o nome de cada modelo como chave e a instância como valor.
+            :param fixar: Indica se os modelos devem ser fixados.
+        """
+        with self._lock:
+            for model_name, modelo in modelos.items():
+                if model_name not in self._stats_modelos:
+                    self.nomes.append(model_name)
+                    self._stats_modelos[model_name] = {'carregamentos': 0, 'descarregamentos': 0}
+
+                self._carregados[model_name] = modelo
+                self.stats['carregamentos'] += 1
+                self._stats_modelos[model_name]['carregamentos'] += 1
+
+                if fixar:
+                    self._fixados.add(model_name)
+
+    def carregar(self, model_name: str):
+        """
+        Carrega um modelo (se ainda não estiver carregado) e descarrega os modelos usados há mais tempo caso o limite de
+        memória seja ultrapassado.
+            :param model_name: Nome do modelo.
+            :return: Instância do modelo.
+        """
+        with self._lock_carga:
+            # Outro job pode ter carregado o modelo enquanto este aguardava
+            with self._lock:
+                modelo = self._carregados.get(model_name)
+
+            if modelo is not None:
+                return modelo
+
+            LOGGER.info(f"[*] Carregando o modelo '{model_name}'...")
+            inicio = time()
+
+            try:
+                # A versão é obtida antes do carregamento: se mudar durante ele, o health check acusa a diferença
+                versao = get_models_versions_providers().get(model_name)
+                modelo, tamanho = self._instanciar(model_name)
+            except BaseException:
+                self.stats['falhas_carregamento'] += 1
+                raise
+
+            with self._lock:
+                self._tamanhos[model_name] = tamanho
+                self._versoes[model_name] = versao
+                self._carregados[model_name] = modelo
+                self.stats['carregamentos'] += 1
+                self._stats_modelos[model_name]['carregamentos'] += 1
+                descarregados = self._liberar_memoria(model_name)
+
+            LOGGER.info(f"[*] Modelo '{model_name}' carregado em {time() - inicio:.1f}s "
+                        f"({tamanho / 1024 / 1024:.1f}MB)")
+
+            if descarregados:
+                LOGGER.info(f"[*] Modelo(s) descarregado(s) para liberar memória: {descarregados}")
+
+        gravar_versoes_health_check(self.versoes())
+        return modelo
+
+    def instanciar(self, model_name: str) -> tuple:
+        """
+        Cria uma nova instância de um modelo sem colocá-la em uso (recarga a quente), um carregamento de cada vez.
+            :param model_name: Nome do modelo.
+            :return: Tupla com a instância e a memória estimada, em bytes.
+        """
+        with self._lock_carga:
+            return self._instanciar(model_name)
+
+    @staticmethod
+    def _instanciar(model_name: str) -> tuple:
+        # Chamado com o '_lock_carga' adquirido, para que o aumento da memória residente seja só deste carregamento
+        memoria_antes = memoria_residente()
+        modelo = instanciar_modelo(model_name)
+        tamanho = tamanho_modelo(modelo) or max(memoria_residente() - memoria_antes, 0)
+        return modelo, tamanho
+
+    def _liberar_memoria(self, carregado: str) -> list:
+        descarregados = []
+
+        if self._limite <= 0:
+            return descarregados
+
+        for model_name in list(self._carregados.keys()):
+            if self._memoria_estimada() <= self._limite:
+                break
+
+            if model_name == carregado or model_name in self._fixados:
+                continue
+
+            del self._carregados[model_name]
+            self._versoes.pop(model_name, None)
+            self.stats['descarregamentos'] += 1
+            self._stats_modelos[model_name]['descarregamentos'] += 1
+            descarregados.append(model_name)
+
+        if descarregados:
+            gc.collect()
+
+        return descarregados
+
+    def _memoria_estimada(self) -> int:
+        return sum(self._tamanhos.get(model_name, 0) for model_name in self._carregados)
+
+    def resumo(self) -> dict:
+        """
+        Retorna as estatísticas de carregamento e a memória estimada de cada modelo carregado.
+        """
+        with self._lock:
+            ret = dict(self.stats)
+            ret['memoria_mb'] = round(self._memoria_estimada() / 1024 / 1024, 1)
+            ret['limite_mb'] = round(self._limite / 1024 / 1024, 1)
+            ret['modelos'] = {nome: dict(self._stats_modelos[nome], residente=nome in self._carregados,
+                                         fixado=nome in self._fixados,
+                                         memoria_mb=round(self._tamanhos[nome] / 1024 / 1024, 1)
+                                         if nome in self._carregados and nome in self._tamanhos else 0)
+                              for nome in self.nomes}
+            return ret
+
+
+try:
+    if WORKER_LAZY_MODELS:
+        MODELOS = ModelosResidentes(list(get_models_params().keys()), WORKER_MODELS_MEMORY_MB, WORKER_PINNED_MODELS)
+
+        for nome_fixado in WORKER_PINNED_MODELS:
+            if nome_fixado not in MODELOS:
+                LOGGER.warning(f"O modelo fixado '{nome_fixado}' (WORKER_PINNED_MODELS) não existe no 'params.conf'")
+                continue
+
+            MODELOS.carregar(nome_fixado)
+
+        LOGGER.info(f"[*] Carregamento sob demanda dos modelos habilitado. Modelos registrados: {MODELOS.keys()} | "
+                    f"Limite de memória: {WORKER_MODELS_MEMORY_MB or 'sem limite'}MB")
+    else:
+        LOGGER.info("[*] Instanciando o(s) modelo(s) de ML...")
+        inicio_carga = time()
+        MODELOS = ModelosResidentes([])
+        MODELOS.adicionar(Im.init_models(), fixar=True)
+        LOGGER.info(f"[*] Modelo(s) instanciado(s) em {time() - inicio_carga:.1f}s")
+
+    if CACHE_ARTEFATOS is not None:
+        LOGGER.info(f"[*] Cache de artefatos dos modelos (tempo de inicialização economizado): "
+                    f"{CACHE_ARTEFATOS.resumo()}")
 except BaseException as e:
     LOGGER.error(f"Não foi possível instanciar o(s) modelo(s). Mensagem do 'init_models': {e.__class__} - {e}",
                  exc_info=True)
     raise e
 
 
+def _chamar_modelo_processo(model_name: str, metodo: str, kwargs: dict):
+    """
+    Executada nos processos filhos: os modelos já estão carregados, pois foram herdados do processo pai (fork).
+    """
+    return getattr(MODELOS[model_name], metodo)(**kwargs)
+
+
+# Pool de processos do modo 'process'. Os processos são criados aqui, logo após o carregamento dos modelos e antes de
+# qualquer outra thread do worker ser iniciada (fork com outras threads em execução pode herdar locks travados). As
+# páginas de memória dos modelos são compartilhadas entre os processos (copy-on-write)
+POOL_PROCESSOS = None
+
+if WORKER_EXECUTION_MODE == "process":
+    POOL_PROCESSOS = ProcessPoolExecutor(max_workers=WORKER_PROCESSES, mp_context=multiprocessing.get_context("fork"))
+    POOL_PROCESSOS.submit(os.getpid).result()  # Com o fork, todos os processos são criados no primeiro envio
+    LOGGER.info(f"[*] Modo de execução 'process': {WORKER_PROCESSES} processo(s) para execução dos modelos")
+
+
+def chamar_modelo(model_name: str, metodo: str, modelo=None, **kwargs):
+    """
+    Chama um método de um modelo, no próprio processo (modo 'thread') ou em um processo filho (modo 'process').
+        :param model_name: Nome do modelo.
+        :param metodo: Nome do método do modelo ('predict', 'evaluate', 'get_feedback' ou 'get_model_info').
+        :param modelo: Instância do modelo (modo 'thread'). Se não for informada, utiliza a instância atual do
+                       'MODELOS'. Assim um job iniciado antes de uma recarga a quente termina na versão antiga.
+        :param kwargs: Argumentos do método.
+        :return: Retorno do método.
+    """
+    if POOL_PROCESSOS is None:
+        return getattr(modelo if modelo is not None else MODELOS[model_name], metodo)(**kwargs)
+
+    try:
+        return POOL_PROCESSOS.submit(_chamar_modelo_processo, model_name, metodo, kwargs).result()
+    except BrokenProcessPool:
+        # Um processo filho morreu (ex.: falta de memória). Encerra o worker para o container ser reiniciado; as
+        # mensagens sem ack voltam para a fila
+        LOGGER.error("Um processo de execução dos modelos foi encerrado inesperadamente. Encerrando o worker...")
+        os._exit(1)
+
+
+def carregar_amostras_aquecimento(model_name: str) -> list:
+    """
+    Lê as amostras de features utilizadas no aquecimento de um modelo.
+        :param model_name: Nome do modelo.
+        :return: Lista de lotes de features (vazia se o modelo não tiver amostras).
+    """
+    caminho = Path(WORKER_WARMUP_DIR) / f"{model_name}.json"
+
+    if not caminho.is_file():
+        return []
+
+    try:
+        amostras = orjson.loads(caminho.read_bytes())
+    except (OSError, orjson.JSONDecodeError) as e:
+        LOGGER.error(f"Não foi possível ler as amostras de aquecimento do modelo '{model_name}' ('{caminho}'): "
+                     f"{e.__class__} - {e}")
+        return []
+
+    if type(amostras) is not list or not all(type(a) is list and a for a in amostras):
+        LOGGER.error(f"As amostras de aquecimento do modelo '{model_name}' ('{caminho}') devem ser uma lista de lotes "
+                     f"de features (listas não vazias)")
+        return []
+
+    return amostras
+
+
+def aquecer_modelo(model_name: str, amostras: list, modelo=None) -> dict:
+    """
+    Executa rodadas de 'predict' com as amostras até a latência estabilizar (variação entre duas rodadas seguidas menor
+    que 'WORKER_WARMUP_TOLERANCE') ou até 'WORKER_WARMUP_MAX_ROUNDS' rodadas. No modo 'process', cada rodada envia as
+    amostras em paralelo, para aquecer todos os processos filhos.
+        :param model_name: Nome do modelo.
+        :param amostras: Lista de lotes de features.
+        :param modelo: Instância do modelo (modo 'thread'). Se não for informada, utiliza a instância atual do
+                       'MODELOS'.
+        :return: Dicionário com a quantidade de rodadas, as latências da primeira e da última rodada e a duração.
+    """
+    paralelo = WORKER_PROCESSES if POOL_PROCESSOS is not None else 1
+    lotes = amostras * paralelo
+    latencias = []
+    inicio = time()
+
+    with ThreadPoolExecutor(max_workers=paralelo, thread_name_prefix="worker_warmup") as executor:
+        for _ in range(max(WORKER_WARMUP_MAX_ROUNDS, 1)):
+            inicio_rodada = time()
+            list(executor.map(lambda lote: chamar_modelo(model_name, "predict", modelo=modelo, dataset=lote), lotes))
+            latencias.append((time() - inicio_rodada) / len(amostras))
+
+            if len(latencias) > 1 and abs(latencias[-1] - latencias[-2]) <= WORKER_WARMUP_TOLERANCE * latencias[-2]:
+                break
+
+    return {'rodadas': len(latencias), 'latencia_inicial_ms': round(latencias[0] * 1000, 2),
+            'latencia_final_ms': round(latencias[-1] * 1000, 2), 'duracao_seg': round(time() - inicio, 2)}
+
+
 class WeakObj:
     """
     Encapsula objetos para possibilitar a criação de referências fracas (via weakref).
@@ -95,6 +719,508 @@ class WeakObj:
         return self.__obj
 
 
+class MicroLote:
+    """
+    Agrupa os 'predicts' de um modelo que chegam quase ao mesmo tempo em uma única chamada ao método 'predict'. As
+    features dos jobs são concatenadas e o resultado é dividido de volta entre os jobs, na mesma ordem.
+
+    Se a chamada do lote falhar, ou o retorno não for uma lista com um resultado por item, cada job do lote é
+    processado individualmente, assim o erro de um job não afeta os demais.
+
+    OBS.: os jobs aguardam o lote nas threads do pool de execução, portanto o tamanho dos lotes também é limitado pelo
+    'WORKER_POOL_SIZE' (e pelo 'WORKER_PREFETCH').
+    """
+    def __init__(self, model_name: str, max_itens: int, espera_ms: float, modelo=None):
+        """
+        :param model_name: Nome do modelo que atenderá aos 'predicts'.
+        :param max_itens: Quantidade máxima de itens (features) de um lote.
+        :param espera_ms: Tempo máximo, em milissegundos, de espera por outros jobs para formar o lote.
+        :param modelo: Instância do modelo que atenderá aos 'predicts'. Se não for informada, utiliza a instância
+                       atual do 'MODELOS' em cada lote.
+        """
+        self._model_name = model_name
+        self.modelo = modelo
+        self._encerrar = False
+        self._max_itens = max_itens
+        self._espera = espera_ms / 1000
+        self._cond = threading.Condition()
+        self._pendentes = []  # Tuplas (features, future)
+        self._itens_pendentes = 0
+        self.stats = {'lotes': 0, 'jobs': 0, 'itens': 0, 'lotes_individuais': 0}
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    def predict(self, features: list):
+        """
+        Inclui as features de um job no próximo lote e aguarda o resultado. Se o micro-lote já foi encerrado (ex.: o job
+        obteve o micro-lote antes da recarga a quente do modelo), chama o modelo diretamente, pois a thread do
+        micro-lote pode já ter terminado.
+            :param features: Features do job.
+            :return: Retorno do 'predict' referente às features do job.
+        """
+        fut = Future()
+
+        with self._cond:
+            encerrado = self._encerrar
+
+            if not encerrado:
+                self._pendentes.append((features, fut))
+                self._itens_pendentes += len(features)
+                self._cond.notify_all()
+
+        if encerrado:
+            return chamar_modelo(self._model_name, "predict", modelo=self.modelo, dataset=features)
+
+        return fut.result()
+
+    def encerrar(self):
+        """
+        Encerra a thread do micro-lote depois que os jobs pendentes forem processados.
+        """
+        with self._cond:
+            self._encerrar = True
+            self._cond.notify_all()
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pendentes or self._encerrar)
+
+                if not self._pendentes:
+                    return
+
+                # Aguarda outros jobs até completar o lote ou terminar o tempo de espera
+                self._cond.wait_for(lambda: self._itens_pendentes >= self._max_itens, timeout=self._espera)
+
+                lote = []
+                qtd_itens = 0
+
+                while self._pendentes and (not lote or qtd_itens + len(self._pendentes[0][0]) <= self._max_itens):
+                    features, fut = self._pendentes.pop(0)
+                    lote.append((features, fut))
+                    qtd_itens += len(features)
+
+                self._itens_pendentes -= qtd_itens
+
+            self._processar(lote, qtd_itens)
+
+    def _processar(self, lote: list, qtd_itens: int):
+        self.stats['lotes'] += 1
+        self.stats['jobs'] += len(lote)
+        self.stats['itens'] += qtd_itens
+        retorno = None
+
+        if len(lote) > 1:
+            dataset = [item for features, _ in lote for item in features]
+
+            try:
+                retorno = chamar_modelo(self._model_name, "predict", modelo=self.modelo, dataset=dataset)
+            except BaseException as e:
+                LOGGER.error(f"O 'predict' do lote de {len(lote)} jobs do modelo '{self._model_name}' falhou. Os jobs "
+                             f"serão processados individualmente: {e.__class__} - {e}")
+
+            del dataset
+
+        if type(retorno) is list and len(retorno) == qtd_itens:
+            inicio = 0
+
+            for features, fut in lote:
+                fut.set_result(retorno[inicio:inicio + len(features)])
+                inicio += len(features)
+            return
+
+        # Processa individualmente (lote de um job só, falha no lote ou retorno que não pode ser dividido)
+        if len(lote) > 1:
+            self.stats['lotes_individuais'] += 1
+
+        for features, fut in lote:
+            try:
+                fut.set_result(chamar_modelo(self._model_name, "predict", modelo=self.modelo, dataset=features))
+            except BaseException as e:
+                fut.set_exception(e)
+
+
+def executar_predict(model_name: str, features, modelo=None):
+    """
+    Executa o 'predict' de um job, utilizando o micro-lote do modelo quando ele estiver habilitado.
+        :param model_name: Nome do modelo.
+        :param features: Features do job.
+        :param modelo: Instância do modelo obtida no início do job.
+        :return: Retorno do método 'predict' do modelo.
+    """
+    micro_lote = MICRO_LOTES.get(model_name)
+
+    # O job iniciado antes de uma recarga a quente não entra no micro-lote da versão nova
+    if micro_lote is None or type(features) is not list or not features or \
+            (modelo is not None and micro_lote.modelo is not None and micro_lote.modelo is not modelo):
+        return chamar_modelo(model_name, "predict", modelo=modelo, dataset=features)
+
+    return micro_lote.predict(features)
+
+
+class PoolExecucao:
+    """
+    Pool limitado de threads para processamento dos jobs, com métricas de saturação. As tarefas concluídas não são
+    guardadas, assim a memória utilizada não cresce com a quantidade de jobs processados.
+    """
+    def __init__(self, tamanho: int, intervalo_metricas: float = 60.0, nome: str = "predict"):
+        """
+        :param tamanho: Quantidade máxima de jobs processados em paralelo.
+        :param intervalo_metricas: Intervalo, em segundos, entre os registros das métricas no log. Se for 0, as métricas
+                                   não são registradas.
+        :param nome: Nome do pool nos logs ('predict' para a fila principal ou 'batch' para a fila separada).
+        """
+        self.tamanho = tamanho
+        self.nome = nome
+        self._executor = ThreadPoolExecutor(max_workers=tamanho, thread_name_prefix=f"worker_job_{nome}")
+        self._intervalo_metricas = intervalo_metricas
+        self._lock = threading.Lock()
+
+        self._aguardando = 0  # Jobs recebidos que aguardam uma thread livre
+        self._em_execucao = 0
+        self._pico_aguardando = 0  # Maior quantidade de jobs aguardando desde o último registro das métricas
+        self._tempo_ocupado = 0.0  # Soma dos tempos de processamento desde o último registro das métricas
+        self._ultimo_registro = time()
+        self.stats = {'recebidos': 0, 'concluidos': 0, 'falhas': 0}
+
+        if intervalo_metricas > 0:
+            threading.Thread(target=self._registrar_metricas, daemon=True).start()
+
+    def submeter(self, funcao, *args):
+        """
+        Agenda a execução de um job no pool.
+            :param funcao: Função que processa o job.
+            :param args: Argumentos da função.
+        """
+        with self._lock:
+            self._aguardando += 1
+            self._pico_aguardando = max(self._pico_aguardando, self._aguardando)
+            self.stats['recebidos'] += 1
+
+        self._executor.submit(self._executar, funcao, *args)
+
+    def _executar(self, funcao, *args):
+        with self._lock:
+            self._aguardando -= 1
+            self._em_execucao += 1
+
+        inicio = time()
+
+        try:
+            funcao(*args)
+        except BaseException as e:
+            with self._lock:
+                self.stats['falhas'] += 1
+
+            LOGGER.error(f"Falha não tratada no processamento de um job: {e.__class__} - {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._em_execucao -= 1
+                self._tempo_ocupado += time() - inicio
+                self.stats['concluidos'] += 1
+
+    def metricas(self) -> dict:
+        """
+        Retorna as métricas de saturação do pool desde a última chamada. A utilização é aproximada, pois considera
+        somente o tempo dos jobs concluídos no período.
+        """
+        with self._lock:
+            agora = time()
+            periodo = max(agora - self._ultimo_registro, 1e-6)
+            ret = dict(self.stats)
+            ret['tamanho'] = self.tamanho
+            ret['em_execucao'] = self._em_execucao
+            ret['aguardando'] = self._aguardando
+            ret['pico_aguardando'] = self._pico_aguardando
+            ret['utilizacao'] = round(min(self._tempo_ocupado / (periodo * self.tamanho), 1.0), 3)
+            self._tempo_ocupado = 0.0
+            self._pico_aguardando = self._aguardando
+            self._ultimo_registro = agora
+            return ret
+
+    def _registrar_metricas(self):
+        recebidos_anterior = 0
+
+        while True:
+            threading.Event().wait(self._intervalo_metricas)
+            metricas = self.metricas()
+
+            # Não enche o log enquanto o worker está ocioso
+            if metricas['recebidos'] != recebidos_anterior or metricas['em_execucao']:
+                LOGGER.info(f"[*] Métricas do pool de execução ({self.nome}): {metricas}")
+
+                # As métricas dos micro-lotes e dos modelos são registradas somente pelo pool da fila principal
+                if self.nome == "predict" and MICRO_LOTES:
+                    LOGGER.info(f"[*] Métricas dos micro-lotes de 'predict': "
+                                f"{ {nome: dict(m.stats) for nome, m in MICRO_LOTES.items()} }")
+
+                if self.nome == "predict" and WORKER_LAZY_MODELS:
+                    LOGGER.info(f"[*] Métricas dos modelos em memória: {MODELOS.resumo()}")
+
+            recebidos_anterior = metricas['recebidos']
+
+    def encerrar(self):
+        """
+        Aguarda a conclusão dos jobs em andamento e encerra o pool.
+        """
+        self._executor.shutdown(wait=True)
+
+
+# Micro-lotes de 'predict' de cada modelo (vazio quando os micro-lotes estão desligados)
+MICRO_LOTES = {}
+
+if PREDICT_BATCH_MAX_ITEMS > 0:
+    MICRO_LOTES = {nome: MicroLote(nome, PREDICT_BATCH_MAX_ITEMS, PREDICT_BATCH_WAIT_MS) for nome in MODELOS}
+    LOGGER.info(f"[*] Micro-lotes de 'predict' habilitados: no máximo {PREDICT_BATCH_MAX_ITEMS} itens por lote, "
+                f"aguardando até {PREDICT_BATCH_WAIT_MS}ms")
+
+
+class EnviadorCallbacks:
+    """
+    Agrupa as chamadas aos endpoints internos da API ('/attstatus' e '/retorno') e as envia em lotes (lista de itens
+    no corpo da requisição), utilizando uma sessão HTTP persistente (keep-alive), assim as conexões TCP são
+    reaproveitadas entre os jobs.
+    """
+    def __init__(self, max_lote: int, intervalo_ms: float, tamanho_pool: int, timeout: float = 30.0):
+        """
+        :param max_lote: Quantidade máxima de itens por requisição. Se for 1, cada item é enviado individualmente (sem
+                         lista), como nas versões anteriores da API.
+        :param intervalo_ms: Tempo máximo, em milissegundos, de espera por outros itens para formar o lote.
+        :param tamanho_pool: Quantidade máxima de conexões mantidas abertas com a API.
+        :param timeout: Tempo máximo, em segundos, de cada requisição. Todos os envios passam por uma única thread, por
+                        isso uma chamada travada na API não pode bloquear os demais jobs indefinidamente.
+        """
+        self.max_lote = max(max_lote, 1)
+        self._intervalo = intervalo_ms / 1000
+        self._timeout = timeout
+        self._sessao = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=tamanho_pool)
+        self._sessao.mount("http://", adaptador)
+        self._sessao.mount("https://", adaptador)
+        self._cond = threading.Condition()
+        self._pendentes = {}  # (url, token) -> lista de tuplas (item serializado, future)
+        self.stats = {'requisicoes': 0, 'itens': 0, 'falhas': 0}
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    def enviar(self, url: str, headers: dict, item: dict) -> Future:
+        """
+        Agenda o envio de um item para um endpoint da API.
+            :param url: URL do endpoint.
+            :param headers: Cabeçalho da requisição (os itens são agrupados pelo token de autorização).
+            :param item: Item que será enviado.
+            :return: 'Future' que será resolvido com a resposta da API referente ao item.
+        """
+        fut = Future()
+
+        # O orjson gera erro (subclasse de TypeError) quando encontra um tipo que não consegue serializar
+        try:
+            corpo = orjson.dumps(item, option=OPCOES_JSON_RETORNO)
+        except TypeError as e:
+            fut.set_exception(e)
+            return fut
+
+        with self._cond:
+            itens = self._pendentes.setdefault((url, headers.get('Authorization')), [])
+            itens.append((corpo, fut))
+
+            # Acorda a thread de envio no primeiro item (inicia a contagem do intervalo) e quando o lote completa
+            if len(itens) == 1 or len(itens) >= self.max_lote:
+                self._cond.notify_all()
+
+        return fut
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pendentes)
+                self._cond.wait_for(lambda: any(len(i) >= self.max_lote for i in self._pendentes.values()),
+                                    timeout=self._intervalo)
+                pendentes = self._pendentes
+                self._pendentes = {}
+
+            for (url, token), itens in pendentes.items():
+                for inicio in range(0, len(itens), self.max_lote):
+                    self._enviar_lote(url, token, itens[inicio:inicio + self.max_lote])
+
+    def _enviar_lote(self, url: str, token: str, itens: list):
+        headers = {'charset': 'utf-8', 'Content-Type': 'application/json', 'Authorization': token}
+
+        try:
+            if self.max_lote == 1:
+                respostas = [self._sessao.post(url, data=itens[0][0], headers=headers, timeout=self._timeout).json()]
+            else:
+                resposta = self._sessao.post(url, data=b"[" + b",".join(corpo for corpo, _ in itens) + b"]",
+                                             headers=headers, timeout=self._timeout).json()
+
+                if type(resposta) is not dict or resposta.get('status') != "Done" or \
+                        type(resposta.get('response')) is not list:
+                    raise ValueError(f"Resposta inesperada da API: {resposta}")
+
+                respostas = resposta['response']
+
+            self.stats['requisicoes'] += 1
+            self.stats['itens'] += len(itens)
+        except BaseException as e:
+            self.stats['falhas'] += 1
+
+            for _, fut in itens:
+                fut.set_exception(e)
+            return
+
+        for (_, fut), resposta in zip(itens, respostas):
+            fut.set_result(resposta)
+
+        # Os itens sem resposta correspondente (a API devolveu menos respostas que itens) falham, para não deixar os
+        # jobs aguardando para sempre
+        for _, fut in itens[len(respostas):]:
+            fut.set_exception(ValueError(f"A API não devolveu a resposta do item ({len(respostas)} resposta(s) para "
+                                         f"{len(itens)} item(ns))"))
+
+
+# Envia as chamadas aos endpoints internos da API (um pool de conexões por worker)
+ENVIADOR_CALLBACKS = EnviadorCallbacks(WORKER_HTTP_BATCH_MAX, WORKER_HTTP_BATCH_MS, WORKER_POOL_SIZE,
+                                       timeout=WORKER_HTTP_TIMEOUT_SECONDS)
+
+
+class RecarregadorModelos:
+    """
+    Recarga a quente dos modelos: verifica periodicamente as versões dos modelos no Model Registry e, quando um modelo
+    tem uma versão nova, carrega a versão nova em segundo plano, faz o aquecimento e troca a instância no 'MODELOS'.
+
+    Os jobs já iniciados guardam a referência da instância antiga e terminam nela. Quando o último deles termina, a
+    instância antiga é liberada da memória. Durante a recarga, as duas versões do modelo ficam em memória (um modelo
+    por vez).
+
+    Se a versão nova não puder ser carregada, a versão antiga continua atendendo e a recarga é tentada novamente na
+    próxima verificação. Se a falha persistir, o health check reinicia o container, como acontecia antes.
+    """
+    def __init__(self, versoes: dict, intervalo: float):
+        """
+        :param versoes: Versões dos modelos (obtidas do Model Registry) carregadas na inicialização do worker.
+        :param intervalo: Intervalo, em segundos, entre as verificações das versões.
+        """
+        self.versoes = dict(versoes)
+        self._intervalo = intervalo
+        self._amostras = {}  # nome do modelo -> features de um job atendido, utilizadas no aquecimento
+        self.stats = {'verificacoes': 0, 'recargas': 0, 'falhas': 0}
+
+    def iniciar(self):
+        """
+        Inicia a thread de verificação das versões dos modelos.
+        """
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    def guardar_amostra(self, model_name: str, features: list):
+        """
+        Guarda o primeiro item das features de um job, caso o modelo ainda não tenha uma amostra.
+        """
+        if features and model_name not in self._amostras:
+            self._amostras[model_name] = features[:1]
+
+    def _executar(self):
+        while True:
+            threading.Event().wait(self._intervalo)
+
+            try:
+                self.verificar()
+            except BaseException as e:
+                self.stats['falhas'] += 1
+                LOGGER.error(f"Falha na verificação das versões dos modelos para a recarga a quente: "
+                             f"{e.__class__} - {e}", exc_info=True)
+
+    def verificar(self):
+        """
+        Obtém as versões dos modelos no Model Registry e recarrega os modelos que possuem uma versão nova.
+        """
+        self.stats['verificacoes'] += 1
+        atuais = get_models_versions_providers()
+        carregadas = MODELOS.versoes()
+        recarregados = []
+
+        for model_name, versao in atuais.items():
+            # Os modelos carregados sob demanda podem estar em uma versão mais nova que a da inicialização
+            self.versoes[model_name] = carregadas.get(model_name, self.versoes.get(model_name))
+
+            if model_name not in MODELOS or versao == self.versoes.get(model_name):
+                continue
+
+            if not MODELOS.residente(model_name):
+                # O modelo não está carregado; a versão nova será carregada no próximo job dele
+                self.versoes[model_name] = versao
+                recarregados.append(model_name)
+                continue
+
+            LOGGER.info(f"[*] Nova versão do modelo '{model_name}' no Model Registry ({self.versoes.get(model_name)} "
+                        f"-> {versao}). Iniciando a recarga a quente...")
+
+            try:
+                self._recarregar(model_name, versao)
+            except BaseException as e:
+                self.stats['falhas'] += 1
+                LOGGER.error(f"Não foi possível recarregar o modelo '{model_name}'. A versão anterior continua "
+                             f"atendendo aos jobs: {e.__class__} - {e}", exc_info=True)
+                continue
+
+            self.versoes[model_name] = versao
+            recarregados.append(model_name)
+
+        if recarregados:
+            gravar_versoes_health_check(MODELOS.versoes())
+            self._avisar_api()
+
+    def _recarregar(self, model_name: str, versao):
+        inicio = time()
+        novo, tamanho = MODELOS.instanciar(model_name)
+
+        # Aquecimento: valida a versão e executa 'predicts' com as amostras, antes de receber os jobs
+        versao_usuario = novo.get_model_version()
+
+        if type(versao_usuario) is not str:
+            raise TypeError(f"O tipo de retorno do método 'get_model_version' está incorreto. Deve ser 'str', mas "
+                            f"retornou '{type(versao_usuario).__name__}'")
+
+        amostras = carregar_amostras_aquecimento(model_name)
+
+        if not amostras and model_name in self._amostras:
+            amostras = [self._amostras[model_name]]
+
+        if amostras:
+            LOGGER.info(f"[*] Aquecimento da nova versão do modelo '{model_name}': "
+                        f"{aquecer_modelo(model_name, amostras, novo)}")
+
+        # A troca é atômica: os jobs seguintes já obtêm a instância nova
+        MODELOS.trocar(model_name, novo, tamanho, versao)
+        micro_lote_antigo = MICRO_LOTES.get(model_name)
+
+        if micro_lote_antigo is not None:
+            MICRO_LOTES[model_name] = MicroLote(model_name, PREDICT_BATCH_MAX_ITEMS, PREDICT_BATCH_WAIT_MS, novo)
+            micro_lote_antigo.encerrar()
+
+        self.stats['recargas'] += 1
+        LOGGER.info(f"[*] Modelo '{model_name}' recarregado a quente em {time() - inicio:.1f}s. Versão definida pelo "
+                    f"usuário: {versao_usuario}")
+
+    @staticmethod
+    def _avisar_api():
+        # A API invalida os resultados guardados no cache para os modelos com versão nova
+        dados = {'advworkid_cred': ADVWORKID_CRED, 'worker_id': WORKER_ID, 'models': list(MODELOS.keys()),
+                 'models_versions': {nome: modelo.get_model_version() for nome, modelo in
+                                     MODELOS.residentes().items()},
+                 'wire_formats': formatos_disponiveis(), 'capabilities': capacidades_worker()}
+
+        try:
+            resposta = requests.post(f"{API_URL}/advworkid", data=orjson.dumps(dados),
+                                     headers={'charset': 'utf-8', 'Content-Type': 'application/json'}).json()
+
+            if resposta['status'] != "Done":
+                LOGGER.error(f"Não foi possível informar as versões novas dos modelos para a API: {resposta}")
+        except BaseException as e:
+            LOGGER.error(f"Não foi possível informar as versões novas dos modelos para a API: {e.__class__} - {e}")
+
+
+# Recarga a quente dos modelos (criada na inicialização do worker, se estiver habilitada)
+RECARREGADOR_MODELOS = None
+
+
 def ack_message(ch, delivery_tag):
     """
     Reconhece (ack) uma mensagem recebida pela função 'do_work'.
@@ -107,18 +1233,229 @@ def ack_message(ch, delivery_tag):
         ch.basic_ack(delivery_tag)
 
 
-def do_work(ch, delivery_tag, body):
+def responder_job(ch, reply_to, correlation_id, body):
+    """
+    Publica o resultado de um job diretamente na fila de respostas da instância da API que está aguardando por ele
+    (modo síncrono do endpoint '/inference').
+        :param ch: Canal pika.
+        :param reply_to: Fila de respostas informada na mensagem do job.
+        :param correlation_id: Identificador da resposta (job_id).
+        :param body: Corpo da resposta.
+    """
+    # Assim como no ack, a publicação deve ser feita na thread da conexão
+    if ch.is_open:
+        ch.basic_publish(exchange="", routing_key=reply_to, body=body,
+                         properties=pika.BasicProperties(correlation_id=correlation_id,
+                                                         content_type="application/json"))
+
+
+def canal_resultados(ch):
+    """
+    Retorna o canal de publicação dos resultados, reabrindo-o caso tenha sido fechado. Deve ser chamada na thread da
+    conexão.
+        :param ch: Canal pika de consumo (utilizado para obter a conexão).
+        :return: Canal em modo 'publisher confirms'.
+    """
+    global CANAL_RESULTADOS
+
+    if CANAL_RESULTADOS is None or not CANAL_RESULTADOS.is_open:
+        CANAL_RESULTADOS = ch.connection.channel()
+        CANAL_RESULTADOS.confirm_delivery()
+
+    return CANAL_RESULTADOS
+
+
+def publicar_resultado(ch, mensagem: dict, aguardar: bool = True):
+    """
+    Publica uma mudança de status ou o retorno de um job na fila de resultados. A publicação é feita na thread da
+    conexão, antes do ack da mensagem do job (as callbacks são executadas na ordem em que foram agendadas). O canal de
+    publicação trabalha em modo 'publisher confirms' e a mensagem é publicada com a flag 'mandatory', assim a
+    publicação só é considerada concluída depois que o servidor de filas confirma que guardou o resultado. Se o servidor
+    recusar (NACK) ou devolver a mensagem (fila de resultados ausente), a publicação falha e o retorno é enviado pelo
+    endpoint da API.
+        :param ch: Canal pika.
+        :param mensagem: Mensagem que será publicada.
+        :param aguardar: Indica se deve aguardar a publicação. Lança uma exceção caso a publicação falhe.
+    """
+    body = orjson.dumps(mensagem, option=OPCOES_JSON_RETORNO)
+    properties = pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent, content_type="application/json")
+    fut = Future()
+
+    def publicar():
+        try:
+            canal_resultados(ch).basic_publish(exchange=EXCHANGE_RESULTADOS, routing_key=FILA_RESULTADOS, body=body,
+                                               properties=properties, mandatory=True)
+            fut.set_result(True)
+        except BaseException as e:
+            fut.set_exception(e)
+
+    ch.connection.add_callback_threadsafe(publicar)
+
+    if aguardar:
+        fut.result(timeout=30)
+
+
+def ler_payload(job: dict) -> dict:
+    """
+    Substitui a mensagem de um job enviado por referência ('claim_check') pelo job completo, lido do armazenamento de
+    payloads. As mensagens sem referência são retornadas sem alteração.
+        :param job: Mensagem recebida da fila.
+        :return: Job completo.
+    """
+    referencia = job.get('claim_check')
+
+    if not referencia:
+        return job
+
+    if ARMAZEM_PAYLOADS is None:
+        raise RuntimeError(f"O job {job.get('job_id')} foi enviado por referência ('{referencia}'), mas o "
+                           f"armazenamento de payloads não está configurado no worker ('CLAIM_CHECK_BACKEND')")
+
+    completo = decodificar(ARMAZEM_PAYLOADS.ler(referencia), job.get('claim_check_content_type'),
+                           job.get('claim_check_content_encoding'))
+    completo['claim_check'] = referencia  # Para remover o payload depois que o job for processado
+    return completo
+
+
+def descartar_payload(job: dict):
+    """
+    Remove do armazenamento o payload de um job enviado por referência, depois que o job foi processado.
+    """
+    if job.get('claim_check') and ARMAZEM_PAYLOADS is not None:
+        try:
+            ARMAZEM_PAYLOADS.remover(job['claim_check'])
+        except BaseException as e:
+            # O payload será removido pela limpeza periódica da API
+            LOGGER.error(f"Não foi possível remover o payload do job {job.get('job_id')} ('{job['claim_check']}'): "
+                         f"{e.__class__} - {e}")
+
+
+def decodificar_labels(labels_codificados: dict) -> tuple:
+    """
+    Decodifica os labels do 'get_feedback' enviados pela API: vocabulário e arrays de códigos (posições no vocabulário)
+    serializados em base64. Com a chave 'counts' (formato de matriz de confusão), cada posição de 'y_pred' e 'y_true' é
+    um par distinto e 'counts' tem a quantidade de cada par; os códigos são repetidos de acordo com as quantidades.
+        :param labels_codificados: Dicionário com as chaves 'vocabulary', 'dtype', 'y_pred', 'y_true' e, opcionalmente,
+                                   'counts'.
+        :return: Tupla contendo: códigos dos labels preditos, códigos dos labels do feedback (arrays NumPy) e
+                 vocabulário.
+    """
+    dtype = labels_codificados['dtype']
+
+    if dtype not in ("uint8", "uint16", "uint32"):
+        raise ValueError(f"Tipo dos códigos dos labels inválido: '{dtype}'")
+
+    vocabulario = labels_codificados['vocabulary']
+    y_pred = np.frombuffer(base64.b64decode(labels_codificados['y_pred']), dtype=dtype)
+    y_true = np.frombuffer(base64.b64decode(labels_codificados['y_true']), dtype=dtype)
+
+    if len(y_pred) != len(y_true) or (len(y_pred) and max(y_pred.max(), y_true.max()) >= len(vocabulario)):
+        raise ValueError("Os códigos dos labels não correspondem ao vocabulário")
+
+    if 'counts' in labels_codificados:
+        quantidades = np.frombuffer(base64.b64decode(labels_codificados['counts']), dtype=np.uint32)
+
+        if len(quantidades) != len(y_pred):
+            raise ValueError("As quantidades dos pares de labels não correspondem aos códigos")
+
+        y_pred = np.repeat(y_pred, quantidades)
+        y_true = np.repeat(y_true, quantidades)
+
+    return y_pred, y_true, vocabulario
+
+
+def argumentos_feedback(modelo, y_pred, y_true, vocabulario) -> dict:
+    """
+    Monta os argumentos do método 'get_feedback' de um modelo. Os modelos que declaram o atributo
+    'accepts_encoded_labels = True' recebem os labels codificados (arrays de códigos em 'y_pred' e 'y_true' e o
+    vocabulário em 'labels'), o que permite calcular as métricas de forma vetorizada. Os demais recebem as listas de
+    labels, como antes.
+        :param modelo: Instância do modelo.
+        :param y_pred: Labels preditos (lista) ou os seus códigos (array).
+        :param y_true: Labels do feedback (lista) ou os seus códigos (array).
+        :param vocabulario: Vocabulário dos códigos, ou None quando os labels vieram em listas.
+        :return: Argumentos do método 'get_feedback'.
+    """
+    if vocabulario is None:
+        return {'y_pred': y_pred, 'y_true': y_true}
+
+    if getattr(modelo, "accepts_encoded_labels", False):
+        return {'y_pred': y_pred, 'y_true': y_true, 'labels': vocabulario}
+
+    labels = np.empty(len(vocabulario), dtype=object)
+    labels[:] = vocabulario
+    return {'y_pred': labels[y_pred].tolist(), 'y_true': labels[y_true].tolist()}
+
+
+def retornar_mensagem_invalida(ch, properties, msg: str):
+    """
+    Retorna erro, pela fila de resultados, para um job cuja mensagem não pôde ser decodificada. Utiliza o job ID e os
+    campos do retorno que a API coloca nas propriedades AMQP da mensagem ('message_id' e 'headers').
+        :param ch: Canal pika.
+        :param properties: Propriedades AMQP da mensagem recebida.
+        :param msg: Mensagem de erro retornada para o job.
+    """
+    job_id = getattr(properties, 'message_id', None)
+    cabecalhos = getattr(properties, 'headers', None) or {}
+
+    if not job_id or 'datetime' not in cabecalhos or not WORKER_RESULTS_VIA_QUEUE:
+        LOGGER.error("Não foi possível retornar o erro do job: a mensagem não informa o job ID e o timestamp de "
+                     "criação do job ou a fila de resultados está desligada ('WORKER_RESULTS_VIA_QUEUE')")
+        return
+
+    try:
+        datetime_job = float(cabecalhos['datetime'])
+        publicar_resultado(ch, {'tipo': "retorno", 'job_id': job_id, 'status': "Error", 'response': msg,
+                                'queue_response_time_sec': time() - datetime_job, 'model_version': "",
+                                'model_name': cabecalhos.get('model_name'), 'method': cabecalhos.get('method'),
+                                'datetime': datetime_job})
+    except BaseException as e:
+        LOGGER.error(f"Não foi possível publicar o erro do job {job_id} na fila de resultados: {e.__class__} - {e}")
+
+
+def do_work(ch, delivery_tag, body, properties=None):
     """
     Processa os jobs recebidos da fila.
         :param ch: Canal pika.
         :param delivery_tag: Tag referente à mensagem recebida.
         :param body: Corpo da mensagem recebida.
+        :param properties: Propriedades AMQP da mensagem recebida.
     """
+    # O formato do corpo é informado nas propriedades AMQP ('content_type' e 'content_encoding'). As mensagens sem essas
+    # propriedades são JSON (versões anteriores da API). Uma mensagem em formato desconhecido nunca poderá ser
+    # processada por este worker, por isso o job retorna erro e a mensagem é descartada
+    content_type = getattr(properties, 'content_type', None)
+    content_encoding = getattr(properties, 'content_encoding', None)
+
+    try:
+        job = decodificar(body, content_type, content_encoding)
+    except BaseException as e:
+        LOGGER.error(f"Mensagem descartada. Não foi possível decodificar o job ('content_type'={content_type}, "
+                     f"'content_encoding'={content_encoding}): {e.__class__} - {e}")
+        retornar_mensagem_invalida(ch, properties, f"O worker não conseguiu decodificar a mensagem do job "
+                                                   f"('content_type'={content_type}, "
+                                                   f"'content_encoding'={content_encoding})")
+        ch.connection.add_callback_threadsafe(functools.partial(ack_message, ch, delivery_tag))
+        return
+
+    # Os jobs grandes chegam só com a referência do payload, que é lido do armazenamento. Se a leitura falhar, o job
+    # retorna erro informando a falha na leitura do payload
+    erro_payload = None
+
+    try:
+        job = ler_payload(job)
+    except BaseException as e:
+        LOGGER.error(f"Não foi possível ler o payload do job {job.get('job_id')} ('{job.get('claim_check')}'): "
+                     f"{e.__class__} - {e}")
+        erro_payload = f"Não foi possível ler o payload do job, enviado por referência ('claim_check'), do " \
+                       f"armazenamento de payloads do worker"
+
     # OBS.: utilizando o weakref para deixar a função mais robusta, pois a depender do modelo, podem vir dados pesados.
     # Portanto, tenta-se garantir com o weakref que não haja objetos grandes ocupando a memória desnecessariamente
-    json_data_obj = WeakObj(json.loads(body))
+    json_data_obj = WeakObj(job)
     json_data_wref = weakref.ref(json_data_obj)
     json_data = json_data_wref()
+    del job
 
     # Apura o tempo que o job ficou em fila aguardando pelo worker
     if json_data.get_obj()['method'] != "get_feedback":
@@ -138,12 +1475,16 @@ def do_work(ch, delivery_tag, body):
     job_id = "n/a"
     model_name = ""
     metodo = ""
+    vocabulario = None  # Vocabulário dos labels codificados do 'get_feedback'
 
     try:
         job_id = json_data.get_obj()['job_id']
         model_name = json_data.get_obj()['model_name']
         metodo = json_data.get_obj()['method']
 
+        if erro_payload is not None:
+            raise RuntimeError(erro_payload)
+
         if metodo not in ["get_feedback", "info"]:
             features_obj = WeakObj(json_data.get_obj()['features'])
             features_wref = weakref.ref(features_obj)
@@ -155,11 +1496,19 @@ def do_work(ch, delivery_tag, body):
             targets = targets_wref()
 
         if metodo == "get_feedback":
-            y_pred_obj = WeakObj(json_data.get_obj()['y_pred'])
+            # Os labels vêm codificados ou, das versões anteriores da API, em listas
+            if 'encoded_labels' in json_data.get_obj():
+                codigos_pred, codigos_true, vocabulario = decodificar_labels(json_data.get_obj()['encoded_labels'])
+                y_pred_obj = WeakObj(codigos_pred)
+                y_true_obj = WeakObj(codigos_true)
+                del codigos_pred, codigos_true
+            else:
+                y_pred_obj = WeakObj(json_data.get_obj()['y_pred'])
+                y_true_obj = WeakObj(json_data.get_obj()['y_true'])
+
             y_pred_wref = weakref.ref(y_pred_obj)
             y_pred = y_pred_wref()
 
-            y_true_obj = WeakObj(json_data.get_obj()['y_true'])
             y_true_wref = weakref.ref(y_true_obj)
             y_true = y_true_wref()
 
@@ -171,12 +1520,37 @@ def do_work(ch, delivery_tag, body):
         retorno_wref = weakref.ref(retorno_obj)
         retorno = retorno_wref()
         LOGGER.error(f"{retorno.get_obj()}")
+    except RuntimeError as e:
+        retorno_obj = WeakObj({'job_id': job_id, 'status': "Error", 'response': f"{e}",
+                               'queue_response_time_sec': queue_response_time_sec})
+        retorno_wref = weakref.ref(retorno_obj)
+        retorno = retorno_wref()
+        LOGGER.error(f"{retorno.get_obj()}")
+    except ValueError as e:
+        retorno_obj = WeakObj({'job_id': job_id, 'status': "Error",
+                               'response': f"Os labels codificados do feedback são inválidos: {e}",
+                               'queue_response_time_sec': queue_response_time_sec})
+        retorno_wref = weakref.ref(retorno_obj)
+        retorno = retorno_wref()
+        LOGGER.error(f"{retorno.get_obj()}")
+
+    # A fila de resultados só é utilizada se o job tiver o timestamp de criação (utilizado pela API no tempo total)
+    via_fila = WORKER_RESULTS_VIA_QUEUE and valores_ok and 'datetime' in json_data.get_obj()
 
-    if valores_ok:
+    if via_fila:
+        # Avisa que o job está em execução sem aguardar. Se o job terminar rápido, a API nem grava o 'Running'
+        try:
+            publicar_resultado(ch, {'tipo': "status", 'job_id': job_id, 'newstatus': "Running"}, aguardar=False)
+            post_status_ok = True
+        except BaseException as e:
+            LOGGER.error(f"Não foi possível publicar o status 'Running' do job {job_id}: {e.__class__} - {e}")
+            via_fila = False
+
+    if valores_ok and not post_status_ok:
         # Fazendo call para API para atualizar o status para 'Running'
         try:
-            r = requests.post(url_status, json={'job_id': job_id, 'newstatus': 'Running'}, headers=headers)
-            resposta = r.json()
+            item_status = {'job_id': job_id, 'newstatus': 'Running'}
+            resposta = ENVIADOR_CALLBACKS.enviar(url_status, headers, item_status).result()
 
             if resposta['status'] == "Done":
                 post_status_ok = True
@@ -202,12 +1576,18 @@ def do_work(ch, delivery_tag, body):
             # Se foi passado o nome do modelo corretamente, escolhe o modelo para atender à requisição
             if model_name in MODELOS:
                 tipo_retorno_ok = True
-                modelo = MODELOS[model_name]
 
                 # Previne que exceções vindas dos modelos derrubem o worker; e manda a mensagem de erro para o cliente
                 try:
+                    modelo = MODELOS[model_name]  # Carrega o modelo, caso ainda não esteja em memória
+
                     if metodo == "predict":
-                        retorno_modelo_obj = WeakObj(modelo.predict(dataset=features.get_obj()))
+                        retorno_modelo_obj = WeakObj(executar_predict(model_name, features.get_obj(), modelo))
+
+                        # Guarda uma amostra das features para o aquecimento das versões novas do modelo
+                        if RECARREGADOR_MODELOS is not None and type(features.get_obj()) is list:
+                            RECARREGADOR_MODELOS.guardar_amostra(model_name, features.get_obj())
+
                         del features
                         retorno_modelo_wref = weakref.ref(retorno_modelo_obj)
                         retorno_modelo = retorno_modelo_wref()
@@ -219,8 +1599,9 @@ def do_work(ch, delivery_tag, body):
                             retorno_modelo = f"O tipo de retorno do método 'predict' está incorreto. Deve ser " \
                                              f"'list' ou 'str', mas retornou '{tipo_retorno.__name__}'"
                     elif metodo == "evaluate":
-                        retorno_modelo_obj = WeakObj(modelo.evaluate(data_features=features.get_obj(),
-                                                                     data_targets=targets.get_obj()))
+                        retorno_modelo_obj = WeakObj(chamar_modelo(model_name, "evaluate", modelo=modelo,
+                                                                   data_features=features.get_obj(),
+                                                                   data_targets=targets.get_obj()))
                         del features, targets
                         retorno_modelo_wref = weakref.ref(retorno_modelo_obj)
                         retorno_modelo = retorno_modelo_wref()
@@ -233,8 +1614,10 @@ def do_work(ch, delivery_tag, body):
                                              f"'dict' ou 'str', mas retornou '{tipo_retorno.__name__}'"
                     elif metodo == "get_feedback":
                         # Esse retorno é temporário porque depois ele será colocado como valor da chave 'model_metrics'
-                        retorno_modelo_temp_obj = WeakObj(modelo.get_feedback(y_pred=y_pred.get_obj(),
-                                                                              y_true=y_true.get_obj()))
+                        retorno_modelo_temp_obj = WeakObj(chamar_modelo(model_name, "get_feedback", modelo=modelo,
+                                                                        **argumentos_feedback(modelo, y_pred.get_obj(),
+                                                                                              y_true.get_obj(),
+                                                                                              vocabulario)))
                         del y_pred, y_true
                         retorno_modelo_temp_wref = weakref.ref(retorno_modelo_temp_obj)
                         retorno_modelo_temp = retorno_modelo_temp_wref()
@@ -256,7 +1639,7 @@ def do_work(ch, delivery_tag, body):
                                              f"'dict' ou 'str', mas retornou '{tipo_retorno.__name__}'"
                         del retorno_modelo_temp
                     elif metodo == "info":
-                        retorno_modelo_obj = WeakObj(modelo.get_model_info())
+                        retorno_modelo_obj = WeakObj(chamar_modelo(model_name, "get_model_info", modelo=modelo))
                         retorno_modelo_wref = weakref.ref(retorno_modelo_obj)
                         retorno_modelo = retorno_modelo_wref()
                         tipo_retorno = type(retorno_modelo.get_obj())
@@ -321,19 +1704,44 @@ def do_work(ch, delivery_tag, body):
                 retorno = retorno_wref()
                 LOGGER.error(f"{retorno.get_obj()}")
 
+    # Modo síncrono: entrega o resultado direto para a API, sem esperar pelo '/retorno'. O '/retorno' continua sendo
+    # feito para que o job seja registrado no banco de dados
+    if properties is not None and properties.reply_to:
+        try:
+            body_resposta = orjson.dumps(retorno.get_obj(), default=str, option=OPCOES_JSON_RETORNO)
+            cb_resposta = functools.partial(responder_job, ch, properties.reply_to, job_id, body_resposta)
+            ch.connection.add_callback_threadsafe(cb_resposta)
+        except BaseException as e:
+            LOGGER.error(f"Não foi possível enviar a resposta direta do job {job_id}: {e.__class__} - {e}")
+
+    if via_fila:
+        try:
+            publicar_resultado(ch, dict(retorno.get_obj(), tipo="retorno", model_name=model_name, method=metodo,
+                                        datetime=json_data.get_obj()['datetime']))
+            descartar_payload(json_data.get_obj())
+            del json_data, retorno
+
+            cb = functools.partial(ack_message, ch, delivery_tag)
+            ch.connection.add_callback_threadsafe(cb)
+            return
+        except BaseException as e:
+            LOGGER.error(f"Não foi possível publicar o retorno do job {job_id} na fila de resultados. O retorno será "
+                         f"enviado pelo endpoint '/retorno': {e.__class__} - {e}")
+
     try:
-        r = requests.post(url_retorno, json=retorno.get_obj(), headers=headers)
-        resposta = r.json()
+        resposta = ENVIADOR_CALLBACKS.enviar(url_retorno, headers, retorno.get_obj()).result()
 
         if resposta['status'] != "Done":
             LOGGER.error(f"{resposta}")
     except BaseException as e:
         LOGGER.error(f"Não foi possível retornar a resposta para a API ao processar o job {job_id}: "
                      f"{e.__class__} - {e}", exc_info=True)
-        if e.__class__ is TypeError:
+        if isinstance(e, TypeError):
             LOGGER.info(f"----> DUMPS do JSON do retorno para verificar a(s) chave(s) com problema (observe os "
-                        f"caracteres de escape e aspas): \n{repr(dumps(retorno.get_obj(), default=str))}")
+                        f"caracteres de escape e aspas): "
+                        f"\n{repr(orjson.dumps(retorno.get_obj(), default=str, option=OPCOES_JSON_RETORNO).decode())}")
 
+    descartar_payload(json_data.get_obj())
     del json_data, retorno
 
     # Solicita o reconhecimento (ack) da mensagem recebida
@@ -341,15 +1749,12 @@ def do_work(ch, delivery_tag, body):
     ch.connection.add_callback_threadsafe(cb)
 
 
-def on_message(ch, method_frame, _header_frame, body, args):
+def on_message(ch, method_frame, header_frame, body, args):
     """
     Função principal de callback.
     """
-    thrds = args
-    delivery_tag = method_frame.delivery_tag
-    t = threading.Thread(target=do_work, args=(ch, delivery_tag, body))
-    t.start()
-    thrds.append(t)
+    pool = args
+    pool.submeter(do_work, ch, method_frame.delivery_tag, body, header_frame)
 
 
 if __name__ == "__main__":
@@ -358,7 +1763,7 @@ if __name__ == "__main__":
     # Guarda a versão, definida pelo usuário, de cada modelo para auxiliar na verificação dos modelos que estão sendo utilizados pelo worker
     models_ver_usuario = {}
 
-    for nome_modelo, modelo in MODELOS.items():
+    for nome_modelo, modelo in MODELOS.residentes().items():
         models_ver_usuario[nome_modelo] = modelo.get_model_version()
 
     LOGGER.info(f"[*] Versões dos modelos definidas pelo usuário: {models_ver_usuario}")
@@ -377,25 +1782,53 @@ if __name__ == "__main__":
     
     LOGGER.info(f"[*] Versões dos modelos obtidas do Model Registry (serão utilizadas no health check do Worker): {models_ver}")
 
-    # Obtém um modelo qualquer para utilizar o método 'convert_artifact_to_pickle' para auxiliar na persistência
-    modelo_aux = MODELOS[list(MODELOS.keys())[0]]
-
-    modelo_aux.convert_artifact_to_pickle(model_name="", artifact=models_ver, file_name="MR-models_versions.pkl", path="/tmp")
+    # Só os modelos carregados são verificados pelo health check: no carregamento sob demanda, os demais são carregados
+    # na versão mais atual quando chegar um job deles
+    MODELOS.registrar_versoes(models_ver)
+    gravar_versoes_health_check(MODELOS.versoes())
     LOGGER.info("[*] Arquivo de versões dos modelos, para realizar o health check do Worker, gerado com sucesso no caminho "
                 "'/tmp/MR-models_versions.pkl'")
 
-    del models_ver_usuario, models_ver, modelo_aux
+    if WORKER_MODEL_RELOAD_SECONDS > 0:
+        RECARREGADOR_MODELOS = RecarregadorModelos(models_ver, WORKER_MODEL_RELOAD_SECONDS)
+        LOGGER.info(f"[*] Recarga a quente dos modelos habilitada: verificação das versões a cada "
+                    f"{WORKER_MODEL_RELOAD_SECONDS}s")
+
+    del models_ver_usuario, models_ver
+
+    # Aquecimento: os modelos em memória executam 'predicts' com as amostras antes do worker ser registrado na API e
+    # começar a consumir a fila, assim os primeiros jobs não pagam pelas inicializações tardias dos modelos
+    inicio_aquecimento = time()
+
+    for nome_modelo in MODELOS.residentes():
+        amostras_aquecimento = carregar_amostras_aquecimento(nome_modelo)
+
+        if not amostras_aquecimento:
+            LOGGER.info(f"[*] O modelo '{nome_modelo}' não possui amostras de aquecimento em "
+                        f"'{WORKER_WARMUP_DIR}/{nome_modelo}.json'")
+            continue
+
+        try:
+            LOGGER.info(f"[*] Aquecimento do modelo '{nome_modelo}': "
+                        f"{aquecer_modelo(nome_modelo, amostras_aquecimento)}")
+        except BaseException as e:
+            # O erro também vai acontecer nos jobs e será informado ao cliente; o worker é registrado mesmo assim
+            LOGGER.error(f"Falha no aquecimento do modelo '{nome_modelo}': {e.__class__} - {e}", exc_info=True)
+
+    LOGGER.info(f"[*] Aquecimento dos modelos concluído em {time() - inicio_aquecimento:.1f}s")
 
     # Montando a requisição para informar o 'WORKER_ID' para a API
     url_advworkid = f"{API_URL}/advworkid"
     headers = {'charset': 'utf-8', 'Content-Type': 'application/json'}
-    dados = {'advworkid_cred': ADVWORKID_CRED, 'worker_id': WORKER_ID, 'models': list(MODELOS.keys())}
+    dados = {'advworkid_cred': ADVWORKID_CRED, 'worker_id': WORKER_ID, 'models': list(MODELOS.keys()),
+             'models_versions': {nome: modelo.get_model_version() for nome, modelo in MODELOS.residentes().items()},
+             'wire_formats': formatos_disponiveis(), 'capabilities': capacidades_worker()}
 
     LOGGER.info("[*] Informando o 'WORKER_ID' para a API...")
     resposta = None
 
     try:
-        r = requests.post(url_advworkid, json=dados, headers=headers)
+        r = requests.post(url_advworkid, data=orjson.dumps(dados), headers=headers)
         resposta = r.json()
     except BaseException as e:
         LOGGER.error(f"{e.__class__} - {e}")
@@ -437,24 +1870,66 @@ if __name__ == "__main__":
                 # Faz o bind da fila com o exchange
                 channel.queue_bind(queue=WORKER_ID, exchange="mlapi_exchange", routing_key=WORKER_ID)
 
-                # Note: prefetch is set to 1 here as an example only and to keep the number of threads created
-                # to a reasonable amount. In production, you will want to test with different prefetch values
-                # to find which one provides the best performance and usability for your solution
-                channel.basic_qos(prefetch_count=1)
-
-                threads = []
-                on_message_callback = functools.partial(on_message, args=threads)
+                # Declara a fila separada dos métodos 'evaluate', 'get_feedback' e 'info', consumida em um canal
+                # próprio (com prefetch próprio) na mesma conexão
+                canal_lote = None
+                fila_lote = f"{WORKER_ID}{SUFIXO_FILA_LOTE}"
+
+                if WORKER_METHOD_LANES:
+                    canal_lote = connection.channel()
+                    canal_lote.queue_declare(queue=fila_lote, durable=True, exclusive=False, auto_delete=False,
+                                             arguments=arguments)
+                    canal_lote.queue_bind(queue=fila_lote, exchange="mlapi_exchange", routing_key=fila_lote)
+
+                # Declara a fila de resultados (durável), para não perder os resultados publicados antes da API
+                # iniciar o consumo
+                if WORKER_RESULTS_VIA_QUEUE:
+                    channel.exchange_declare(exchange=EXCHANGE_RESULTADOS, exchange_type=ExchangeType.direct,
+                                             durable=True)
+                    channel.queue_declare(queue=FILA_RESULTADOS, durable=True)
+                    channel.queue_bind(queue=FILA_RESULTADOS, exchange=EXCHANGE_RESULTADOS,
+                                       routing_key=FILA_RESULTADOS)
+                    canal_resultados(channel)
+
+                # O prefetch limita as mensagens entregues e ainda não reconhecidas, que são as que estão no pool
+                # (em execução ou aguardando uma thread livre)
+                channel.basic_qos(prefetch_count=WORKER_PREFETCH)
+
+                pool_execucao = PoolExecucao(WORKER_POOL_SIZE, intervalo_metricas=WORKER_METRICS_SECONDS)
+                pool_lote = None
+
+                if canal_lote is not None:
+                    canal_lote.basic_qos(prefetch_count=WORKER_BATCH_PREFETCH)
+                    pool_lote = PoolExecucao(WORKER_BATCH_POOL_SIZE, intervalo_metricas=WORKER_METRICS_SECONDS,
+                                             nome="batch")
+                    canal_lote.basic_consume(on_message_callback=functools.partial(on_message, args=pool_lote),
+                                             queue=fila_lote)
+                    LOGGER.info(f"[*] Aguardando por mensagens de 'evaluate', 'get_feedback' e 'info'. "
+                                f"FILA={fila_lote}, POOL={WORKER_BATCH_POOL_SIZE}, PREFETCH={WORKER_BATCH_PREFETCH}")
+
+
+                if RECARREGADOR_MODELOS is not None:
+                    RECARREGADOR_MODELOS.iniciar()
+
+                on_message_callback = functools.partial(on_message, args=pool_execucao)
                 channel.basic_consume(on_message_callback=on_message_callback, queue=WORKER_ID)
-                LOGGER.info(f"[*] Aguardando por mensagens. FILA={WORKER_ID} - Para sair pressione CTRL+c")
+                LOGGER.info(f"[*] Aguardando por mensagens. FILA={WORKER_ID}, POOL={WORKER_POOL_SIZE}, "
+                            f"PREFETCH={WORKER_PREFETCH} - Para sair pressione CTRL+c")
 
+                # O laço de consumo da conexão também entrega as mensagens do canal da fila separada
                 try:
                     channel.start_consuming()
                 except KeyboardInterrupt:
                     channel.stop_consuming()
 
-                # Wait for all to complete
-                for thread in threads:
-                    thread.join()
+                    if canal_lote is not None:
+                        canal_lote.stop_consuming()
+
+                # Aguarda a conclusão dos jobs em andamento
+                pool_execucao.encerrar()
+
+                if pool_lote is not None:
+                    pool_lote.encerrar()
 
                 connection.close()
             except BaseException as e: